@@ -0,0 +1,141 @@
+import asyncio
+from heapq import heappush, heappop
+from itertools import count
+from time import monotonic, perf_counter
+import metrics
+
+PRIORITY_HIGH = 0
+PRIORITY_NORMAL = 1
+PRIORITY_LOW = 2
+
+_rest_seconds = {}  # Route kind ('channel', 'member_edit', ...) -> rest_call_seconds histogram
+_rest_failures = {}  # Route kind -> rest_call_failures_total counter
+
+
+def _rest_metric(cache, factory, name, help_text, kind):
+    metric = cache.get(kind)
+    if metric is None:
+        metric = cache[kind] = factory(name, help_text, route=str(kind))
+    return metric
+
+
+class _Route:
+    def __init__(self, interval):
+        self.interval = interval
+        self.heap = []  # (priority, sequence, key)
+        self.pending = {}  # key -> [action, future]
+        self.last_run = 0
+        self.task = None
+
+
+class ActionQueue:
+    """
+    Central queue for outbound Discord actions (role edits, message edits, purges, debug DMs).
+
+    Actions are grouped into routes, one per rate limit bucket (for example a channel or a guild's member edits).
+    Each route runs its actions one at a time, highest priority first, spaced at least `interval` seconds apart.
+    Enqueueing an action under a key that is already pending on the route replaces the pending action, so only the
+    latest state is sent: ten level-ups in a burst become one log message edit.
+
+    Example usage:
+    ```
+    from actionQueue import ActionQueue
+    action_queue = ActionQueue.get_instance()
+    action_queue.enqueue(('channel', channel.id), lambda: message.edit(embed=embed), key='leaderboard')  # no await
+    ```
+    """
+
+    _instance = None
+    ROUTE_INTERVAL = 1.0
+
+    def __init__(self):
+        if ActionQueue._instance is None:
+            self.routes = {}
+            self.sequence = count()
+            ActionQueue._instance = self
+            metrics.gauge('action_queue_pending', 'Actions waiting in the action queue', function=self.pending_count)
+            self.coalesced = metrics.counter('action_queue_coalesced_total', 'Actions replaced by a newer one before they ran')
+        else:
+            raise Exception("You cannot create another ActionQueue class!")  # Enforce singleton instance
+
+    @classmethod
+    def get_instance(cls):
+        # Get the singleton instance, or create it if it doesn't exist
+        if cls._instance is None:
+            cls()
+        return cls._instance
+
+    def enqueue(self, route, action, key=None, priority=PRIORITY_NORMAL, interval=None):
+        """
+        Queue `action`, a callable returning an awaitable, and return immediately.
+
+        Returns a future that resolves to the action's result, or raises the action's exception. Actions coalesced
+        under the same key share one future.
+        """
+        route_state = self.routes.get(route)
+        if route_state is None:
+            route_state = self.routes[route] = _Route(self.ROUTE_INTERVAL if interval is None else interval)
+
+        sequence = next(self.sequence)
+        if key is None:
+            key = ('unique', sequence)
+
+        entry = route_state.pending.get(key)
+        if entry is not None:
+            # Latest state wins, the action keeps its place in the queue unless it now has a higher priority
+            entry[0] = action
+            self.coalesced.inc()
+            if priority < entry[2]:
+                entry[2] = priority
+                heappush(route_state.heap, (priority, sequence, key))
+            future = entry[1]
+        else:
+            future = asyncio.get_running_loop().create_future()
+            route_state.pending[key] = [action, future, priority]
+            heappush(route_state.heap, (priority, sequence, key))
+
+        if route_state.task is None:
+            route_state.task = asyncio.get_running_loop().create_task(self._run_route(route, route_state))
+        return future
+
+    async def _run_route(self, route, route_state):
+        while route_state.heap:
+            _, _, key = heappop(route_state.heap)
+            entry = route_state.pending.get(key)
+            if entry is None:  # Stale heap entry left behind by a priority bump
+                continue
+
+            wait = route_state.last_run + route_state.interval - monotonic()
+            if wait > 0:
+                await asyncio.sleep(wait)
+
+            # Take the action only now, so anything coalesced while waiting is included
+            action, future, _ = route_state.pending.pop(key)
+            result = error = None
+            kind = route[0] if isinstance(route, tuple) else route
+            started = perf_counter()
+            try:
+                result = await action()
+            except Exception as e:
+                _rest_metric(_rest_failures, metrics.counter, 'rest_call_failures_total', 'Queued actions that raised', kind).inc()
+                print(f"Queued action on route {route} failed: {e}")
+                error = e
+            finally:
+                _rest_metric(_rest_seconds, metrics.histogram, 'rest_call_seconds', 'Duration of queued actions', kind).observe(perf_counter() - started)
+                route_state.last_run = monotonic()
+                if not future.done():
+                    if error is None:
+                        future.set_result(result)
+                    else:
+                        future.set_exception(error)
+                        future.exception()  # Already reported above, callers that dropped the future shouldn't warn again
+        route_state.task = None
+
+    def pending_count(self):
+        return sum(len(route_state.pending) for route_state in self.routes.values())
+
+    async def drain(self, timeout=None):
+        # Wait until every queued action has been sent (or the timeout expires)
+        tasks = [route_state.task for route_state in self.routes.values() if route_state.task is not None]
+        if tasks:
+            await asyncio.wait(tasks, timeout=timeout)
@@ -0,0 +1,200 @@
+"""
+Async facade over configManager for use inside coroutines.
+
+Storage reads and writes run on a small thread pool so disk latency never stalls the event loop, while the
+in-memory store itself is only touched from the event loop thread. Operations on a user are serialized per
+(guild, user) so a chat and a voice update for the same user can't overwrite each other.
+
+Example usage:
+```
+import asyncStorage
+async with asyncStorage.user_lock(guild.id, member.id):
+    user_data = await asyncStorage.load_user_data(guild.id, member.id)
+    ...
+    asyncStorage.save_user_data(guild.id, member.id, user_data)
+
+# Or as one atomic operation, the mutator's return value is passed through
+old_level = await asyncStorage.update_user_data(guild.id, member.id, lambda user_data: user_data['level'])
+await asyncStorage.update_guild_data(guild.id, lambda guild_data: guild_data.update(publog=channel.id))
+```
+"""
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from weakref import WeakValueDictionary
+import configManager
+import xpJournal
+import xpHistory
+from debug_logger import DebugLogger
+
+STORAGE_THREADS = 4
+
+_executor = ThreadPoolExecutor(max_workers=STORAGE_THREADS, thread_name_prefix='storage')
+_user_locks = WeakValueDictionary()  # A lock lives as long as someone holds or waits on it
+_guild_locks = WeakValueDictionary()  # Keep a guild's storage writes in order
+_guild_data_locks = WeakValueDictionary()  # Serialize load/mutate/save of a guild's record, see update_guild_data
+_flush_lock = None
+_flush_requested = False
+_journal_lock = None  # Keeps journal appends and rotations in order
+_append_handle = None  # The pending call_later of the next journal append
+_background_tasks = set()  # The event loop only keeps weak references to tasks, these keep them alive until done
+
+save_user_data = configManager.save_user_data  # Only touches memory, safe to call directly
+
+
+async def run_in_storage_thread(function, *args):
+    return await asyncio.get_running_loop().run_in_executor(_executor, function, *args)
+
+def _start_background(coroutine, description):
+    task = asyncio.get_running_loop().create_task(coroutine)
+    _background_tasks.add(task)
+    task.add_done_callback(lambda task: _background_done(task, description))
+    return task
+
+def _background_done(task, description):
+    _background_tasks.discard(task)
+    if not task.cancelled() and task.exception() is not None:
+        DebugLogger.get_instance().log(f"Background {description} failed: {task.exception()!r}")
+
+def _get_lock(locks, key):
+    lock = locks.get(key)
+    if lock is None:
+        lock = asyncio.Lock()
+        locks[key] = lock
+    return lock
+
+def user_lock(guild_id, user_id):
+    return _get_lock(_user_locks, (str(guild_id), str(user_id)))
+
+async def load_user_data(guild_id, user_id):
+    user_data = configManager.get_cached_user_data(guild_id, user_id)
+    if user_data is not None:
+        return user_data
+    loaded = await run_in_storage_thread(configManager.get_storage_backend().load_user, guild_id, user_id)
+    return configManager.cache_user_data(guild_id, user_id, loaded)
+
+async def cache_guild_users(guild_id):
+    if not configManager.is_guild_cached(guild_id):
+        users = await run_in_storage_thread(configManager.get_storage_backend().load_users, guild_id)
+        configManager.cache_guild_users(guild_id, users)
+
+async def load_all_user_data(guild_id):
+    await cache_guild_users(guild_id)
+    return configManager.load_all_user_data(guild_id)
+
+async def get_rank_index(guild_id):
+    # Building a guild's index reads all of its users, make sure that happens off the event loop
+    await cache_guild_users(guild_id)
+    return configManager.get_rank_index(guild_id)
+
+async def get_user_rank(guild_id, user_id):
+    return (await get_rank_index(guild_id)).rank(user_id)
+
+async def update_user_data(guild_id, user_id, mutator):
+    # Load, mutate and save a user's record as one operation, returns whatever mutator(user_data) returns
+    async with user_lock(guild_id, user_id):
+        user_data = await load_user_data(guild_id, user_id)
+        result = mutator(user_data)
+        configManager.save_user_data(guild_id, user_id, user_data)
+        return result
+
+def _get_journal_lock():
+    global _journal_lock
+    if _journal_lock is None:
+        _journal_lock = asyncio.Lock()
+    return _journal_lock
+
+async def flush_user_data():
+    # Write a snapshot of the dirty records and archive the journal segments it covers.
+    # Flushes are serialized so an older snapshot can never be written after a newer one.
+    global _flush_lock
+    if _flush_lock is None:
+        _flush_lock = asyncio.Lock()
+    async with _flush_lock:
+        async with _get_journal_lock():
+            # Taken in the same step, so the rotated segments hold exactly the events these records include
+            lines = xpJournal.take_buffer()
+            records = configManager.take_dirty_user_records()
+            histories = xpHistory.take_snapshots()
+            segments = await run_in_storage_thread(xpJournal.rotate, lines)
+        try:
+            await run_in_storage_thread(configManager.write_user_records, records)
+            await run_in_storage_thread(xpHistory.write_snapshots, histories)
+        except Exception:
+            configManager.restore_dirty_user_records(records)
+            xpHistory.restore_snapshots(histories)
+            raise
+        await run_in_storage_thread(xpJournal.archive, segments)
+        return len(records)
+
+def request_flush():
+    # Flush handler for configManager: start a background flush instead of writing from the caller
+    global _flush_requested
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        configManager.flush_user_data()  # Not inside the event loop, nothing to stall
+        return
+    if not _flush_requested:
+        _flush_requested = True
+        _start_background(_requested_flush(), 'flush')
+
+async def _requested_flush():
+    global _flush_requested
+    try:
+        await flush_user_data()
+    finally:
+        _flush_requested = False
+
+async def append_journal():
+    # Append the buffered journal events in one sequential write
+    async with _get_journal_lock():
+        await run_in_storage_thread(xpJournal.write_lines, xpJournal.take_buffer())
+
+def request_journal_append():
+    # Append handler for xpJournal: batch the events of the next APPEND_INTERVAL seconds into one write, or append
+    # right away once APPEND_BATCH events are waiting
+    global _append_handle
+    try:
+        loop = asyncio.get_running_loop()
+    except RuntimeError:
+        xpJournal.append_buffer()
+        return
+    delay = 0 if xpJournal.pending_count() >= xpJournal.APPEND_BATCH else xpJournal.APPEND_INTERVAL
+    if _append_handle is not None:
+        if _append_handle.when() <= loop.time() + delay:
+            return  # Already due as soon as this one would be
+        _append_handle.cancel()
+    _append_handle = loop.call_later(delay, _start_scheduled_append)
+
+def _start_scheduled_append():
+    global _append_handle
+    _append_handle = None
+    _start_background(append_journal(), 'journal append')
+
+async def load_guild_data(guild_id):
+    data = configManager.get_cached_guild_data(guild_id)
+    if data is not None:
+        return data
+    loaded = await run_in_storage_thread(configManager.get_storage_backend().load_guild, guild_id)
+    data, is_new = configManager.cache_guild_data(guild_id, loaded)
+    if is_new:
+        await save_guild_data(guild_id, data)
+    return data
+
+def guild_lock(guild_id):
+    return _get_lock(_guild_data_locks, str(guild_id))
+
+async def update_guild_data(guild_id, mutator):
+    # Load, mutate and save a guild's record as one operation, returns whatever mutator(guild_data) returns.
+    # Use it instead of holding on to a loaded record across an await, a save in the meantime would be lost.
+    async with guild_lock(guild_id):
+        guild_data = await load_guild_data(guild_id)
+        result = mutator(guild_data)
+        await save_guild_data(guild_id, guild_data)
+        return result
+
+async def save_guild_data(guild_id, data):
+    # The in-memory record is updated right away, the writes for a guild are done in order
+    snapshot = configManager.update_guild_data(guild_id, data)
+    async with _get_lock(_guild_locks, str(guild_id)):
+        await run_in_storage_thread(configManager.get_storage_backend().save_guild, guild_id, snapshot)
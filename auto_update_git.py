@@ -1,75 +1,89 @@
-import subprocess
 import asyncio
-from pathlib import Path
+from time import monotonic
 from debug_logger import DebugLogger
+import asyncStorage
+from actionQueue import ActionQueue
+import metrics
+
+GIT_TIMEOUT = 15  # Seconds a git command may take before it's killed
+BACKOFF_BASE = 30  # Seconds to wait after the first failed check, doubled for every failure after it
+BACKOFF_MAX = 30 * 60
+SLOW_CHECK = 5  # Checks taking longer than this many seconds are logged
 
 initial_run_sha = None
+last_check_duration = None  # Seconds the last remote check took
+_failures = 0
+_next_check_at = 0
+
+metrics.gauge('version_check_seconds', 'Duration of the last version check', function=lambda: last_check_duration or 0)
+metrics.gauge('version_check_failures', 'Version checks failed in a row', function=lambda: _failures)
+
+async def run_git(*args, timeout=GIT_TIMEOUT):
+    # Returns the stripped output of a git command, or None if it failed or timed out
+    process = await asyncio.create_subprocess_exec(
+        'git', *args, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE,
+    )
+    try:
+        output, error = await asyncio.wait_for(process.communicate(), timeout=timeout)
+    except asyncio.TimeoutError:
+        process.kill()
+        await process.wait()
+        print(f'git {args[0]} timed out after {timeout}s')
+        return None
+    if process.returncode != 0:
+        print(f'git {args[0]} failed: {error.decode(errors="replace").strip()}')
+        return None
+    return output.decode().strip()
 
-def set_initial_run_sha():
+async def set_initial_run_sha():
     global initial_run_sha
-    initial_run_sha = get_latest_local_commit_sha()
+    initial_run_sha = await get_latest_local_commit_sha()
     print(f"Initial run sha: {initial_run_sha}")
 
     debug_logger = DebugLogger.get_instance()
     debug_logger.log(f"Initial run sha: {initial_run_sha}")
 
-def get_latest_local_commit_sha():
-    try:
-        commit_sha = subprocess.check_output(['git', 'rev-parse', 'HEAD'], text=True).strip()
-    except subprocess.CalledProcessError as e:
-        print(f'An error occurred while trying to fetch the latest local commit SHA: {str(e)}')
-        return None
-    return commit_sha
+async def get_latest_local_commit_sha():
+    return await run_git('rev-parse', 'HEAD')
 
-def get_latest_remote_commit_sha():
-    try:
-        subprocess.check_output(['git', 'fetch'], text=True)
-        commit_sha = subprocess.check_output(['git', 'rev-parse', 'origin/main'], text=True).strip()
-    except subprocess.CalledProcessError as e:
-        print(f'An error occurred while trying to fetch the latest remote commit SHA: {str(e)}')
+async def get_latest_remote_commit_sha():
+    # ls-remote only asks the remote for the ref, nothing is downloaded
+    output = await run_git('ls-remote', 'origin', 'refs/heads/main')
+    if not output:
         return None
-    return commit_sha
+    return output.split()[0]
 
 async def check_version(bot):
-    global initial_run_sha
-    check_sha = get_latest_remote_commit_sha()
+    global last_check_duration, _failures, _next_check_at
+    if monotonic() < _next_check_at:
+        return  # Backing off after failed checks
+
+    started = monotonic()
+    check_sha = await get_latest_remote_commit_sha()
+    last_check_duration = monotonic() - started
 
-    if check_sha and initial_run_sha != check_sha:
-        debug_logger = DebugLogger.get_instance()
+    debug_logger = DebugLogger.get_instance()
+    if check_sha is None:
+        _failures += 1
+        backoff = min(BACKOFF_BASE * 2 ** (_failures - 1), BACKOFF_MAX)
+        _next_check_at = monotonic() + backoff
+        debug_logger.log(f"Version check failed after {last_check_duration:.2f}s ({_failures} in a row), next check in {backoff}s")
+        return
+    _failures = 0
+    if last_check_duration > SLOW_CHECK:
+        debug_logger.log(f"Version check took {last_check_duration:.2f}s")
+
+    if initial_run_sha and initial_run_sha != check_sha:  # Without a local sha there's nothing to compare against
         debug_logger.log(f"[New Version Detected] 🥳 Initiating the update and restart process... [{initial_run_sha[:7]}] -> [{check_sha[:7]}]")
         try:
+            await asyncStorage.flush_user_data()
+            await ActionQueue.get_instance().drain(timeout=10)  # Let queued role and message edits go out first
             await debug_logger.flush()
             await asyncio.sleep(1)
             await bot.close()
         except:
             pass
 
-def backup_to_github():
-    debug_logger = DebugLogger.get_instance()
-    debug_logger.log("Uploading user data to backup repository...")
-
-    # Relative paths assuming script is run from a specific root directory
-    root_folder = Path.cwd()
-    source_folder = root_folder / "data"
-    dest_folder = root_folder.parent / "TLERepBotData"
-
-    # Using rsync to copy directory to ensure it only copies the changes.
-    command = ["xcopy", str(source_folder) + "\\*", str(dest_folder), "/E", "/Y", "/I", "/D"]
-    debug_logger.log(f"{command}")
-    subprocess.run(command)
-
-    # Delete data/debugconf.yaml in the destination folder
-    debugconf_path = dest_folder / "debugconf.yaml"
-    if debugconf_path.exists():
-        debugconf_path.unlink()
-
-    # Stage, commit, and push changes to GitHub repository
-    subprocess.run(["git", "-C", str(dest_folder), "add", "-A"])
-    subprocess.run(["git", "-C", str(dest_folder), "commit", "-m", "Backup data"])
-    subprocess.run(["git", "-C", str(dest_folder), "push"])
-
-    debug_logger.log("Upload complete.")
-
 
 # Code below uses the GitHub API to check for updates and restart the bot if there is a new version.
 # import requests
@@ -0,0 +1,270 @@
+"""
+Incremental, content-addressed backups of the data/ folder.
+
+Each run compares data/ with the manifest of the last run: files whose size and modification time are unchanged
+reuse the recorded hash, the others are hashed and stored once as objects/<hash[:2]>/<hash>.gz. A snapshot is a
+small JSON file mapping every path to its object, so a snapshot only costs the files that actually changed.
+SQLite databases are copied with the online backup API rather than read byte for byte, so a snapshot never holds a
+half-written database. Old snapshots are pruned (see KEEP_RECENT_SNAPSHOTS and KEEP_DAILY_SNAPSHOTS) and objects
+no snapshot refers to any more are deleted.
+The file work runs on a worker thread. If the backup folder is a git work tree, the new objects and snapshot are
+committed with asyncio subprocesses and pushed when a remote is set up (a local bare repository works as well).
+
+Example usage:
+```
+import backupService
+backupService.start_backup()  # Runs in the background, returns the task (or the one already running)
+```
+
+Or from the command line:
+
+    python backupService.py backup
+    python backupService.py restore <snapshot file> <target folder>
+"""
+import asyncio
+import gzip
+import hashlib
+import json
+import os
+import sqlite3
+import sys
+import time
+from datetime import datetime, timedelta
+from os import makedirs, path
+import _secrets
+
+SOURCE_FOLDER = 'data'
+BACKUP_FOLDER = getattr(_secrets, 'BACKUP_FOLDER', path.join('..', 'TLERepBotData'))
+EXCLUDED_FILES = {'debugconf.yaml', 'metrics.prom'}  # metrics.prom is rewritten every minute and isn't state
+EXCLUDED_FOLDERS = {'profiles'}  # Profiler reports, relative to the source folder
+# Files that only exist during a write (see storageBackends.write_yaml_atomic), and SQLite's WAL and shared memory
+# files, which the database backup already includes
+EXCLUDED_SUFFIXES = ('.tmp', '.bak', '-wal', '-shm', '-journal')
+DATABASE_SUFFIX = '.db'
+KEEP_RECENT_SNAPSHOTS = 48  # The newest snapshots are all kept, two days of hourly backups
+KEEP_DAILY_SNAPSHOTS = 30  # Before those, the newest snapshot of each of the last 30 days is kept
+SNAPSHOT_FORMAT = '%Y-%m-%d_%H-%M-%S'
+GIT_TIMEOUT = 120  # Seconds a git command may take before it's abandoned
+
+_backup_task = None
+
+
+class BackupReport:
+    def __init__(self, snapshot):
+        self.snapshot = snapshot
+        self.files = 0
+        self.changed_files = 0
+        self.bytes_read = 0
+        self.bytes_written = 0
+        self.pruned_snapshots = 0
+        self.removed_objects = 0
+        self.duration = 0
+
+    def __str__(self):
+        return (f"Backup {self.snapshot}: {self.changed_files}/{self.files} files changed, {self.bytes_read:,} bytes read, "
+                f"{self.bytes_written:,} bytes written, {self.pruned_snapshots} old snapshots and {self.removed_objects} "
+                f"unused objects removed in {self.duration:.2f}s")
+
+
+def _object_path(backup_folder, digest):
+    return path.join(backup_folder, 'objects', digest[:2], digest + '.gz')
+
+def _load_manifest(backup_folder):
+    manifest_file = path.join(backup_folder, 'manifest.json')
+    if not path.exists(manifest_file):
+        return {}
+    with open(manifest_file, 'r') as file:
+        return json.load(file)
+
+def _write_json(file_path, data):
+    with open(file_path + '.tmp', 'w') as file:
+        json.dump(data, file, indent=0, sort_keys=True)
+    os.replace(file_path + '.tmp', file_path)
+
+def _read_database(file_path, backup_folder):
+    # A consistent copy of a live SQLite database, including what's still in its WAL
+    copy_path = path.join(backup_folder, 'database.tmp')
+    source = sqlite3.connect(file_path)
+    try:
+        target = sqlite3.connect(copy_path)
+        try:
+            source.backup(target)
+        finally:
+            target.close()
+    finally:
+        source.close()
+    try:
+        with open(copy_path, 'rb') as copy:
+            return copy.read()
+    finally:
+        os.remove(copy_path)
+
+def create_snapshot(source_folder=SOURCE_FOLDER, backup_folder=BACKUP_FOLDER):
+    # Blocking, run it on a worker thread. Returns a BackupReport.
+    started = time.perf_counter()
+    report = BackupReport(datetime.now().strftime(SNAPSHOT_FORMAT))
+    makedirs(backup_folder, exist_ok=True)  # Databases are copied through it, before anything else is written
+    previous = _load_manifest(backup_folder)
+    manifest = {}
+
+    for root, dirs, files in os.walk(source_folder):
+        if path.samefile(root, source_folder):
+            dirs[:] = [folder for folder in dirs if folder not in EXCLUDED_FOLDERS]
+        for file in files:
+            if file in EXCLUDED_FILES or file.endswith(EXCLUDED_SUFFIXES):
+                continue
+            file_path = path.join(root, file)
+            relative_path = path.relpath(file_path, source_folder).replace(os.sep, '/')
+            try:
+                stat = os.stat(file_path)
+            except FileNotFoundError:
+                continue  # Removed while walking
+            report.files += 1
+
+            # A database's own file doesn't change until its WAL is checkpointed, so databases are always copied
+            is_database = file.endswith(DATABASE_SUFFIX)
+            entry = previous.get(relative_path)
+            if not is_database and entry and entry['size'] == stat.st_size and entry['mtime_ns'] == stat.st_mtime_ns:
+                manifest[relative_path] = entry
+                continue
+
+            try:
+                if is_database:
+                    content = _read_database(file_path, backup_folder)
+                else:
+                    with open(file_path, 'rb') as source:
+                        content = source.read()
+            except FileNotFoundError:
+                report.files -= 1
+                continue
+            report.bytes_read += len(content)
+            digest = hashlib.sha256(content).hexdigest()
+            if entry is None or entry['sha256'] != digest:
+                report.changed_files += 1
+            object_file = _object_path(backup_folder, digest)
+            if not path.exists(object_file):
+                makedirs(path.dirname(object_file), exist_ok=True)
+                compressed = gzip.compress(content)
+                with open(object_file + '.tmp', 'wb') as target:
+                    target.write(compressed)
+                os.replace(object_file + '.tmp', object_file)
+                report.bytes_written += len(compressed)
+            manifest[relative_path] = {'sha256': digest, 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+
+    makedirs(path.join(backup_folder, 'snapshots'), exist_ok=True)
+    _write_json(path.join(backup_folder, 'snapshots', report.snapshot + '.json'), {name: entry['sha256'] for name, entry in manifest.items()})
+    _write_json(path.join(backup_folder, 'manifest.json'), manifest)
+    report.pruned_snapshots, report.removed_objects = prune_snapshots(backup_folder)
+    report.duration = time.perf_counter() - started
+    return report
+
+def snapshots_to_keep(names, now):
+    # The snapshot names (timestamps) the retention policy keeps: the KEEP_RECENT_SNAPSHOTS newest, and before
+    # those the newest of each day for KEEP_DAILY_SNAPSHOTS days
+    names = sorted(names, reverse=True)
+    keep = set(names[:KEEP_RECENT_SNAPSHOTS])
+    oldest_day = (now - timedelta(days=KEEP_DAILY_SNAPSHOTS)).date()
+    days = set()
+    for name in names[KEEP_RECENT_SNAPSHOTS:]:
+        day = datetime.strptime(name, SNAPSHOT_FORMAT).date()
+        if day > oldest_day and day not in days:
+            days.add(day)
+            keep.add(name)
+    return keep
+
+def prune_snapshots(backup_folder=BACKUP_FOLDER, now=None):
+    # Delete the snapshots the retention policy drops and the objects only they referred to.
+    # Returns (snapshots removed, objects removed).
+    snapshot_folder = path.join(backup_folder, 'snapshots')
+    names = [file[:-len('.json')] for file in os.listdir(snapshot_folder) if file.endswith('.json')]
+    keep = snapshots_to_keep(names, now or datetime.now())
+    removed_snapshots = 0
+    for name in names:
+        if name not in keep:
+            os.remove(path.join(snapshot_folder, name + '.json'))
+            removed_snapshots += 1
+    if not removed_snapshots:
+        return 0, 0
+
+    referenced = {entry['sha256'] for entry in _load_manifest(backup_folder).values()}
+    for name in keep:
+        with open(path.join(snapshot_folder, name + '.json'), 'r') as file:
+            referenced.update(json.load(file).values())
+    removed_objects = 0
+    for root, dirs, files in os.walk(path.join(backup_folder, 'objects')):
+        for file in files:
+            if file.endswith('.gz') and file[:-len('.gz')] not in referenced:
+                os.remove(path.join(root, file))
+                removed_objects += 1
+    return removed_snapshots, removed_objects
+
+def restore_snapshot(snapshot_file, target_folder, backup_folder=BACKUP_FOLDER):
+    # Write every file of a snapshot into target_folder, returns the number of files restored
+    with open(snapshot_file, 'r') as file:
+        snapshot = json.load(file)
+    for relative_path, digest in snapshot.items():
+        target_file = path.join(target_folder, *relative_path.split('/'))
+        makedirs(path.dirname(target_file) or '.', exist_ok=True)
+        with gzip.open(_object_path(backup_folder, digest), 'rb') as source, open(target_file, 'wb') as target:
+            target.write(source.read())
+    return len(snapshot)
+
+async def _git(backup_folder, *args):
+    # Returns (return code, output), output is stdout and stderr combined
+    process = await asyncio.create_subprocess_exec(
+        'git', '-C', backup_folder, *args, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.STDOUT,
+    )
+    try:
+        output, _ = await asyncio.wait_for(process.communicate(), timeout=GIT_TIMEOUT)
+    except asyncio.TimeoutError:
+        process.kill()
+        await process.wait()
+        return None, f"git {args[0]} timed out after {GIT_TIMEOUT}s"
+    return process.returncode, output.decode(errors='replace').strip()
+
+async def commit_backup(report, backup_folder=BACKUP_FOLDER):
+    # Commit the snapshot if the backup folder is a git work tree and push it if there is a remote
+    if not path.exists(path.join(backup_folder, '.git')):
+        return
+    for args in (('add', '-A'), ('commit', '-q', '-m', f"Backup {report.snapshot}")):
+        code, output = await _git(backup_folder, *args)
+        if code != 0:
+            print(f"Backup git {args[0]} failed: {output}")
+            return
+    code, remotes = await _git(backup_folder, 'remote')
+    if code == 0 and remotes:
+        code, output = await _git(backup_folder, 'push', '-q')
+        if code != 0:
+            print(f"Backup git push failed: {output}")
+
+async def run_backup(source_folder=SOURCE_FOLDER, backup_folder=BACKUP_FOLDER):
+    from debug_logger import DebugLogger  # Imported here so the command line version doesn't need discord
+    debug_logger = DebugLogger.get_instance()
+    started = time.perf_counter()
+    try:
+        makedirs(backup_folder, exist_ok=True)
+        report = await asyncio.get_running_loop().run_in_executor(None, create_snapshot, source_folder, backup_folder)
+        await commit_backup(report, backup_folder)
+    except Exception as e:
+        debug_logger.log(f"Backup failed: {e}")
+        return None
+    debug_logger.log(f"{report}, {time.perf_counter() - started:.2f}s including git")
+    return report
+
+def start_backup():
+    # Start a backup in the background unless one is still running, returns its task
+    global _backup_task
+    if _backup_task is None or _backup_task.done():
+        _backup_task = asyncio.get_running_loop().create_task(run_backup())
+    return _backup_task
+
+
+if __name__ == "__main__":
+    if len(sys.argv) >= 2 and sys.argv[1] == 'backup':
+        report = create_snapshot()
+        asyncio.run(commit_backup(report))
+        print(report)
+    elif len(sys.argv) == 4 and sys.argv[1] == 'restore':
+        print(f"Restored {restore_snapshot(sys.argv[2], sys.argv[3])} files into {sys.argv[3]}")
+    else:
+        print(__doc__)
@@ -0,0 +1,53 @@
+"""
+Chat experience throughput benchmark.
+
+Feeds synthetic chat messages through levelSystem.process_experience against a temporary data/ directory and
+reports messages per second. Run from the repository root (needs the bot's dependencies and _secrets.py):
+
+    python benchmarks/chat_throughput.py [messages] [users]
+"""
+import asyncio
+import os
+import sys
+import tempfile
+import time
+from contextlib import redirect_stdout
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def make_member(user_id):
+    return SimpleNamespace(
+        id=user_id, name=f'user{user_id}', display_name=f'user{user_id}', nick=None, mention=f'<@{user_id}>',
+        roles=[], voice=None, bot=False,
+    )
+
+
+async def run(messages, users):
+    import levelSystem
+
+    guild = SimpleNamespace(id=1, name='Benchmark Guild', get_role=lambda role_id: None, get_channel=lambda channel_id: None)
+    members = [make_member(user_id) for user_id in range(1, users + 1)]
+    chats = [SimpleNamespace(author=members[i % users], guild=guild) for i in range(messages)]
+
+    started = time.perf_counter()
+    for message in chats:
+        await levelSystem.process_experience(None, guild, message.author, False, 'chat', message)
+    return time.perf_counter() - started
+
+
+def main():
+    messages = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    users = int(sys.argv[2]) if len(sys.argv) > 2 else 500
+
+    with tempfile.TemporaryDirectory() as data_root:
+        os.chdir(data_root)  # All paths in the bot are relative to data/
+        with open(os.devnull, 'w') as devnull, redirect_stdout(devnull):  # Silence the per-message debug log
+            elapsed = asyncio.run(run(messages, users))
+
+    print(f"{messages} messages from {users} users in {elapsed:.2f}s: {messages / elapsed:,.0f} messages/s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,196 @@
+"""
+Minimal stand-ins for the discord.py objects the bot touches, enough to drive the experience, voice, leaderboard
+and reconciliation code paths without a gateway connection. REST calls (sends, edits, member edits) return at once
+and are counted on the guild so benchmarks can report them.
+"""
+import discord
+from types import SimpleNamespace
+
+
+class FakeRole:
+    def __init__(self, role_id, name, position=1, default=False):
+        self.id = role_id
+        self.name = name
+        self.position = position
+        self.default = default
+        self.mention = f'<@&{role_id}>'
+
+    def is_default(self):
+        return self.default
+
+
+class FakeMessage:
+    def __init__(self, channel, message_id, content=None, embed=None):
+        self.channel = channel
+        self.id = message_id
+        self.content = content
+        self.embed = embed
+
+    async def edit(self, content=None, embed=None):
+        self.channel.guild.rest_calls += 1
+        self.content = content if content is not None else self.content
+        self.embed = embed if embed is not None else self.embed
+        return self
+
+    async def delete(self):
+        self.channel.guild.rest_calls += 1
+        self.channel.messages.pop(self.id, None)
+
+
+class FakeChannel:
+    def __init__(self, guild, channel_id, name, voice=False):
+        self.guild = guild
+        self.id = channel_id
+        self.name = name
+        self.voice = voice
+        self.members = []  # Connected members, for voice channels
+        self.messages = {}
+        self.mention = f'<#{channel_id}>'
+
+    async def send(self, content=None, embed=None, file=None):
+        self.guild.rest_calls += 1
+        message = FakeMessage(self, self.guild.next_id(), content, embed)
+        self.messages[message.id] = message
+        return message
+
+    def get_partial_message(self, message_id):
+        message = self.messages.get(message_id)
+        if message is None:
+            return SimpleNamespace(edit=self._missing_message)
+        return message
+
+    async def _missing_message(self, **kwargs):
+        raise discord.NotFound(SimpleNamespace(status=404, reason='Not Found'), 'Unknown Message')
+
+    async def history(self, limit=100):
+        for message in list(self.messages.values())[:limit]:
+            yield message
+
+
+class FakeVoiceState:
+    def __init__(self, channel, self_mute=False, self_deaf=False, self_stream=False):
+        self.channel = channel
+        self.self_mute = self_mute
+        self.self_deaf = self_deaf
+        self.self_stream = self_stream
+
+
+class FakeMember:
+    def __init__(self, guild, member_id, name=None, status=discord.Status.online):
+        self.guild = guild
+        self.id = member_id
+        self.name = name or f'user{member_id}'
+        self.display_name = self.name
+        self.nick = None
+        self.mention = f'<@{member_id}>'
+        self.bot = False
+        self.status = status
+        self.roles = [guild.default_role]
+        self.voice = None
+        self.color = discord.Color.default()
+        self.avatar = None
+        self.default_avatar = SimpleNamespace(url=f'https://cdn.discordapp.com/embed/avatars/{member_id % 5}.png')
+
+    async def edit(self, roles=None, **kwargs):
+        self.guild.rest_calls += 1
+        if roles is not None:
+            self.roles = [self.guild.default_role] + [role for role in roles if not role.is_default()]
+
+    def join_voice(self, channel, **voice_state):
+        self.voice = FakeVoiceState(channel, **voice_state)
+        channel.members.append(self)
+
+
+class FakeGuild:
+    def __init__(self, guild_id=1, name='Synthetic Guild'):
+        self.id = guild_id
+        self.name = name
+        self._next_id = 1000
+        self.rest_calls = 0
+        self.default_role = FakeRole(guild_id, '@everyone', position=0, default=True)
+        self.roles = {self.default_role.id: self.default_role}
+        self.members = {}
+        self.channels = {}
+        self.voice_channels = []
+        self.stage_channels = []
+        self.afk_channel = None
+
+    def next_id(self):
+        self._next_id += 1
+        return self._next_id
+
+    def add_role(self, name, position=1):
+        role = FakeRole(self.next_id(), name, position)
+        self.roles[role.id] = role
+        return role
+
+    def add_member(self, member_id, **kwargs):
+        member = self.members[member_id] = FakeMember(self, member_id, **kwargs)
+        return member
+
+    def add_text_channel(self, name):
+        channel = self.channels[self.next_id()] = FakeChannel(self, self._next_id, name)
+        return channel
+
+    def add_voice_channel(self, name):
+        channel = self.channels[self.next_id()] = FakeChannel(self, self._next_id, name, voice=True)
+        self.voice_channels.append(channel)
+        return channel
+
+    def get_role(self, role_id):
+        return self.roles.get(role_id)
+
+    def get_member(self, member_id):
+        return self.members.get(member_id)
+
+    def get_channel(self, channel_id):
+        return self.channels.get(channel_id)
+
+    async def query_members(self, user_ids=None, limit=5, cache=True, **kwargs):
+        self.rest_calls += 1
+        return [self.members[user_id] for user_id in (user_ids or [])[:limit] if user_id in self.members]
+
+
+class FakeResponse:
+    def __init__(self):
+        self.sent = []
+
+    async def send_message(self, content=None, embed=None, ephemeral=False, **kwargs):
+        self.sent.append(content if embed is None else embed)
+
+
+class FakeInteraction:
+    def __init__(self, guild, user):
+        self.guild = guild
+        self.guild_id = guild.id
+        self.user = user
+        self.response = FakeResponse()
+
+
+class FakeTree:
+    # Command decorators that leave the function as it is, so command modules can be imported without a bot
+    def command(self, *args, **kwargs):
+        return lambda function: function
+
+    def context_menu(self, *args, **kwargs):
+        return lambda function: function
+
+
+class FakeBot:
+    def __init__(self, guilds=()):
+        self.tree = FakeTree()
+        self.guilds = list(guilds)
+        self.user = SimpleNamespace(id=1, name='bot')
+
+    def get_guild(self, guild_id):
+        return next((guild for guild in self.guilds if guild.id == guild_id), None)
+
+    def get_channel(self, channel_id):
+        for guild in self.guilds:
+            channel = guild.get_channel(channel_id)
+            if channel is not None:
+                return channel
+        return None
+
+    def get_user(self, user_id):
+        return None
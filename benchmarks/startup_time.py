@@ -0,0 +1,72 @@
+"""
+Startup time harness.
+
+Imports the bot's modules in a fresh interpreter under `python -X importtime` and reports the total import time
+and the most expensive imports. With --connect it also starts main.py for real (needs _secrets.py and network
+access), which exits as soon as the gateway connects and reports the time from cold start to connect.
+Run from the repository root:
+
+    python benchmarks/startup_time.py [--connect] [--top 15]
+"""
+import argparse
+import os
+import subprocess
+import sys
+import time
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BOT_MODULES = ['util', 'configManager', 'debug_logger', 'levelSystem', 'auto_update_git']
+
+
+def measure_imports(top):
+    # -X importtime writes "import time: self [us] | cumulative | imported package" lines to stderr
+    started = time.perf_counter()
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f"import {', '.join(BOT_MODULES)}"],
+        cwd=REPO_ROOT, capture_output=True, text=True,
+    )
+    elapsed = time.perf_counter() - started
+    if result.returncode != 0:
+        print(result.stderr.splitlines()[-1] if result.stderr else 'Import failed')
+        return
+
+    imports = []
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, package = line[len('import time:'):].split('|')
+        imports.append((int(cumulative_us), int(self_us), package.rstrip()))
+
+    total_us = sum(self_us for _, self_us, _ in imports)
+    print(f"Interpreter + imports: {elapsed:.2f}s wall, {total_us / 1e6:.2f}s importing {len(imports)} modules")
+    print(f"{'cumulative':>12} {'self':>10}  module")
+    for cumulative_us, self_us, package in sorted(imports, reverse=True)[:top]:
+        print(f"{cumulative_us / 1000:>10.1f}ms {self_us / 1000:>8.1f}ms  {package}")
+
+
+def measure_connect():
+    # main.py closes itself on the first gateway connect when EXIT_ON_CONNECT is set
+    started = time.perf_counter()
+    result = subprocess.run(
+        [sys.executable, 'main.py'], cwd=REPO_ROOT, capture_output=True, text=True,
+        env=dict(os.environ, EXIT_ON_CONNECT='1'), timeout=120,
+    )
+    elapsed = time.perf_counter() - started
+    connect_lines = [line for line in result.stdout.splitlines() if line.startswith('Connected to the gateway')]
+    print(connect_lines[0] if connect_lines else 'The bot did not report a gateway connection')
+    print(f"Cold start to exit: {elapsed:.2f}s wall")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure the bot\'s startup time.')
+    parser.add_argument('--connect', action='store_true', help='also start the bot and time the gateway connect')
+    parser.add_argument('--top', type=int, default=15, help='number of imports to list')
+    args = parser.parse_args()
+
+    measure_imports(args.top)
+    if args.connect:
+        measure_connect()
+
+
+if __name__ == "__main__":
+    main()
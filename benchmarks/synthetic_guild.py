@@ -0,0 +1,294 @@
+"""
+Synthetic guild benchmark.
+
+Builds a fake guild (see fakes.py) with the given number of users, seeds a temporary data/ tree through the
+configured storage backend, and drives the bot's hot paths against it:
+
+    reconcile    the on_ready reconciliation of stored levels and level roles (one run)
+    chat         process_experience for chat messages from random members
+    voice        process_voice_tick called directly (voice_activity_tracker runs it for every guild each minute),
+                 with members in voice channels
+    leaderboard  generate_leaderboard, a full render every time
+    publish      main.refresh_leaderboard, what publish_leaderboard_task runs every minute, with some chat from
+                 random and top members in between (not timed); it only renders when the watched ranking changed
+                 and only sends when the board did
+    rep          show_rep_util, the /rep command
+
+Every size runs in its own process so caches and peak RSS don't carry over. Fake REST calls return at once and the
+action queue runs without spacing, so the numbers are the bot's own cost. Run from the repository root (needs the
+bot's dependencies and _secrets.py):
+
+    python benchmarks/synthetic_guild.py [--sizes 1000 10000 100000] [--backend yaml|sqlite]
+                                         [--baseline benchmarks/baseline.json] [--save]
+
+With --baseline, the results are compared with the saved ones, --save (over)writes the baseline with this run.
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import resource
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from contextlib import redirect_stdout
+from types import SimpleNamespace
+
+import discord
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+from benchmarks.fakes import FakeBot, FakeGuild, FakeInteraction
+
+bot = FakeBot()  # The command modules do `from __main__ import bot`
+
+DEFAULT_SIZES = (1000, 10000, 100000)
+CHAT_MESSAGES = 20000
+VOICE_MEMBERS = 1000  # Members connected to voice during the voice ticks, at most the guild size
+VOICE_CHANNEL_SIZE = 10
+VOICE_TICKS = 5
+LEADERBOARD_RUNS = 50
+PUBLISH_RUNS = 50
+PUBLISH_CHATS = 20  # Chat messages between two publish refreshes
+REP_LOOKUPS = 2000
+LEVEL_ROLES = (5, 10, 20, 30, 50)
+WRONG_LEVEL_SHARE = 0.1  # Share of users stored with a stale level, for the reconciliation to fix
+PHASE_UNITS = (('chat', 'messages/s'), ('voice', 'members/s'), ('leaderboard', 'renders/s'), ('publish', 'refreshes/s'), ('rep', 'lookups/s'))
+
+
+def latency_stats(samples, elapsed, operations=None):
+    # samples are per-operation durations in seconds, operations defaults to one per sample
+    samples = sorted(samples)
+    quantiles = statistics.quantiles(samples, n=100, method='inclusive') if len(samples) > 1 else samples * 99
+    return {
+        'count': len(samples),
+        'seconds': round(elapsed, 4),
+        'throughput': round((operations or len(samples)) / elapsed, 1) if elapsed else None,
+        'p50_ms': round(quantiles[49] * 1000, 4),
+        'p99_ms': round(quantiles[98] * 1000, 4),
+    }
+
+
+def build_guild(users, rng):
+    guild = FakeGuild()
+    roles = {level: guild.add_role(f'Level {level}', position=index + 1) for index, level in enumerate(LEVEL_ROLES)}
+    guild.leaderboard_channel = guild.add_text_channel('leaderboard')
+    guild.publog_channel = guild.add_text_channel('publog')
+    guild.afk_channel = guild.add_voice_channel('AFK')
+    for user_id in range(1, users + 1):
+        guild.add_member(user_id, status=discord.Status.idle if rng.random() < 0.1 else discord.Status.online)
+    guild.level_roles = roles
+    bot.guilds = [guild]
+    return guild
+
+
+async def seed(guild, rng):
+    # Write the users straight through the storage backend, like data left behind by an earlier run
+    import configManager
+    from levelSystem import calculate_level
+    from roleLadder import get_role_ladder
+
+    guild_data = {
+        'leaderboard': guild.leaderboard_channel.id,
+        'leaderboard_message': None,
+        'level_roles': {str(level): role.id for level, role in guild.level_roles.items()},
+        'levelup_log': None,
+        'levelup_log_message': None,
+        'publog': guild.publog_channel.id,
+    }
+    configManager.get_storage_backend().save_guild(guild.id, guild_data)
+    ladder = get_role_ladder(guild)
+
+    records = []
+    for member in guild.members.values():
+        experience = round(rng.expovariate(1 / 20000), 2)
+        level = calculate_level(experience)
+        if rng.random() < WRONG_LEVEL_SHARE:
+            level = max(1, level - 1)  # Stale, and its roles are left for the reconciliation too
+        else:
+            member.roles = [guild.default_role] + ladder.entitled_roles(level)
+        records.append((guild.id, member.id, {'level': level, 'experience': experience, 'username': member.name}))
+    configManager.get_storage_backend().save_users(records)
+
+
+async def run_size(users, rng):
+    import asyncStorage
+    import configManager
+    import xpJournal
+    import levelSystem
+    from actionQueue import ActionQueue
+    import commandsUser
+
+    ActionQueue.ROUTE_INTERVAL = 0  # Fake REST calls have no rate limits to respect
+    configManager.set_flush_handler(asyncStorage.request_flush)
+    xpJournal.set_append_handler(asyncStorage.request_journal_append)
+
+    guild = build_guild(users, rng)
+    members = list(guild.members.values())
+    results = {'users': users}
+
+    started = time.perf_counter()
+    await seed(guild, rng)
+    results['seed_seconds'] = round(time.perf_counter() - started, 2)
+
+    # on_ready reconciliation, from a cold cache
+    started = time.perf_counter()
+    level_fixes, role_fixes = await levelSystem.reconcile_guild(guild)
+    elapsed = time.perf_counter() - started
+    results['reconcile'] = {'seconds': round(elapsed, 4), 'throughput': round(users / elapsed, 1), 'level_fixes': level_fixes, 'role_fixes': role_fixes}
+
+    # Chat messages from random members
+    samples = []
+    started = time.perf_counter()
+    for _ in range(CHAT_MESSAGES):
+        member = members[rng.randrange(users)]
+        message = SimpleNamespace(author=member, guild=guild, content='hello')
+        operation_started = time.perf_counter()
+        await levelSystem.process_experience(bot, guild, member, False, 'chat', message)
+        samples.append(time.perf_counter() - operation_started)
+    results['chat'] = latency_stats(samples, time.perf_counter() - started)
+
+    # Voice ticks with members spread over voice channels
+    channel = None
+    for index, member in enumerate(rng.sample(members, min(VOICE_MEMBERS, users))):
+        if index % VOICE_CHANNEL_SIZE == 0:
+            channel = guild.add_voice_channel(f'voice {index // VOICE_CHANNEL_SIZE}')
+        member.join_voice(channel, self_mute=rng.random() < 0.1, self_deaf=rng.random() < 0.05, self_stream=rng.random() < 0.1)
+    samples = []
+    processed = 0
+    started = time.perf_counter()
+    for _ in range(VOICE_TICKS):
+        operation_started = time.perf_counter()
+        processed += await levelSystem.process_voice_tick(bot, guild)
+        samples.append(time.perf_counter() - operation_started)
+    results['voice'] = latency_stats(samples, time.perf_counter() - started, processed)  # Throughput in members/s
+
+    # Leaderboard renders
+    samples = []
+    started = time.perf_counter()
+    for _ in range(LEADERBOARD_RUNS):
+        operation_started = time.perf_counter()
+        await levelSystem.generate_leaderboard(bot, guild.id)
+        samples.append(time.perf_counter() - operation_started)
+    results['leaderboard'] = latency_stats(samples, time.perf_counter() - started)
+
+    # Leaderboard publishing, with chat between the refreshes that sometimes moves the top
+    import main as bot_main  # Importing main.py only defines the bot's handlers, its setup() isn't run
+    bot_main.bot = bot
+    samples = []
+    sent = 0
+    for _ in range(PUBLISH_RUNS):
+        for _ in range(PUBLISH_CHATS):
+            member = members[rng.randrange(min(users, 20) if rng.random() < 0.5 else users)]
+            await levelSystem.process_experience(bot, guild, member, False, 'chat', SimpleNamespace(author=member, guild=guild, content='hello'))
+        operation_started = time.perf_counter()
+        published = await bot_main.refresh_leaderboard(guild, guild.leaderboard_channel)
+        if published:
+            await published
+            sent += 1
+        samples.append(time.perf_counter() - operation_started)
+    results['publish'] = dict(latency_stats(samples, sum(samples)), sent=sent)
+
+    # /rep lookups
+    samples = []
+    started = time.perf_counter()
+    for _ in range(REP_LOOKUPS):
+        member = members[rng.randrange(users)]
+        operation_started = time.perf_counter()
+        await commandsUser.show_rep_util(FakeInteraction(guild, member), member)
+        samples.append(time.perf_counter() - operation_started)
+    results['rep'] = latency_stats(samples, time.perf_counter() - started)
+
+    await asyncStorage.flush_user_data()
+    results['rest_calls'] = guild.rest_calls
+    results['peak_rss_mb'] = round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)  # ru_maxrss is in KB on Linux
+    return results
+
+
+def run_child(users, backend, seed_value):
+    # Runs inside the temporary data directory, prints the results as the last line of output
+    import _secrets
+    _secrets.STORAGE_BACKEND = backend  # Read by configManager when the backend is first used
+    with open(os.devnull, 'w') as devnull, redirect_stdout(devnull):  # Silence the bot's logging
+        results = asyncio.run(run_size(users, random.Random(seed_value)))
+    print(json.dumps(results))
+
+
+def run_parent(sizes, backend, seed_value):
+    results = {}
+    for users in sizes:
+        with tempfile.TemporaryDirectory() as data_root:  # All paths in the bot are relative to data/
+            completed = subprocess.run(
+                [sys.executable, os.path.abspath(__file__), '--child', str(users), '--backend', backend, '--seed', str(seed_value)],
+                cwd=data_root, capture_output=True, text=True,
+            )
+        if completed.returncode != 0:
+            print(f"{users} users: failed\n{completed.stderr}")
+            continue
+        results[str(users)] = json.loads(completed.stdout.strip().splitlines()[-1])
+        print_results(results[str(users)])
+    return results
+
+
+def print_results(results):
+    print(f"\n{results['users']:,} users (seeded in {results['seed_seconds']}s, peak RSS {results['peak_rss_mb']} MB, {results['rest_calls']} REST calls)")
+    reconcile = results['reconcile']
+    print(f"  {'reconcile':<12} {reconcile['seconds']:>9.3f}s  {reconcile['throughput']:>12,.0f} users/s  "
+          f"{reconcile['level_fixes']} levels and {reconcile['role_fixes']} members' roles fixed")
+    for phase, unit in PHASE_UNITS:
+        stats = results[phase]
+        sent = f"  {stats['sent']}/{stats['count']} sent an edit" if 'sent' in stats else ''
+        print(f"  {phase:<12} {stats['seconds']:>9.3f}s  {stats['throughput']:>12,.0f} {unit:<11} p50 {stats['p50_ms']:.3f}ms  p99 {stats['p99_ms']:.3f}ms{sent}")
+
+
+def compare(baseline, results):
+    # Relative change of every timing against the baseline, positive is slower
+    print(f"\nCompared with the baseline from {baseline.get('commit', 'an unknown commit')[:7]}:")
+    for users, current in results.items():
+        previous = baseline['results'].get(users)
+        if previous is None:
+            continue
+        changes = []
+        for phase, _ in PHASE_UNITS:
+            if phase not in previous:
+                continue  # Baseline from before the phase was added
+            for key in ('p50_ms', 'p99_ms'):
+                if previous[phase][key]:
+                    changes.append(f"{phase} {key[:3]} {(current[phase][key] / previous[phase][key] - 1) * 100:+.0f}%")
+        changes.append(f"reconcile {(current['reconcile']['seconds'] / previous['reconcile']['seconds'] - 1) * 100:+.0f}%")
+        changes.append(f"RSS {(current['peak_rss_mb'] / previous['peak_rss_mb'] - 1) * 100:+.0f}%")
+        print(f"  {int(users):,} users: " + ', '.join(changes))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the bot against a synthetic guild.')
+    parser.add_argument('--sizes', type=int, nargs='+', default=DEFAULT_SIZES, help='guild sizes (users) to run')
+    parser.add_argument('--backend', choices=('yaml', 'sqlite'), default='yaml', help='storage backend to seed and use')
+    parser.add_argument('--seed', type=int, default=1, help='random seed, keep it fixed when comparing runs')
+    parser.add_argument('--baseline', default=os.path.join(REPO_ROOT, 'benchmarks', 'baseline.json'), help='baseline file')
+    parser.add_argument('--save', action='store_true', help='save this run as the baseline')
+    parser.add_argument('--child', type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        run_child(args.child, args.backend, args.seed)
+        return
+
+    results = run_parent(args.sizes, args.backend, args.seed)
+    if os.path.exists(args.baseline):
+        with open(args.baseline, 'r') as file:
+            compare(json.load(file), results)
+    if args.save:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=REPO_ROOT, capture_output=True, text=True).stdout.strip()
+        with open(args.baseline, 'w') as file:
+            json.dump({'commit': commit, 'python': platform.python_version(), 'backend': args.backend, 'results': results}, file, indent=2)
+        print(f"\nSaved the baseline to {args.baseline}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,11 @@
 from discord.ext import commands
 import discord
-from configManager import load_guild_data, save_guild_data, load_user_data, save_user_data
-from levelSystem import calculate_level, adjust_roles, cumulative_experience_for_level, log_level_up
+from configManager import reload_config, get_config_error
+import asyncStorage
+import xpJournal
+import metrics
+from levelSystem import calculate_level, apply_roles, cumulative_experience_for_level, log_level_up
+from roleLadder import invalidate_role_ladder
 from util import send_embed
 from discord import Interaction
 from discord import app_commands
@@ -13,22 +17,23 @@ from __main__ import bot
 @app_commands.describe(member='The member whose level you want to set.')
 @app_commands.describe(level='The level to set for the member.')
 async def set_level(interaction: Interaction, member: discord.Member, level: int):
-    # Load user data
-    user_data = load_user_data(interaction.guild.id, member.id)
-    current_level = user_data['level']
     # Calculate the experience needed for the target level
     experience_list = cumulative_experience_for_level(level)
     experience = experience_list[-1]  # Get the last item from the list, which corresponds to the cumulative experience needed for the target level
     
-    # Set the user's level and experience
-    user_data['level'] = level
-    user_data['experience'] = experience
-    
-    # Save user data
-    save_user_data(interaction.guild.id, member.id, user_data)
+    # Set the user's level and experience, returns the level they had
+    def set_level_and_experience(user_data):
+        current_level = user_data['level']
+        delta = experience - user_data['experience']
+        user_data['level'] = level
+        user_data['experience'] = experience
+        xpJournal.record(interaction.guild.id, member.id, user_data, delta, 'set_level')
+        return current_level
+
+    current_level = await asyncStorage.update_user_data(interaction.guild.id, member.id, set_level_and_experience)
 
     # Adjust roles
-    await adjust_roles(interaction.guild, level, member)
+    await apply_roles(interaction.guild, level, member)
 
     if current_level != level:
         await log_level_up(interaction, interaction.guild, member, level)
@@ -42,24 +47,19 @@ async def set_level(interaction: Interaction, member: discord.Member, level: int
 @app_commands.describe(member='The member whose reputation you want to adjust.')
 @app_commands.describe(reputation='The reputation to adjust for the member (relative to the current rep).')
 async def adjust_rep(interaction: Interaction, member: discord.Member, reputation: int):
-    # Load user data
-    user_data = load_user_data(interaction.guild.id, member.id)
-    current_level = user_data['level']
-
-    # Adjust the experience in the user's total
-    user_data['experience'] += reputation
-    if user_data['experience'] < 0:
-        user_data['experience'] = 0
+    # Adjust the experience in the user's total and recalculate the level, returns (old level, new level)
+    def adjust_experience(user_data):
+        current_level = user_data['level']
+        current_experience = user_data['experience']
+        user_data['experience'] = max(0, user_data['experience'] + reputation)
+        user_data['level'] = calculate_level(user_data['experience'])
+        xpJournal.record(interaction.guild.id, member.id, user_data, user_data['experience'] - current_experience, 'adjust_rep')
+        return current_level, user_data['level']
 
-    # Calculate new level
-    new_level = calculate_level(user_data['experience'])
-    user_data['level'] = new_level
-
-    # Save user data
-    save_user_data(interaction.guild.id, member.id, user_data)
+    current_level, new_level = await asyncStorage.update_user_data(interaction.guild.id, member.id, adjust_experience)
 
     # Adjust roles
-    await adjust_roles(interaction.guild, new_level, member)
+    await apply_roles(interaction.guild, new_level, member)
 
     if current_level != new_level:
         await log_level_up(interaction, interaction.guild, member, new_level)
@@ -72,24 +72,19 @@ async def adjust_rep(interaction: Interaction, member: discord.Member, reputatio
 @app_commands.describe(member='The member whose reputation you want to set.')
 @app_commands.describe(reputation='The reputation to set for the member.')
 async def set_rep(interaction: Interaction, member: discord.Member, reputation: int):
-    # Load user data
-    user_data = load_user_data(interaction.guild.id, member.id)
-    current_level = user_data['level']
-
-    # Adjust the experience in the user's total
-    user_data['experience'] = reputation
-    if user_data['experience'] < 0:
-        user_data['experience'] = 0
-
-    # Calculate new level
-    new_level = calculate_level(user_data['experience'])
-    user_data['level'] = new_level
+    # Set the experience in the user's total and recalculate the level, returns (old level, new level)
+    def set_experience(user_data):
+        current_level = user_data['level']
+        current_experience = user_data['experience']
+        user_data['experience'] = max(0, reputation)
+        user_data['level'] = calculate_level(user_data['experience'])
+        xpJournal.record(interaction.guild.id, member.id, user_data, user_data['experience'] - current_experience, 'set_rep')
+        return current_level, user_data['level']
 
-    # Save user data
-    save_user_data(interaction.guild.id, member.id, user_data)
+    current_level, new_level = await asyncStorage.update_user_data(interaction.guild.id, member.id, set_experience)
 
     # Adjust roles
-    await adjust_roles(interaction.guild, new_level, member)
+    await apply_roles(interaction.guild, new_level, member)
 
     if current_level != new_level:
         await log_level_up(interaction, interaction.guild, member, new_level)
@@ -102,25 +97,29 @@ async def set_rep(interaction: Interaction, member: discord.Member, reputation:
 @app_commands.describe(level='The level you want to set the role for.')
 @app_commands.describe(role='The role you want to set for the level.')
 async def set_level_role(interaction: Interaction, level: int, role: discord.Role = None):
-    # Load guild data
-    guild_data = load_guild_data(interaction.guild.id)
-    
-    # Create 'level_roles' field if it doesn't exist
-    if 'level_roles' not in guild_data:
-        guild_data['level_roles'] = {}
-        
+    # Update the level-role mapping, returns False if there was no role to remove
+    def update_level_roles(guild_data):
+        # Create 'level_roles' field if it doesn't exist
+        if not guild_data.get('level_roles'):
+            guild_data['level_roles'] = {}
+
+        if role is None:
+            # Remove the role mapping for the level if it exists
+            return guild_data['level_roles'].pop(str(level), None) is not None
+        # Add the level-role mapping
+        guild_data['level_roles'][str(level)] = role.id
+        return True
+
+    changed = await asyncStorage.update_guild_data(interaction.guild.id, update_level_roles)
+    if changed:
+        invalidate_role_ladder(interaction.guild.id)
+
     if role is None:
-        # Remove the role mapping for the level if it exists
-        if str(level) in guild_data['level_roles']:
-            del guild_data['level_roles'][str(level)]
-            save_guild_data(interaction.guild.id, guild_data)
+        if changed:
             await interaction.response.send_message(f"The role for level {level} has been removed.")
         else:
             await interaction.response.send_message(f"No role found for this level.")
     else:
-        # Add the level-role mapping
-        guild_data['level_roles'][str(level)] = role.id
-        save_guild_data(interaction.guild.id, guild_data)
         await interaction.response.send_message(f"The role for level {level} has been set to {role.name}.")
 
 
@@ -131,8 +130,7 @@ async def set_level_role(interaction: Interaction, level: int, role: discord.Rol
 @app_commands.describe(channel_name='The name of the channel to set for the type.')
 async def set_channel(interaction: Interaction, channel_type: str, channel_name: str):
     guild_id = interaction.guild.id
-    guild_data = load_guild_data(guild_id)
-    
+
     if channel_type.lower() not in ['leaderboard', 'publog']:
         await interaction.response.send_message('Invalid channel type. Please specify either "leaderboard" or "publog".')
         return
@@ -144,8 +142,7 @@ async def set_channel(interaction: Interaction, channel_type: str, channel_name:
         return
 
     # Update the guild data
-    guild_data[channel_type.lower()] = channel.id
-    save_guild_data(guild_id, guild_data)
+    await asyncStorage.update_guild_data(guild_id, lambda guild_data: guild_data.update({channel_type.lower(): channel.id}))
 
     await interaction.response.send_message(f"Set the {channel_type} channel to {channel_name}.")
 
@@ -155,12 +152,43 @@ async def set_channel(interaction: Interaction, channel_type: str, channel_name:
 @app_commands.checks.has_permissions(administrator=True)
 @app_commands.describe(user='The user to toggle blacklist status for.')
 async def blacklist(interaction: Interaction, user: discord.Member):
-    user_data = load_user_data(interaction.guild.id, user.id)
     # Toggle the blacklist status
-    user_data['blacklisted'] = not user_data.get('blacklisted', False)
-    save_user_data(interaction.guild.id, user.id, user_data)
+    def toggle_blacklist(user_data):
+        user_data['blacklisted'] = not user_data.get('blacklisted', False)
+        return user_data['blacklisted']
+
+    blacklisted = await asyncStorage.update_user_data(interaction.guild.id, user.id, toggle_blacklist)
     # Reply with the new status
-    if user_data['blacklisted']:
+    if blacklisted:
         await interaction.response.send_message(f"{user.name} has been added to the blacklist.")
     else:
         await interaction.response.send_message(f"{user.name} has been removed from the blacklist.")
+
+
+@bot.tree.command(name='botstats', description='Admin only command. Show the bot\'s internal metrics.')
+@app_commands.guild_only()
+@app_commands.checks.has_permissions(administrator=True)
+async def botstats(interaction: Interaction):
+    # Quantiles are bucket upper bounds, the full histograms are in data/metrics.prom
+    lines = []
+    length = 0
+    for line in metrics.summary():
+        if length + len(line) + 1 > 1900:
+            lines.append('...')
+            break
+        lines.append(line)
+        length += len(line) + 1
+    await interaction.response.send_message("```" + '\n'.join(lines) + "```", ephemeral=True)
+
+
+@bot.tree.command(name='reload_config', description='Admin only command. Reload the configuration file.')
+@app_commands.guild_only()
+@app_commands.checks.has_permissions(administrator=True)
+async def reload_config_command(interaction: Interaction):
+    config = reload_config()
+    settings = '\n'.join(f"{key}: {value}" for key, value in sorted(config.items()))
+    error = get_config_error()
+    if error:
+        await interaction.response.send_message(f"{error}\n```{settings}```")
+        return
+    await interaction.response.send_message(f"Configuration reloaded.\n```{settings}```")
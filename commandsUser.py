@@ -1,6 +1,7 @@
 from discord.ext import commands
 import discord
-from configManager import load_user_data, load_all_user_data
+import asyncStorage
+import xpHistory
 from util import get_random_color, add_commas
 from datetime import datetime, timedelta
 from discord import app_commands
@@ -34,13 +35,37 @@ async def rep(interaction: discord.Interaction, member: discord.Member = None):
     # Run the same code as the context menu command
     await show_rep_util(interaction, member)
 
+@bot.tree.command(name='rep_history', description='Show how Reputation has grown for yourself or another member.')
+@app_commands.guild_only()
+@app_commands.checks.cooldown(1, 5.0, key=lambda i: (i.guild_id, i.user.id))
+@app_commands.describe(member='The member you want to see the reputation history of...')
+async def rep_history(interaction: discord.Interaction, member: discord.Member = None):
+    if not member:
+        member = interaction.user
+
+    history = xpHistory.get_history(interaction.guild.id, member.id)
+    if history is None:
+        await interaction.response.send_message(f"No reputation history for {member.name} yet.", ephemeral=True)
+        return
+
+    embed = discord.Embed(
+        title=f"{member.name[0].upper() + member.name[1:]}'s Reputation History",
+        description='',
+        color=member.color
+    )
+    # Read straight from the rollups, one value per bar
+    for name, series, count in (('Last hour', 'minute', 60), ('Last 24 hours', 'hour', 24), ('Last 30 days', 'day', 30)):
+        values = history.recent(series, count)
+        embed.add_field(name=f"{name} (+{add_commas(round(sum(values)))})", value=f"`{xpHistory.sparkline(values)}`", inline=False)
+
+    await interaction.response.send_message(embed=embed)
+
 async def show_rep_util(interaction: discord.Interaction, member: discord.Member):
     # Load user data
-    user_data = load_user_data(interaction.guild.id, member.id)
+    user_data = await asyncStorage.load_user_data(interaction.guild.id, member.id)
     
-    # Load all users' data and find the rank of the user
-    all_user_data = load_all_user_data(interaction.guild.id)
-    user_rank = [i for i, user in enumerate(all_user_data) if user[0] == str(member.id)][0] + 1
+    # Look up the rank of the user in the guild's rank index
+    user_rank = await asyncStorage.get_user_rank(interaction.guild.id, member.id)
     if 10 <= user_rank <= 20:
         suffix = 'th'
     else:
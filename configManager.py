@@ -1,46 +1,198 @@
-from yaml import safe_load, safe_dump
-from os import makedirs, path, walk
+from yaml import safe_load, YAMLError
+from os import makedirs, path
+from time import monotonic, perf_counter
+from types import MappingProxyType
+from copy import deepcopy
+from storageBackends import create_backend, write_yaml_atomic
+from rankIndex import RankIndex
+import _secrets
+import metrics
 
+# Number of dirty user records that triggers an immediate flush to storage. Experience changes are in the
+# journal (see xpJournal.py) long before that, a flush is the snapshot the journal is compacted into.
+FLUSH_THRESHOLD = 1000
 
-def load_user_data(guild_id, user_id):
-    default_user_data = {'level': 1, 'experience': 0, 'points_in_last_minute': 0}
-    # Create the guild directory if it doesn't exist
-    makedirs(f'data/{guild_id}', exist_ok=True)
-    # Load the user's data if it exists, otherwise create a new data file
-    if path.exists(f'data/{guild_id}/{user_id}.yaml'):
-        with open(f'data/{guild_id}/{user_id}.yaml', 'r') as file:
-            return safe_load(file)
+# Write-back store: every user record stays in memory after its first load.
+# Records are keyed by guild then user (both as strings, since ids arrive as either int or str)
+_user_cache = {}
+_dirty_users = set()
+_loaded_guilds = set()  # Guilds whose entire user set has been read into the cache
+
+_guild_data_cache = {}  # Guild ID -> guild data, written through on every save
+_rank_indexes = {}  # Guild ID -> RankIndex, built on the first rank lookup and kept in sync by save_user_data
+
+_backend = None
+
+USER_CACHE_HITS = metrics.counter('user_cache_lookups_total', 'User record lookups', result='hit')
+USER_CACHE_MISSES = metrics.counter('user_cache_lookups_total', 'User record lookups', result='miss')
+USER_SAVES = metrics.counter('user_saves_total', 'User records saved to memory')
+GUILD_SAVES = metrics.counter('guild_saves_total', 'Guild records saved')
+metrics.gauge('dirty_user_records', 'User records waiting for the next flush', function=lambda: len(_dirty_users))
+metrics.gauge('cached_user_records', 'User records in memory', function=lambda: sum(len(users) for users in _user_cache.values()))
+
+CONFIG_FILE = 'data/config.yaml'
+CONFIG_CHECK_INTERVAL = 5  # Seconds between checks of the config file's modification time
+_config = None
+_config_mtime = None
+_config_checked_at = 0
+_config_subscribers = []
+_config_error = None  # Why the config file was last rejected, None while it reads fine
+
+
+def get_storage_backend():
+    # 'yaml' (one file per user, the default) or 'sqlite', set with STORAGE_BACKEND in _secrets.py.
+    # STORAGE_FSYNC = True makes every flush durable against power loss, at the cost of throughput.
+    global _backend
+    if _backend is None:
+        _backend = TimedBackend(create_backend(getattr(_secrets, 'STORAGE_BACKEND', 'yaml'), getattr(_secrets, 'STORAGE_FSYNC', False)))
+        restored = _backend.recover()
+        if restored:
+            print(f"Restored {restored} damaged records from their last good copy")
+    return _backend
+
+class TimedBackend:
+    """
+    Wraps a storage backend and records the duration of every call in the storage_seconds histogram.
+    """
+
+    def __init__(self, backend):
+        self.backend = backend
+
+    def __getattr__(self, name):
+        # Only called the first time a method is used, the timed wrapper is then stored on the instance
+        attribute = getattr(self.backend, name)
+        if not callable(attribute):
+            return attribute
+        histogram = metrics.histogram('storage_seconds', 'Duration of storage backend calls', operation=name)
+
+        def timed(*args, **kwargs):
+            started = perf_counter()
+            try:
+                return attribute(*args, **kwargs)
+            finally:
+                histogram.observe(perf_counter() - started)
+        setattr(self, name, timed)
+        return timed
+
+def _guild_cache(guild_id):
+    return _user_cache.setdefault(str(guild_id), {})
+
+# The in-memory store is only ever changed from the event loop thread. Storage I/O can run elsewhere (see
+# asyncStorage), so loading and flushing are split into a storage step and a cache step.
+
+def get_cached_user_data(guild_id, user_id):
+    # The user's record if it is in memory, otherwise None
+    user_data = _user_cache.get(str(guild_id), {}).get(str(user_id))
+    if user_data is None:
+        USER_CACHE_MISSES.inc()
     else:
-        with open(f'data/{guild_id}/{user_id}.yaml', 'w') as file:
-            safe_dump(default_user_data, file)
-        return default_user_data
+        USER_CACHE_HITS.inc()
+    return user_data
+
+def cache_user_data(guild_id, user_id, user_data):
+    # Store a record read from storage (None if there was none) unless one was cached in the meantime,
+    # returns the record that is now in memory
+    guild_users = _guild_cache(guild_id)
+    cached = guild_users.get(str(user_id))
+    if cached is not None:
+        return cached
+    if user_data is None:
+        # New users get a default record which is written on the next flush
+        user_data = {'level': 1, 'experience': 0, 'points_in_last_minute': 0}
+        _dirty_users.add((str(guild_id), str(user_id)))
+        if str(guild_id) in _rank_indexes:
+            _rank_indexes[str(guild_id)].update(user_id, 0)
+    guild_users[str(user_id)] = user_data
+    return user_data
+
+def load_user_data(guild_id, user_id):
+    user_data = get_cached_user_data(guild_id, user_id)
+    if user_data is not None:
+        return user_data
+    return cache_user_data(guild_id, user_id, get_storage_backend().load_user(guild_id, user_id))
+
+def is_guild_cached(guild_id):
+    return str(guild_id) in _loaded_guilds
+
+def cache_guild_users(guild_id, users):
+    # Merge a guild's records read from storage, records already in memory are newer and win
+    guild_users = _guild_cache(guild_id)
+    for user_id, user_data in users.items():
+        if user_data and user_id not in guild_users:
+            guild_users[user_id] = user_data
+    _loaded_guilds.add(str(guild_id))
 
 def load_all_user_data(guild_id):
-    # Create the guild directory if it doesn't exist
-    makedirs(f'data/{guild_id}', exist_ok=True)
-    # Initialize the user data list
-    user_data_list = []
-    # Walk the guild directory and load each user's data
-    for root, dirs, files in walk(f'data/{guild_id}'):
-        for file in files:
-            if file.endswith('.yaml') and file != 'guild_data.yaml':
-                with open(path.join(root, file), 'r') as f:
-                    user_data = safe_load(f)
-                    user_data_list.append((file.replace('.yaml', ''), user_data))
+    if not is_guild_cached(guild_id):
+        cache_guild_users(guild_id, get_storage_backend().load_users(guild_id))
+
+    user_data_list = list(_guild_cache(guild_id).items())
     # Sort the list by user experience
     user_data_list.sort(key=lambda x: x[1]['experience'], reverse=True)
     return user_data_list
 
 def save_user_data(guild_id, user_id, data):
-    with open(f'data/{guild_id}/{user_id}.yaml', 'w') as file:
-        safe_dump(data, file)
+    # Update the in-memory record and mark it dirty, it is written to storage on the next flush
+    USER_SAVES.inc()
+    _guild_cache(guild_id)[str(user_id)] = data
+    _dirty_users.add((str(guild_id), str(user_id)))
+    if str(guild_id) in _rank_indexes:
+        _rank_indexes[str(guild_id)].update(user_id, data['experience'])
+    if len(_dirty_users) >= FLUSH_THRESHOLD:
+        _flush_handler()
 
-def load_guild_data(guild_id):
-    # Load the guild's data if it exists, otherwise create a new data file
-    if path.exists(f'data/{guild_id}/guild_data.yaml'):
-        with open(f'data/{guild_id}/guild_data.yaml', 'r') as file:
-            return safe_load(file)
-    else:
+def set_flush_handler(handler):
+    # Called instead of flush_user_data when FLUSH_THRESHOLD dirty records are pending
+    global _flush_handler
+    _flush_handler = handler
+
+def get_rank_index(guild_id):
+    rank_index = _rank_indexes.get(str(guild_id))
+    if rank_index is None:
+        rank_index = RankIndex((user_id, user_data['experience']) for user_id, user_data in load_all_user_data(guild_id))
+        _rank_indexes[str(guild_id)] = rank_index
+    return rank_index
+
+def get_user_rank(guild_id, user_id):
+    # 1-based rank of the user by experience within the guild, or None if the user has no record
+    return get_rank_index(guild_id).rank(user_id)
+
+def take_dirty_user_records():
+    # Snapshot of every dirty record as (guild_id, user_id, data), the records are marked clean
+    records = [(guild_id, user_id, dict(_user_cache[guild_id][user_id])) for guild_id, user_id in _dirty_users]
+    _dirty_users.clear()
+    return records
+
+def write_user_records(records):
+    # Storage step of a flush, safe to run outside the event loop thread
+    get_storage_backend().save_users(records)
+
+def restore_dirty_user_records(records):
+    # Mark the records of a failed flush dirty again so the next flush retries them
+    _dirty_users.update((guild_id, user_id) for guild_id, user_id, _ in records)
+
+def flush_user_data():
+    # Write every dirty user record to storage in one batch, returns the number of records written
+    records = take_dirty_user_records()
+    try:
+        write_user_records(records)
+    except Exception:
+        restore_dirty_user_records(records)
+        raise
+    return len(records)
+
+_flush_handler = flush_user_data
+
+def get_cached_guild_data(guild_id):
+    return _guild_data_cache.get(str(guild_id))
+
+def cache_guild_data(guild_id, data):
+    # Store a guild record read from storage (None if there was none), returns (data, is_new)
+    cached = _guild_data_cache.get(str(guild_id))
+    if cached is not None:
+        return cached, False
+    is_new = data is None
+    if is_new:
         data = {
             'leaderboard': None, 
             'leaderboard_message': None, 
@@ -49,20 +201,42 @@ def load_guild_data(guild_id):
             'levelup_log_message': None,
             'publog': None
         }
-        # Create guild directory if it doesn't exist
-        makedirs(f'data/{guild_id}', exist_ok=True)
-        # Create guild_data.yaml
-        with open(f'data/{guild_id}/guild_data.yaml', 'w') as file:
-            safe_dump(data, file)
+    _guild_data_cache[str(guild_id)] = data
+    return data, is_new
+
+def load_guild_data(guild_id):
+    # Served from memory after the first load, otherwise load the guild's data or create a new record
+    data = get_cached_guild_data(guild_id)
+    if data is not None:
         return data
+    data, is_new = cache_guild_data(guild_id, get_storage_backend().load_guild(guild_id))
+    if is_new:
+        get_storage_backend().save_guild(guild_id, data)
+    return data
 
+def update_guild_data(guild_id, data):
+    # Cache step of a guild save, returns a copy to hand to the storage backend
+    GUILD_SAVES.inc()
+    data = {k: data[k] for k in sorted(data)} # Sort the data before saving
+    _guild_data_cache[str(guild_id)] = data
+    return deepcopy(data)
 
 def save_guild_data(guild_id, data):
-    data = {k: data[k] for k in sorted(data)} # Sort the data before saving
-    with open(f'data/{guild_id}/guild_data.yaml', 'w') as file:
-        safe_dump(data, file)
+    get_storage_backend().save_guild(guild_id, update_guild_data(guild_id, data))
 
 def load_config():
+    # Returns the cached config snapshot, the file is only re-parsed when its modification time changes
+    global _config_checked_at
+    now = monotonic()
+    if _config is None or now - _config_checked_at >= CONFIG_CHECK_INTERVAL:
+        _config_checked_at = now
+        if _config is None or not path.exists(CONFIG_FILE) or path.getmtime(CONFIG_FILE) != _config_mtime:
+            return reload_config()
+    return _config
+
+def reload_config():
+    # Parse the config file, publish a new read-only snapshot and notify the subscribers
+    global _config, _config_mtime, _config_error
     default_config = {
         'chat_limit': 5,
         'experience_per_chat': 25,
@@ -73,10 +247,40 @@ def load_config():
     # Create data directory if it doesn't exist
     makedirs(f'data/', exist_ok=True)
     # Load the config file if it exists, otherwise create a new config file
-    if path.exists('data/config.yaml'):
-        with open('data/config.yaml', 'r') as file:
-            return safe_load(file)
+    if path.exists(CONFIG_FILE):
+        mtime = path.getmtime(CONFIG_FILE)
+        try:
+            with open(CONFIG_FILE, 'r') as file:
+                config = dict(safe_load(file))  # TypeError/ValueError if the file is empty or not a mapping
+        except (YAMLError, TypeError, ValueError) as e:
+            # Keep the last good snapshot and leave _config_mtime alone, so the file is read again once it's fixed
+            error = f"Could not read {CONFIG_FILE}, keeping the previous configuration: {e}"
+            if error != _config_error:
+                print(error)
+            _config_error = error
+            if _config is not None:
+                return _config
+            config = default_config  # Nothing to keep yet
+        else:
+            _config_error = None
+            _config_mtime = mtime
     else:
-        with open('data/config.yaml', 'w') as file:
-            safe_dump(default_config, file)
-        return default_config
+        write_yaml_atomic(CONFIG_FILE, default_config)
+        config = default_config
+        _config_error = None
+        _config_mtime = path.getmtime(CONFIG_FILE)
+    _config = MappingProxyType(dict(config))
+
+    for callback in _config_subscribers:
+        callback(_config)
+    return _config
+
+def get_config_error():
+    # The reason the config file was rejected on the last read, or None
+    return _config_error
+
+def subscribe_config(callback):
+    # callback(config) is called on every reload, and right away if the config is already loaded
+    _config_subscribers.append(callback)
+    if _config is not None:
+        callback(_config)
@@ -1,10 +1,12 @@
 import asyncio
+from collections import deque
 from datetime import datetime
+from time import monotonic
 import discord
 import _secrets
-import yaml
-import os
 import pytz
+import metrics
+from actionQueue import ActionQueue, PRIORITY_LOW
 
 class DebugLogger:
     """
@@ -13,9 +15,10 @@ class DebugLogger:
     This class logs messages and sends them to the bot developer, stored in _secrets.py.
     It saves the messages and flushes them every 10 seconds (or another interval, configurable via the SLEEP_TIME variable).
     If a message already exists, it edits that message to append new information.
-    Messages are stored in a list, and the total character count is ensured to be under a limit (2000 by default, 
-    configurable via the CHAR_LIMIT variable).
+    Messages wait in a ring buffer of BUFFER_SIZE lines, and the total character count is ensured to be under a limit
+    (2000 by default, configurable via the CHAR_LIMIT variable).
     If the total length of the messages exceeds the limit, the oldest message is discarded.
+    Under load, lines beyond MAX_LINES_PER_SECOND are dropped, counted in `dropped` and summarized in the log.
     The bot and current message information (including ID and content) are stored in a singleton instance of the class.
 
     Example usage:
@@ -29,16 +32,24 @@ class DebugLogger:
 
     _instance = None
     bot = None
-    DEBUG_INFO_FILE = 'data/debugconf.yaml'
     CHAR_LIMIT = 2000
     SLEEP_TIME = 10
+    BUFFER_SIZE = 200  # Lines waiting to be sent, the oldest are dropped beyond this
+    MAX_LINES_PER_SECOND = 50  # Lines past this in the same second are dropped and counted instead of logged
+    TIMEZONE = pytz.timezone('US/Central')
 
     def __init__(self, bot=None):
         if bot is not None:
             DebugLogger.bot = bot
         if DebugLogger._instance is None:
-            self.debug_message_list = []
-            self.current_message_info = {'id': '', 'content': []}  # Initialize with no message ID and empty content
+            self.pending = deque(maxlen=self.BUFFER_SIZE)  # Logged lines not sent yet
+            self.shown = deque()  # Lines in the current DM message, oldest first
+            self.message_id = None  # Every run starts a new DM message and then keeps editing it
+            self.dropped = 0  # Total lines dropped since start
+            self._second = 0
+            self._lines_this_second = 0
+            self._dropped_this_second = 0
+            metrics.gauge('debug_log_lines_dropped', 'Debug log lines dropped under load since start', function=lambda: self.dropped)
             DebugLogger._instance = self
         else:
             raise Exception("You cannot create another DebugLogger class!")  # Enforce singleton instance
@@ -55,13 +66,31 @@ class DebugLogger:
         self.bot.loop.create_task(self.send_loop())
 
     def log(self, message):
-        # Add a timestamp to the message and store it in the message list
-        now = datetime.now(pytz.timezone('US/Central'))
-        #timestamp = now.strftime("[%Y-%m-%d %H:%M:%S]")
-        timestamp = now.strftime("%m-%d %H:%M:%S]")
+        # Add a timestamp to the message and store it in the ring buffer, or count it as dropped under load
+        second = int(monotonic())
+        if second != self._second:
+            dropped = self._dropped_this_second
+            self._second, self._lines_this_second, self._dropped_this_second = second, 0, 0
+            if dropped:
+                self._append(f"({dropped} messages dropped)")
+        if self._lines_this_second >= self.MAX_LINES_PER_SECOND:
+            self._dropped_this_second += 1
+            self.dropped += 1
+            return None
+        self._lines_this_second += 1
+        return self._append(message)
+
+    def _append(self, message):
+        timestamp = datetime.now(self.TIMEZONE).strftime("%m-%d %H:%M:%S]")
         debug_message = f"{timestamp} {message}"
-        self.debug_message_list.append(debug_message)
-        print(debug_message)
+        print(debug_message)  # The console gets the whole line
+        if len(debug_message) > self.CHAR_LIMIT:
+            # A line longer than a whole message is cut, render() would otherwise have nothing to send
+            marker = " ... (cut, the whole line is in the console)"
+            debug_message = debug_message[:self.CHAR_LIMIT - len(marker)] + marker
+        if len(self.pending) == self.pending.maxlen:
+            self.dropped += 1  # The oldest unsent line is pushed out
+        self.pending.append(debug_message)
         return debug_message
 
     async def get_developer(self):
@@ -69,54 +98,42 @@ class DebugLogger:
         dev_id = _secrets.DEVELOPER_ID
         return self.bot.get_user(dev_id)
 
-    def load_message_info(self):
-        # Load the current message ID and content from the YAML file, or initialize them if the file doesn't exist
-        if os.path.exists(self.DEBUG_INFO_FILE):
-            with open(self.DEBUG_INFO_FILE, 'r') as f:
-                self.current_message_info = yaml.safe_load(f)
-        else:
-            self.current_message_info = {'id': '', 'content': []}
-
-    def save_message_info(self):
-        # Save the current message ID and content to the YAML file
-        with open(self.DEBUG_INFO_FILE, 'w') as f:
-            yaml.safe_dump(self.current_message_info, f)
+    def render(self):
+        # The newest lines that fit in CHAR_LIMIT, joined once
+        self.shown.extend(self.pending)
+        self.pending.clear()
+        length = -1  # No newline before the first line
+        count = 0
+        for line in reversed(self.shown):
+            if length + len(line) + 1 > self.CHAR_LIMIT:
+                break
+            length += len(line) + 1
+            count += 1
+        while len(self.shown) > count:
+            self.shown.popleft()
+        return '\n'.join(self.shown)
 
     async def flush(self):
-        if self.debug_message_list:
-            if self.current_message_info is not None:
-                self.current_message_info['content'].extend(self.debug_message_list)
-                self.debug_message_list = []
-
-                lines = self.current_message_info['content']
-                new_content = ""
-                for line in reversed(lines):
-                    if len(new_content + line + "\n") <= self.CHAR_LIMIT:
-                        new_content = line + "\n" + new_content
-                    else:
-                        break
-                new_content = new_content.strip()
-
-                developer = await self.get_developer()
-
-                self.load_message_info()
-                if self.current_message_info:
-                    if self.current_message_info['id']:
-                        try:
-                            current_message = await developer.fetch_message(self.current_message_info['id'])
-                            await current_message.edit(content=new_content)
-                            self.current_message_info['content'] = new_content.split('\n')
-                            self.save_message_info()
-                        except discord.NotFound:
-                            current_message = await developer.send(content=new_content)
-                            self.current_message_info = {'id': current_message.id, 'content': new_content.split('\n')}
-                            self.save_message_info()
-                    else:
-                        current_message = await developer.send(content=new_content)
-                        self.current_message_info = {'id': current_message.id, 'content': new_content.split('\n')}
-                        self.save_message_info()
+        if not self.pending:
+            return
+        new_content = self.render()
+        developer = await self.get_developer()
+        if developer is None or not new_content:
+            return
+        channel = developer.dm_channel or await developer.create_dm()
+
+        if self.message_id:  # Edit without fetching the message first
+            try:
+                await channel.get_partial_message(self.message_id).edit(content=new_content)
+                return
+            except discord.NotFound:
+                pass  # The message was deleted, send a new one
+        current_message = await channel.send(content=new_content)
+        self.message_id = current_message.id
 
     async def send_loop(self):
+        # The flush goes through the action queue so the DM edits share the rate limit handling of other REST calls
+        action_queue = ActionQueue.get_instance()
         while True:
-            await self.flush()  # Reuse the logic in the flush method
+            action_queue.enqueue(('dm', _secrets.DEVELOPER_ID), self.flush, key='debug_flush', priority=PRIORITY_LOW)
             await asyncio.sleep(self.SLEEP_TIME)
\ No newline at end of file
@@ -0,0 +1,25 @@
+import importlib
+import subprocess
+import sys
+
+# Run once when setting up the bot: python install_libraries.py
+# This used to run at the top of main.py on every start, which imported every library (slowly) before booting.
+libraries = [
+    ("discord", "discord.py"),
+    ("yaml", "PyYAML"),
+    ("asciichartpy", "asciichartpy"),
+    ("pytz", "pytz"),
+    ("requests", "requests"),
+    ("matplotlib", "matplotlib")
+]
+
+def verify_libraries_installed(libraries):
+    for library in libraries:
+        try:
+            importlib.import_module(library[0])
+        except ImportError:
+            print(f"{library[0]} not installed. Installing...")
+            subprocess.call([sys.executable, "-m", "pip", "install", library[1]])
+
+if __name__ == "__main__":
+    verify_libraries_installed(libraries)
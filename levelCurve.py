@@ -0,0 +1,65 @@
+from bisect import bisect_right
+
+
+class LevelCurve:
+    """
+    Cumulative experience thresholds for one experience_constant.
+
+    thresholds[level] is the total experience needed to reach that level (thresholds[0] is 0 so indexes line up
+    with levels). The table is built once and doubled whenever a lookup runs past the end of it.
+    """
+
+    INITIAL_LEVELS = 200
+
+    def __init__(self, experience_constant, levels=INITIAL_LEVELS):
+        self.experience_constant = experience_constant
+        self.thresholds = [0]
+        self.extend(levels)
+
+    def extend(self, target_level):
+        # Using the formula: experience for a level = level * level^experience_constant + 30
+        thresholds = self.thresholds
+        for level in range(len(thresholds), target_level + 1):
+            thresholds.append(thresholds[-1] + (level * (level ** self.experience_constant)) + 30)
+
+    def level_for(self, experience):
+        # Highest level whose threshold has been reached, never below 1
+        while experience >= self.thresholds[-1]:
+            self.extend(len(self.thresholds) * 2)
+        return max(1, bisect_right(self.thresholds, experience) - 1)
+
+    def levels_for(self, experiences):
+        # Batch version of level_for: maps a sequence (or numpy array) of experience values to levels in one call
+        if len(experiences) == 0:
+            return []
+        highest = max(experiences)
+        while highest >= self.thresholds[-1]:
+            self.extend(len(self.thresholds) * 2)
+        try:
+            import numpy as np
+        except ImportError:
+            return [max(1, bisect_right(self.thresholds, experience) - 1) for experience in experiences]
+        levels = np.searchsorted(np.asarray(self.thresholds), np.asarray(experiences), side='right') - 1
+        return np.maximum(levels, 1)
+
+    def experience_for_level(self, level):
+        # Cumulative experience needed to reach the level
+        if level >= len(self.thresholds):
+            self.extend(level)
+        return self.thresholds[level]
+
+
+_curve = None
+
+
+def get_level_curve(experience_constant):
+    # The shared curve, rebuilt whenever the configured experience_constant changes
+    global _curve
+    if _curve is None or _curve.experience_constant != experience_constant:
+        _curve = LevelCurve(experience_constant)
+    return _curve
+
+
+def current_level_curve():
+    # The shared curve if one has been built yet, otherwise None
+    return _curve
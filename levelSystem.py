@@ -1,25 +1,67 @@
-from configManager import load_guild_data, load_config, save_user_data, load_user_data, save_guild_data
+from configManager import load_config, save_user_data, load_user_data, get_rank_index, subscribe_config
+import asyncStorage
+import xpJournal
+import xpHistory
+import asyncio
 import discord
+import hashlib
 import math
-from functools import lru_cache
-from os import path
-import glob
-import discord
-
-import asciichartpy
-import pandas as pd
-import matplotlib.pyplot as plt
-from datetime import datetime, timedelta
+import re
+from datetime import datetime
 from util import get_random_color, get_celebration_emoji, add_commas
 from debug_logger import DebugLogger
+from levelCurve import get_level_curve, current_level_curve
+from roleLadder import get_role_ladder
+from actionQueue import ActionQueue, PRIORITY_HIGH
+from collections import deque
+from renderService import render_leaderboard_image
+from time import monotonic, perf_counter
+import metrics
+
+CHAT_WINDOW = 180  # Seconds a chat counts towards the chat limit
+CHAT_WINDOW_SIZE = 16  # Minimum number of recent chats remembered per user
+_chat_windows = {}  # (guild_id, user_id) -> deque of recent chat times, pruned by the voice tick
+
+DEPARTED_MEMBER_TTL = 3600  # Seconds a member that couldn't be found is left off the leaderboards
+_departed_members = {}  # (guild_id, user_id) -> monotonic time the entry expires
+
+RECONCILE_CONCURRENCY = 8  # Role updates in flight at once during the startup reconciliation
+RECONCILE_PROGRESS_INTERVAL = 25  # Log progress every this many role updates
+
+_experience_seconds = {}  # Source -> process_experience_seconds histogram
+CALCULATE_LEVEL_SECONDS = metrics.histogram('calculate_level_seconds', 'Duration of calculate_level')
+ADJUST_ROLES_SECONDS = metrics.histogram('adjust_roles_seconds', 'Duration of adjust_roles, not including the queued member edit')
+ROLE_SYNCS_QUEUED = metrics.counter('role_syncs_queued_total', 'Member role syncs queued')
+LEADERBOARD_SECONDS = metrics.histogram('generate_leaderboard_seconds', 'Duration of generate_leaderboard')
+VOICE_TICK_SECONDS = metrics.histogram('voice_tick_seconds', 'Duration of a voice tick for one guild')
+VOICE_TICK_MEMBERS = metrics.gauge('voice_tick_members', 'Members processed by the last voice tick')
+EXPERIENCE_AWARDED = metrics.counter('experience_awarded_total', 'Experience issued')
+LEVEL_CHANGES = metrics.counter('level_changes_total', 'Level changes from experience')
+
+def experience_seconds(source):
+    histogram = _experience_seconds.get(source)
+    if histogram is None:
+        histogram = _experience_seconds[source] = metrics.histogram(
+            'process_experience_seconds', 'Duration of processing experience for one member', source=str(source)
+        )
+    return histogram
 
 async def process_experience(ctx, guild, member, debug=False, source=None, message=None):
     if source == 'voice_activity':
         if not member.voice:
             return 0 # Do not issue experience if the member is not in a voice channel, and the source is voice activity
-        
+
+    # One update per user at a time, so a chat and a voice tick can't both award from the same old record
+    started = perf_counter()
+    try:
+        async with asyncStorage.user_lock(guild.id, member.id):
+            user_data = await asyncStorage.load_user_data(guild.id, member.id)
+            return await _process_experience(ctx, guild, member, user_data, source, message)
+    finally:
+        experience_seconds(source).observe(perf_counter() - started)
+
+async def _process_experience(ctx, guild, member, user_data, source, message):
     debug_logger = DebugLogger.get_instance()
-    user_data = load_user_data(guild.id, member.id)
     config = load_config()
     modifier = ''
     # If the source is "on_ready"
@@ -29,7 +71,7 @@ async def process_experience(ctx, guild, member, debug=False, source=None, messa
             return 0
         
         calculated_level = calculate_level(user_data['experience'])
-        await adjust_roles(guild, calculated_level, member)
+        await apply_roles(guild, calculated_level, member)
         # If the calculated level does not match the stored level, update the stored level
         if user_data['level'] != calculated_level:
             user_data['level'] = calculated_level
@@ -41,46 +83,16 @@ async def process_experience(ctx, guild, member, debug=False, source=None, messa
         debug_logger.log("➥ Issued 0r to {member.name} [blacklisted].")
         return 0
 
-    # Current level
-    current_level = user_data['level']
-    experience_gain = 0
     if source == 'voice_activity':
-        if member.voice and member.voice.channel and (member.voice.channel.id != guild.afk_channel.id):
-            is_alone = len(member.voice.channel.members) == 1
-            is_fullmute = (member.voice.self_mute and member.voice.self_deaf)
-            is_idle = member.status == discord.Status.idle or member.status == discord.Status.offline
-            all_others_idle = all((other_member.status == discord.Status.idle or
-                                    (other_member.voice.self_mute and other_member.voice.self_deaf)) for other_member in member.voice.channel.members if other_member != member)
-            
-            modifier += 'v'
-
-            if is_alone:
-                experience_gain += config['experience_per_minute_voice'] / 4
-                modifier += 'a'
-            elif is_idle:
-                #experience_gain += config['experience_per_minute_voice'] / 4
-                experience_gain = 1
-                modifier += 'i'
-            elif is_fullmute:
-                #experience_gain += config['experience_per_minute_voice'] / 4
-                experience_gain = 1
-                modifier += 'm'
-            elif all_others_idle:
-                experience_gain += config['experience_per_minute_voice'] / 3
-                modifier += 'o'
-            else:
-                experience_gain += config['experience_per_minute_voice']
-                
-            if member.voice.self_stream:
-                experience_gain += config['experience_streaming_bonus']
-                modifier += 's'
+        channel = member.voice.channel
+        if channel is None or (guild.afk_channel and channel.id == guild.afk_channel.id):
+            return user_data['level']
+        experience_gain, modifier = voice_experience(config, member, VoiceChannelFacts(channel))
 
     elif source == 'chat':
         modifier += 'c'
-        now = datetime.now()
-        user_data['chats_timestamps'] = [timestamp for timestamp in user_data['chats_timestamps'] if now - timestamp < timedelta(minutes=3)]
-        num_chats = len(user_data['chats_timestamps'])
-        user_data['chats_timestamps'].append(now)
+        num_chats = count_recent_chats(guild.id, member.id, config['chat_limit'])
+        user_data.pop('chats_timestamps', None)  # Stored by older versions, the chat window now lives in memory
         experience_gain = max(1, config['experience_per_chat'] * (1 - num_chats / config['chat_limit']))
         if message.author.voice and message.author.voice.channel:
             experience_gain /= 3
@@ -89,6 +101,75 @@ async def process_experience(ctx, guild, member, debug=False, source=None, messa
         debug_logger.log(f"Invalid source provided to process_experience: {source}")
         return 0
 
+    return await award_experience(ctx, guild, member, user_data, experience_gain, modifier, source)
+
+async def reconcile_guild(guild, concurrency=RECONCILE_CONCURRENCY):
+    # Startup pass over every stored user: fix stored levels that don't match the experience, then sync roles only
+    # for the members whose level roles are actually wrong. Returns (level_fixes, role_fixes).
+    debug_logger = DebugLogger.get_instance()
+    user_data_list = [(user_id, user_data) for user_id, user_data in await asyncStorage.load_all_user_data(guild.id) if user_data['experience'] != 0]
+    levels = get_current_level_curve().levels_for([user_data['experience'] for _, user_data in user_data_list])
+    ladder = get_role_ladder(guild)
+
+    level_fixes = 0
+    role_fixes = []
+    for (user_id, user_data), level in zip(user_data_list, levels):
+        level = int(level)
+        if user_data['level'] != level:
+            user_data['level'] = level
+            save_user_data(guild.id, user_id, user_data)
+            level_fixes += 1
+        member = guild.get_member(int(user_id)) if ladder else None
+        if member and ladder.role_diff(member, level) is not None:
+            role_fixes.append((member, level))
+    debug_logger.log(f"({guild.name}) {level_fixes} stored levels fixed, {len(role_fixes)} members need a role update")
+
+    # Role syncs go through the action queue, the semaphore bounds how many are waiting on it at once
+    semaphore = asyncio.Semaphore(concurrency)
+    completed = 0
+
+    async def fix_roles(member, level):
+        nonlocal completed
+        async with semaphore:
+            try:
+                await apply_roles(guild, level, member)
+            except Exception as e:
+                debug_logger.log(f"({guild.name}) Role update for '{member.name}' failed: {e}")
+        completed += 1
+        if completed % RECONCILE_PROGRESS_INTERVAL == 0 and completed < len(role_fixes):
+            debug_logger.log(f"({guild.name}) Role updates: {completed}/{len(role_fixes)}")
+
+    await asyncio.gather(*(fix_roles(member, level) for member, level in role_fixes))
+    return level_fixes, len(role_fixes)
+
+def count_recent_chats(guild_id, user_id, chat_limit):
+    # Record a chat and return how many chats the user sent in the CHAT_WINDOW before it.
+    # Only the most recent chats are kept, counting beyond chat_limit makes no difference to the experience.
+    now = monotonic()
+    window = _chat_windows.get((guild_id, user_id))
+    if window is None or window.maxlen < chat_limit:
+        window = _chat_windows[(guild_id, user_id)] = deque(window or (), maxlen=max(CHAT_WINDOW_SIZE, chat_limit))
+    while window and now - window[0] >= CHAT_WINDOW:
+        window.popleft()
+    num_chats = len(window)
+    window.append(now)
+    return num_chats
+
+def prune_chat_windows(now=None):
+    # Forget the users whose last chat is older than CHAT_WINDOW, their window would count zero chats anyway.
+    # Returns the number of windows dropped.
+    now = monotonic() if now is None else now
+    stale = [key for key, window in _chat_windows.items() if not window or now - window[-1] >= CHAT_WINDOW]
+    for key in stale:
+        del _chat_windows[key]
+    return len(stale)
+
+async def award_experience(ctx, guild, member, user_data, experience_gain, modifier, source='chat'):
+    debug_logger = DebugLogger.get_instance()
+    # Current level
+    current_level = user_data['level']
+    current_experience = user_data['experience']
+
     # No changes, return
     if experience_gain == 0:
         return current_level
@@ -110,11 +191,20 @@ async def process_experience(ctx, guild, member, debug=False, source=None, messa
     username = member.display_name or member.nick or member.name
     user_data['username'] = username  # Update the user_data with the username
 
-    # Save user data
+    # Journal the change, add it to the user's history and save user data
+    experience_delta = round(user_data['experience'] - current_experience, 2)
+    EXPERIENCE_AWARDED.inc(experience_delta)
+    xpJournal.record(guild.id, member.id, user_data, experience_delta, source, modifier)
+    xpHistory.record(guild.id, member.id, experience_delta)
     save_user_data(guild.id, member.id, user_data)
 
-    # Adjust roles
-    await adjust_roles(guild, new_level, member)
+    # Adjust roles, only needed when the level has changed
+    if current_level != new_level:
+        LEVEL_CHANGES.inc()
+        queued = await adjust_roles(guild, new_level, member)
+        if queued:
+            # Don't hold the user's lock until the edit goes out, report a failure when it does
+            queued.add_done_callback(lambda future: _report_role_sync(future, member))
 
     debug_logger.log(f"{experience_gain}r {modifier} ➥ {member.name} Rep: {add_commas(round(user_data['experience'] + experience_gain, 2))}")
     if current_level != new_level:
@@ -122,22 +212,162 @@ async def process_experience(ctx, guild, member, debug=False, source=None, messa
 
     return new_level
 
-async def generate_leaderboard(bot, guild_id, full_board = False):
-    leader_depth = 9
-    if full_board:
-        leader_depth = 999
+class VoiceChannelFacts:
+    """
+    Per-channel facts for one voice tick, computed once instead of once per member.
+    """
+
+    def __init__(self, channel):
+        self.members = channel.members
+        self.member_count = len(self.members)
+        # Members that count as idle for the others in the channel: idle status or fully muted
+        self.quiet_ids = {
+            other_member.id for other_member in self.members
+            if other_member.status == discord.Status.idle or (other_member.voice and other_member.voice.self_mute and other_member.voice.self_deaf)
+        }
+
+    def all_others_idle(self, member):
+        quiet_others = len(self.quiet_ids) - (member.id in self.quiet_ids)
+        return quiet_others == self.member_count - 1
+
+def voice_experience(config, member, facts):
+    # Returns the experience gain and the modifier string for one minute in a voice channel
+    experience_gain = 0
+    modifier = 'v'
+    is_alone = facts.member_count == 1
+    is_fullmute = (member.voice.self_mute and member.voice.self_deaf)
+    is_idle = member.status == discord.Status.idle or member.status == discord.Status.offline
+
+    if is_alone:
+        experience_gain += config['experience_per_minute_voice'] / 4
+        modifier += 'a'
+    elif is_idle:
+        #experience_gain += config['experience_per_minute_voice'] / 4
+        experience_gain = 1
+        modifier += 'i'
+    elif is_fullmute:
+        #experience_gain += config['experience_per_minute_voice'] / 4
+        experience_gain = 1
+        modifier += 'm'
+    elif facts.all_others_idle(member):
+        experience_gain += config['experience_per_minute_voice'] / 3
+        modifier += 'o'
+    else:
+        experience_gain += config['experience_per_minute_voice']
 
-    user_data_files = glob.glob(f'data/{guild_id}/[!guild_data]*.yaml')
+    if member.voice.self_stream:
+        experience_gain += config['experience_streaming_bonus']
+        modifier += 's'
 
-    user_data_list = []
-    for user_data_file in user_data_files:
-        user_id = path.splitext(path.basename(user_data_file))[0]
-        user_data = load_user_data(guild_id, user_id)
-        user_data_list.append((user_id, user_data))
+    return experience_gain, modifier
 
-    user_data_list.sort(key=lambda item: item[1]['experience'], reverse=True)
+async def process_voice_tick(ctx, guild, debug=False):
+    # Issue one minute of voice experience to everyone connected in the guild, walking the voice channels
+    # rather than every member. Returns the number of members processed.
+    started = perf_counter()
+    prune_chat_windows()  # Runs every minute anyway, keeps the chat windows to the recently active users
+    award_seconds = experience_seconds('voice_activity')
+    config = load_config()
+    afk_channel_id = guild.afk_channel.id if guild.afk_channel else None
+    processed = 0
+    for channel in guild.voice_channels + guild.stage_channels:
+        if channel.id == afk_channel_id or not channel.members:
+            continue
+
+        # Work out every member's gain first, then apply them as one batch
+        facts = VoiceChannelFacts(channel)
+        grants = []
+        for member in facts.members:
+            user_data = await asyncStorage.load_user_data(guild.id, member.id)
+            if user_data.get('blacklisted'):
+                DebugLogger.get_instance().log(f"➥ Issued 0r to {member.name} [blacklisted].")
+                continue
+            grants.append((member,) + voice_experience(config, member, facts))
+
+        for member, experience_gain, modifier in grants:
+            award_started = perf_counter()
+            async with asyncStorage.user_lock(guild.id, member.id):
+                user_data = await asyncStorage.load_user_data(guild.id, member.id)
+                await award_experience(ctx, guild, member, user_data, experience_gain, modifier, 'voice_activity')
+            award_seconds.observe(perf_counter() - award_started)
+        processed += len(grants)
+    VOICE_TICK_SECONDS.observe(perf_counter() - started)
+    VOICE_TICK_MEMBERS.set(processed)
+    return processed
+
+async def get_leaderboard_entries(guild, depth, min_experience=5):
+    # The top `depth` members by experience as (member, user_data), and the ranking position after the last one looked at.
+    # Members come from the gateway cache first, misses are resolved in one batched query per round and members
+    # that can't be found are skipped for DEPARTED_MEMBER_TTL seconds.
+    rank_index = await asyncStorage.get_rank_index(guild.id)
+    now = monotonic()
+    entries = []
+    seen = set()
+    position = 0
+    exhausted = False
+    while len(entries) < depth and not exhausted:
+        # Take the next batch of candidates in rank order
+        candidates = []
+        while len(candidates) < min(depth - len(entries), 100):
+            if position >= len(rank_index):
+                exhausted = True
+                break
+            user_id = rank_index.user_at(position)
+            user_data = load_user_data(guild.id, user_id)
+            if user_data['experience'] <= min_experience:  # Skip users with 5 experience or less, so does everyone after them
+                exhausted = True
+                break
+            position += 1
+            if user_id in seen or _departed_members.get((guild.id, user_id), 0) > now:
+                continue
+            seen.add(user_id)
+            candidates.append((user_id, user_data, guild.get_member(int(user_id))))
+
+        misses = [int(user_id) for user_id, _, member in candidates if member is None]
+        resolved = {}
+        if misses:
+            try:
+                for member in await guild.query_members(user_ids=misses, limit=len(misses), cache=True):
+                    resolved[member.id] = member
+            except asyncio.TimeoutError:
+                pass
+
+        for user_id, user_data, member in candidates:
+            member = member or resolved.get(int(user_id))
+            if member is None:
+                _departed_members[(guild.id, user_id)] = now + DEPARTED_MEMBER_TTL
+                continue
+            entries.append((member, user_data))
+    return entries, position
+
+def find_next_lower_level(guild_id, position, min_level):
+    # The level of the first user ranked from `position` on with a level below min_level, and the number of
+    # ranking positions read to find it
+    rank_index = get_rank_index(guild_id)
+    for next_position in range(position, len(rank_index)):
+        level = load_user_data(guild_id, rank_index.user_at(next_position))['level']
+        if level < min_level:
+            return level, next_position + 1
+    return min_level, len(rank_index)
+
+async def generate_leaderboard(bot, guild_id, full_board = False, return_depth=False):
+    # With return_depth, returns (ascii_plot, depth) where depth is the number of ranking positions the board was
+    # built from, a change below it can't change the board
+    started = perf_counter()
+    try:
+        ascii_plot, depth = await _generate_leaderboard(bot, guild_id, full_board)
+        return (ascii_plot, depth) if return_depth else ascii_plot
+    finally:
+        LEADERBOARD_SECONDS.observe(perf_counter() - started)
+
+async def _generate_leaderboard(bot, guild_id, full_board):
+    leader_depth = 9
+    if full_board:
+        leader_depth = 999
 
     guild = bot.get_guild(guild_id)
+    entries, next_position = await get_leaderboard_entries(guild, leader_depth)
+    depth = next_position + 1  # The user the walk stopped at was read as well
 
     leaderboard_data = []
     leaderboard_levels = []
@@ -145,15 +375,7 @@ async def generate_leaderboard(bot, guild_id, full_board = False):
     max_level = 0
     max_username_len = 0
     rank_emoji = ["🥇", "🥈", "🥉"] + ["🏅"]*2 + ["🔹"]*2 + ["🔸"]*2
-    for rank, (user_id, user_data) in enumerate(user_data_list[:leader_depth], start=1):
-        #Skip user if they have less than 5 experience
-        if user_data["experience"] <= 5:
-            continue
-
-        user = await guild.fetch_member(int(user_id))  # Fetch member from the guild
-        if not user:  # Skip if the user is not found
-            continue
-
+    for rank, (user, user_data) in enumerate(entries, start=1):
         username = user.display_name or user.nick or user.name
         username = username.title()  # Titlize the username
 
@@ -188,14 +410,16 @@ async def generate_leaderboard(bot, guild_id, full_board = False):
 
     if not full_board:
         # Find the next level that's lower than min_level
-        next_lower_level = next((user_data['level'] for user_id, user_data in user_data_list[leader_depth:] if user_data['level'] < min_level), min_level)
+        next_lower_level, scanned = find_next_lower_level(guild_id, next_position, min_level)
+        depth = max(depth, scanned)
         stretched_leaderboard_levels.append(next_lower_level)
 
     # Calculate height
     if not full_board:
         height = min(max_level - next_lower_level, 16)
 
-    # Generate ASCII plot for levels
+    # Generate ASCII plot for levels, asciichartpy is only needed here so it's imported on first use
+    import asciichartpy
     if full_board:
         ascii_plot = asciichartpy.plot(stretched_leaderboard_levels, {'format': '{:>6.0f}'})
     else:
@@ -221,11 +445,14 @@ async def generate_leaderboard(bot, guild_id, full_board = False):
     ascii_plot = '   Level\n' + ascii_plot
 
     # Add title
-    timestamp = datetime.now().strftime("[%Y-%m-%d %H:00]")
+    timestamp = datetime.now().strftime("[%Y-%m-%d %H:%M]")
     ascii_plot = '\n\t\t\t' + timestamp + '\n   Earn Rep by participating in the server!\n' + ascii_plot
 
-    # Return the ASCII plot
-    return ascii_plot
+    return ascii_plot, depth
+
+def leaderboard_fingerprint(ascii_plot):
+    # Hash of the rendered leaderboard without its timestamp, so it only changes when the content does
+    return hashlib.sha1(re.sub(r'\[\d{4}-\d{2}-\d{2} \d{2}:\d{2}\]', '', ascii_plot, count=1).encode()).hexdigest()
 
 # Generate a matplotlib image of the leaderboard. Too many characters can be returned with the other function for discord to handle. Let's try an image
 async def generate_leaderboard_image(bot, guild_id, full_board=False):
@@ -233,169 +460,87 @@ async def generate_leaderboard_image(bot, guild_id, full_board=False):
     if full_board:
         leader_depth = 999
 
-    user_data_files = glob.glob(f'data/{guild_id}/[!guild_data]*.yaml')
-
-    user_data_list = []
-    for user_data_file in user_data_files:
-        user_id = path.splitext(path.basename(user_data_file))[0]
-        user_data = load_user_data(guild_id, user_id)
-        user_data_list.append((user_id, user_data))
-
-    user_data_list.sort(key=lambda item: item[1]['experience'], reverse=True)
-
     guild = bot.get_guild(guild_id)
+    entries, _ = await get_leaderboard_entries(guild, leader_depth)
 
     usernames = []
     levels = []
 
-    for rank, (user_id, user_data) in enumerate(user_data_list[:leader_depth], start=1):
-        if user_data.get('experience') <= 5:
-            continue
-
-        user = guild.get_member(int(user_id))
-        if user:
-            username = user.display_name or user.nick or user.name
-            username = username.title()
-        else:
-            continue
-        # elif user_data.get('username') is not None:
-        #     username = user_data['username']
-        # else:
-        #     username = user_id
-
+    for rank, (user, user_data) in enumerate(entries, start=1):
+        username = user.display_name or user.nick or user.name
+        username = username.title()
         username = f'{rank}. {username}'
 
         usernames.append(username)
         levels.append(user_data["level"])
 
-    # Create pyplot figure and axes
-    plt.style.use('dark_background')
-    
-    fig, ax = plt.subplots(figsize=(10, 6))
-    bars = ax.barh(usernames[::-1], levels[::-1], color='skyblue')  # Reverse to have the top player at the top
-
-      # Add value labels to each bar
-    for bar in bars:
-        width = bar.get_width()
-        ax.annotate(f'{width}',
-                    xy=(bar.get_width() + 0.2, bar.get_y() + bar.get_height() / 2),
-                    xytext=(3, 0),  # 3 points horizontal offset
-                    textcoords="offset points",
-                    ha='center', va='center', color='white')
-
-    # Customize the plot
-    ax.set_xlabel('Levels')
-    ax.set_title(f'Leaderboard by Level')
-    plt.tight_layout()
-
-    # Save the plot to an image file
-    image_path = f'data/{guild_id}/leaderboard.png'
-    plt.savefig(image_path)
-
-    # Close the plot
-    plt.close()
-
-    return image_path
+    # Rendered off the event loop, returns the PNG bytes
+    return await render_leaderboard_image(usernames, levels)
 
 
 def calculate_level(experience, debug = False):
-    # # Get experience constant from config
-    # config = load_config()
-    # experience_constant = config['experience_constant']
-    
-    # # Using the formula: level = (level * math.pow((level, experience_constant)) + 30)
-    # level = 1
-    # while experience >= (level * (math.pow(level, experience_constant)) + 30):
-    #     if debug:
-    #         # Print on one line
-    #         print(f"Level: {level}, Experience: {experience}, Change: {(level * (math.pow(level, experience_constant)) + 30)}")
-    #     experience -= (level * (math.pow(level, experience_constant)) + 30)
-    #     level += 1
-    
-    # return level
-    # v2 Below
-    global experience_cache  # Access the global variable
-
-    # Ensure we have cached enough experience values for this calculation
-    while experience > experience_cache[-1]:
-        # If we need to expand the list, do it by 10 levels at a time
-        cumulative_experience_for_level(len(experience_cache) + 10)
-
-    # Search through the cache for the level
-    level = 1
-    for i in range(1, len(experience_cache)):
-        if experience_cache[i] > experience:
-            break
-        level = i
-        #if debug:
-            #print(f"Level: {level}, Experience: {experience}, Change: {experience_cache[i]}")
-
+    # Bisect the precomputed threshold table for the current experience_constant
+    started = perf_counter()
+    level = get_current_level_curve().level_for(experience)
+    CALCULATE_LEVEL_SECONDS.observe(perf_counter() - started)
     return level
 
-# Initialize the experience list globally
-experience_cache = [0]  # Start the list with 0 so that the indexes line up with the levels
-
 def cumulative_experience_for_level(target_level: int):
-    # Get experience constant from config
-    config = load_config()
-    experience_constant = config['experience_constant']
-
-    global experience_cache  # Access the global variable
+    # Cumulative experience for every level up to target_level, indexes line up with the levels
+    curve = get_current_level_curve()
+    curve.experience_for_level(target_level)
+    return curve.thresholds[:target_level+1]
 
-    if target_level < len(experience_cache):
-        # We have the data in cache, just return it
-        return experience_cache[:target_level+1]
-    
-    # We need to calculate more levels
-    for level in range(len(experience_cache), target_level+1):
-        experience_for_level = (level * (level ** experience_constant)) + 30
-        total_experience = experience_cache[-1] + experience_for_level
-        experience_cache.append(total_experience)
+def get_current_level_curve():
+    # Built from the config on first use, then rebuilt by the config subscription below when the constant changes
+    return current_level_curve() or get_level_curve(load_config()['experience_constant'])
 
-    return experience_cache
+subscribe_config(lambda config: get_level_curve(config['experience_constant']))
 
 async def adjust_roles(guild, new_level, member):
+    # Queue a sync of the member's level roles. Syncs for the same member are coalesced so only the latest
+    # level is applied, with at most one member edit. Returns the queued future (resolving to True if the roles
+    # were changed), or None if the roles already match.
+    started = perf_counter()
+    try:
+        ladder = get_role_ladder(guild)
+        if not ladder or ladder.role_diff(member, new_level) is None:
+            return None
+        ROLE_SYNCS_QUEUED.inc()
+        return ActionQueue.get_instance().enqueue(
+            ('member_edit', guild.id), lambda: sync_member_roles(guild, member, new_level), key=member.id, priority=PRIORITY_HIGH
+        )
+    finally:
+        ADJUST_ROLES_SECONDS.observe(perf_counter() - started)
+
+async def apply_roles(guild, new_level, member):
+    # adjust_roles, then wait until the queued member edit has been sent. Returns True if the roles were changed,
+    # raises if the edit failed.
+    queued = await adjust_roles(guild, new_level, member)
+    return bool(queued and await queued)
+
+def _report_role_sync(future, member):
+    # Done callback for role syncs nobody awaits
+    if not future.cancelled() and future.exception() is not None:
+        DebugLogger.get_instance().log(f"Failed to update the roles of member '{member.name}': {future.exception()}")
+
+async def sync_member_roles(guild, member, new_level):
+    # The diff is worked out again when the action runs, against the member's roles at that time
+    diff = get_role_ladder(guild).role_diff(member, new_level)
+    if diff is None:
+        return False
+
+    desired_roles, added, removed = diff
+    await member.edit(roles=desired_roles)
     debug_logger = DebugLogger.get_instance()
-    guild_data = load_guild_data(guild.id)
-
-    if 'level_roles' in guild_data:
-        level_roles = guild_data['level_roles']
-
-        # Iterate through all level roles 
-        for level_str, role_id in level_roles.items():
-            level = int(level_str)
-            role = discord.utils.get(guild.roles, id=role_id)
-
-            # If role not found or doesn't change, skip this iteration
-            if role is None or (role in member.roles and level <= new_level):
-                continue
-
-            # Add role if level is less or equal to new level
-            if level <= new_level and role not in member.roles:
-                await member.add_roles(role)
-                debug_logger.log(f"Added role '{role.name}' to member '{member.name}'")
-            # Remove role if level is above new level
-            elif level > new_level and role in member.roles:
-                await member.remove_roles(role)
-                debug_logger.log(f"Removed role '{role.name}' from member '{member.name}'")
-    else:
-        debug_logger.log(f"No 'level_roles' found in guild data for guild '{guild.name}'")
+    for role in added:
+        debug_logger.log(f"Added role '{role.name}' to member '{member.name}'")
+    for role in removed:
+        debug_logger.log(f"Removed role '{role.name}' from member '{member.name}'")
+    return True
 
 
 async def log_level_up(ctx, guild, member, new_level):
-    guild_data = load_guild_data(guild.id)
-
-    levelup_log_channel_id = guild_data.get('publog')
-    levelup_log_message_id = guild_data.get('levelup_log_message')
-    levelup_log_channel = ctx.get_channel(levelup_log_channel_id) if levelup_log_channel_id else None
-    levelup_log_message = None
-
-    if levelup_log_channel and levelup_log_message_id:
-        try:
-            levelup_log_message = await levelup_log_channel.fetch_message(levelup_log_message_id)
-        except discord.NotFound:
-            levelup_log_message_id = None  # Reset the message ID if the message was not found
-
     if member is not None:
         if new_level <= 5:  # Don't log for levels >1 and <=5
             return
@@ -407,17 +552,44 @@ async def log_level_up(ctx, guild, member, new_level):
 
         # If the levelup_log exists in guild_data, append the new level up text to the list
         # and slice the list to keep only the last x elements. If it does not exist, initialize it
-        guild_data.setdefault('levelup_log', [])
-        if guild_data['levelup_log'] and member_name in guild_data['levelup_log'][-1][1]:
-            # Update the last entry with the new level
-            guild_data['levelup_log'][-1] = (timestamp, new_levelup_text)
-        else:
-            # Add a new entry if the member is different or no recent log exists
-            guild_data['levelup_log'].append((timestamp, new_levelup_text))
-
-        guild_data['levelup_log'] = guild_data['levelup_log'][-6:]
-        save_guild_data(guild.id, guild_data)
+        def add_levelup_text(guild_data):
+            levelup_log = guild_data.get('levelup_log') or []
+            if levelup_log and member_name in levelup_log[-1][1]:
+                # Update the last entry with the new level
+                levelup_log[-1] = (timestamp, new_levelup_text)
+            else:
+                # Add a new entry if the member is different or no recent log exists
+                levelup_log.append((timestamp, new_levelup_text))
+            guild_data['levelup_log'] = levelup_log[-6:]
+
+        await asyncStorage.update_guild_data(guild.id, add_levelup_text)
+
+    levelup_log_channel_id = (await asyncStorage.load_guild_data(guild.id)).get('publog')
+    levelup_log_channel = guild.get_channel(levelup_log_channel_id) if levelup_log_channel_id else None
+    if levelup_log_channel:
+        # Queued and coalesced, a burst of level ups becomes a single edit showing the latest log
+        action_queue = ActionQueue.get_instance()
+        action_queue.enqueue(('channel', levelup_log_channel.id), lambda: publish_levelup_log(guild, levelup_log_channel), key='levelup_log')
+
+        if member is not None and new_level == 6:
+            embed = discord.Embed(
+                title=f"{member_name}, you have reached level 6!", 
+                description=f"{member.mention} Welcome to the reputation system! {get_celebration_emoji()} You gain reputation by participating in the server, and you're already level 6! We hope you enjoy your stay!", 
+                color=get_random_color(True)
+            )
+            action_queue.enqueue(('channel', levelup_log_channel.id), lambda: levelup_log_channel.send(embed=embed))
+    else:
+        print(f"Level up log channel not found for guild {guild.id} ({guild.name})")
+    
+    debug_logger = DebugLogger.get_instance()
+    if member is not None:
+        debug_logger.log(f"({guild.name}) {new_levelup_text}")
+    else:
+        debug_logger.log(f"({guild.name}) Startup message sent/updated.")
 
+async def publish_levelup_log(guild, levelup_log_channel):
+    # Render the level up log from the latest guild data and edit the existing message, or send a new one
+    guild_data = await asyncStorage.load_guild_data(guild.id)
     levelup_embed = discord.Embed(
         title="Reputation Level Up Log",
         color=get_random_color(True)
@@ -427,32 +599,17 @@ async def log_level_up(ctx, guild, member, new_level):
     check_rank_instructions = "You can check your current reputation by typing `/rep`. If you want to check someone else's rep, type `/rep @username`. You can also right click on any user and go to `Apps > Show Reputation`. Try it now! All chats in this channel are cleared every hour."
     levelup_embed.add_field(name='How to check your rank:', value=check_rank_instructions, inline=False)
 
-    for timestamp, log_text in guild_data['levelup_log']:
+    for timestamp, log_text in guild_data.get('levelup_log') or []:
         levelup_embed.add_field(name=timestamp + ' ' + log_text, value='\u200b', inline=False)
 
-    if levelup_log_message:  # If a message already exists, edit it
-        await levelup_log_message.edit(embed=levelup_embed)
-    else:  # If no message exists, send a new one and save its ID
-        if levelup_log_channel:
-            levelup_log_message = await levelup_log_channel.send(embed=levelup_embed)
-            guild_data['levelup_log_message'] = levelup_log_message.id
-            save_guild_data(guild.id, guild_data)
-        else:
-            print(f"Level up log channel not found for guild {guild.id} ({guild.name})")
+    levelup_log_message_id = guild_data.get('levelup_log_message')
+    if levelup_log_message_id:  # If a message already exists, edit it without fetching it first
+        try:
+            await levelup_log_channel.get_partial_message(levelup_log_message_id).edit(embed=levelup_embed)
+            return
+        except discord.NotFound:
+            pass  # The message was deleted, send a new one
 
-    if member is not None and new_level == 6:
-        embed = discord.Embed(
-            title=f"{member_name}, you have reached level 6!", 
-            description=f"{member.mention} Welcome to the reputation system! {get_celebration_emoji()} You gain reputation by participating in the server, and you're already level 6! We hope you enjoy your stay!", 
-            color=get_random_color(True)
-        )
-        if levelup_log_channel:
-            await levelup_log_channel.send(embed=embed)
-        else:
-            print(f"Level up log channel not found for guild {guild.id} ({guild.name})")
-    
-    debug_logger = DebugLogger.get_instance()
-    if member is not None:
-        debug_logger.log(f"({guild.name}) {new_levelup_text}")
-    else:
-        debug_logger.log(f"({guild.name}) Startup message sent/updated.")
\ No newline at end of file
+    levelup_log_message = await levelup_log_channel.send(embed=levelup_embed)
+    # guild_data may be stale after the send, only the message ID is written back
+    await asyncStorage.update_guild_data(guild.id, lambda guild_data: guild_data.update(levelup_log_message=levelup_log_message.id))
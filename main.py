@@ -1,18 +1,5 @@
-from util import verify_libraries_installed
-
-libraries = [
-    ("discord", "discord.py"),
-    ("asyncio", "asyncio"),
-    ("yaml", "PyYAML"),
-    ("asciichartpy", "asciichartpy"),
-    ("pandas", "pandas"),
-    ("pytz", "pytz"),
-    ("requests", "requests"),
-    ("pprint", "pprint"),
-    ("matplotlib", "matplotlib")
-]
-
-verify_libraries_installed(libraries)
+import time
+BOOT_STARTED = time.perf_counter()  # Taken before the heavy imports, see benchmarks/startup_time.py
 
 import asyncio
 import discord
@@ -22,24 +9,61 @@ from datetime import datetime, timedelta
 from discord.ext.commands import Greedy, Context
 from typing import Literal, Optional
 
+import io
+import os
 import pprint
+import renderService
 import _secrets
-from configManager import load_user_data, load_config, save_user_data, load_guild_data, save_guild_data, load_all_user_data
-from levelSystem import process_experience, generate_leaderboard, log_level_up, cumulative_experience_for_level, generate_leaderboard_image
-from util import get_initial_delay, get_random_color
+from configManager import load_config, load_guild_data, set_flush_handler
+import asyncStorage
+import xpJournal
+from levelSystem import process_experience, process_voice_tick, reconcile_guild, generate_leaderboard, leaderboard_fingerprint, log_level_up, cumulative_experience_for_level, generate_leaderboard_image
+from util import get_initial_delay, get_random_color, send_developer_message
 from debug_logger import DebugLogger
+from roleLadder import invalidate_role_ladder
 import auto_update_git
+import backupService
+import metrics
+import profiler
+from actionQueue import ActionQueue, PRIORITY_LOW
 
 debug = True
+boot_reported = False
+
+LEADERBOARD_WATCH_DEPTH = 20  # Minimum ranking positions watched for changes, widened to what the last render read
+_rendered_top_versions = {}  # Guild ID -> rank index top_version at the last leaderboard render
+_watch_depths = {}  # Guild ID -> ranking positions the last leaderboard render read
+_missing_leaderboard_channels = set()  # Guild IDs whose missing leaderboard channel was already reported
 
 intents = discord.Intents().all()
 bot = commands.Bot(command_prefix='!', intents=intents, reconnect=True)
-debug_logger = DebugLogger.get_instance(bot)
-config = load_config()
+debug_logger = None  # Set by setup()
+config = None
+
+def setup():
+    # Everything with side effects lives here rather than at module level: a process spawned by renderService
+    # imports this file as __mp_main__, and must not load data, replay the journal or register commands
+    global debug_logger, config
+    debug_logger = DebugLogger.get_instance(bot)
+    config = load_config()
+    set_flush_handler(asyncStorage.request_flush)  # Threshold flushes run on the storage threads
+    xpJournal.set_append_handler(asyncStorage.request_journal_append)
+    replayed = xpJournal.replay()  # Experience earned after the last snapshot, if the bot didn't shut down cleanly
+    if replayed:
+        print(f"Replayed {replayed} experience events from the journal")
+
+    # Import commands after 'bot' has been initialized
+    import commandsAdmin
+    import commandsUser
 
-# Import commands after 'bot' has been initialized
-import commandsAdmin
-import commandsUser
+@bot.event
+async def on_connect():
+    global boot_reported
+    if not boot_reported:
+        boot_reported = True
+        print(f"Connected to the gateway {time.perf_counter() - BOOT_STARTED:.2f}s after start")
+        if os.environ.get('EXIT_ON_CONNECT'):  # Used by benchmarks/startup_time.py
+            await bot.close()
 
 @bot.event
 async def on_ready():
@@ -52,18 +76,23 @@ async def on_ready():
     if debug:
         debug_logger.start()
 
-    debug_logger.log(f"Configuration: ```{pprint.pformat(config)}```")
-
-    check_version.start()
+    debug_logger.log(f"Configuration: ```{pprint.pformat(dict(config))}```")
 
     # Pre-calculate the experience for 100 levels so it can be referenced in memory later
     debug_logger.log(f"Pre-calculating experience for 100 levels...")
     cumulative_experience_for_level(100)
 
+    # Start tracking experience right away, the startup reconciliation below can take a while.
+    # on_ready runs again after a reconnect, so only start what isn't running yet.
+    for task in (check_version, flush_user_data_task, voice_activity_tracker, update_leaderboard_task, publish_leaderboard_task, write_metrics_task):
+        if not task.is_running():
+            task.start()
+    renderService.start()  # Warm up the leaderboard image worker
+
     # Load guild data for TLE
     guild = bot.get_guild(262726474967023619)
     if guild:
-        guild_data = load_guild_data(guild.id)
+        guild_data = await asyncStorage.load_guild_data(guild.id)
         # Remove 'levelup_log' from data for logging
         guild_data_for_logging = {k: v for k, v in guild_data.items() if k != 'levelup_log'}
         debug_logger.log(f"Guild {guild.name} data: ```{pprint.pformat(guild_data_for_logging)}```")
@@ -71,20 +100,12 @@ async def on_ready():
         # Update the level up log message
         await log_level_up(bot, guild, None, 0)
         
-        # Process initial experience/roles for each user data in the guild
+        # Fix stored levels and level roles that don't match the stored experience
         debug_logger.log(f"Processing initial experience/roles for guild {guild.name}...")
-        user_data_list = load_all_user_data(guild.id)
-        for user_id, user_data in user_data_list:
-            # Note: The user_id should be converted to an integer
-            member = guild.get_member(int(user_id))
-            if member:  # Make sure the member still exists in the guild
-                await process_experience(bot, guild, member, debug, 'on_ready')
+        await reconcile_guild(guild)
         debug_logger.log(f"Processing complete.")
     else:
         print("Bot is not in TLE!")
-
-    voice_activity_tracker.start()
-    update_leaderboard_task.start()
     
     await update_leaderboard()
 
@@ -95,8 +116,7 @@ async def voice_activity_tracker():
         debug_logger.log(f"Updating credits")
 
     for guild in bot.guilds:
-        for member in guild.members:
-            await process_experience(bot, guild, member, debug, 'voice_activity')
+        await process_voice_tick(bot, guild, debug)
 
     if debug:
         debug_logger.log(f"Credit update complete.")
@@ -108,6 +128,13 @@ async def before_voice_activity_tracker():
         print('Update credits scheduled for: {}'.format(initial_delay))
     await asyncio.sleep(initial_delay)
 
+@tasks.loop(minutes=5)
+async def flush_user_data_task():
+    # Snapshot the user records and compact the journal, experience in between is safe in the journal
+    flushed = await asyncStorage.flush_user_data()
+    if debug and flushed:
+        print(f"Flushed {flushed} user records to disk")
+
 @bot.event
 async def on_guild_join(guild):
     allowed_guild_id = 262726474967023619  # TLE
@@ -117,6 +144,14 @@ async def on_guild_join(guild):
     else:
         print(f"Joined the allowed guild {guild.name} ({guild.id}).")
 
+@bot.event
+async def on_guild_role_update(before, after):
+    invalidate_role_ladder(after.guild.id)
+
+@bot.event
+async def on_guild_role_delete(role):
+    invalidate_role_ladder(role.guild.id)
+
 @bot.event
 async def on_message(message):
     # Avoid responding to bot messages
@@ -127,25 +162,6 @@ async def on_message(message):
         await bot.process_commands(message)
         return
 
-    # Load or initialize user data
-    user_data = load_user_data(message.guild.id, message.author.id)
-
-    now = datetime.now()
-    
-    # Handle chat timestamp tracking
-    # Initialize 'chats_timestamps' if it doesn't exist
-    if 'chats_timestamps' not in user_data:
-        user_data['chats_timestamps'] = []
-
-    # Remove timestamps older than 3 minutes
-    user_data['chats_timestamps'] = [timestamp for timestamp in user_data['chats_timestamps'] if now - timestamp < timedelta(minutes=3)]
-
-    # Add new timestamp
-    user_data['chats_timestamps'].append(now)
-
-    # Save user data after updating it
-    save_user_data(message.guild.id, message.author.id, user_data)
-    # End chat timestamp tracking
     await process_experience(bot, message.guild, message.author, debug, 'chat', message)
 
     # Process commands after checking for spam and awarding points
@@ -156,45 +172,98 @@ async def update_leaderboard_task():
     await update_leaderboard()
 
 async def update_leaderboard():
+    # Purge the leaderboard channels and re-render every leaderboard, returns the futures of the queued edits
     debug_logger.log(f"Updating leaderboard...")
+    action_queue = ActionQueue.get_instance()
+    published = []
 
     for guild in bot.guilds:
-        guild_data = load_guild_data(guild.id)
-        leaderboard_channel_id = guild_data.get('leaderboard')
-        leaderboard_channel = bot.get_channel(leaderboard_channel_id) if leaderboard_channel_id else None
-
-        await clear_channel_except(guild.id, leaderboard_channel_id)
-
+        leaderboard_channel = get_leaderboard_channel(guild)
         if leaderboard_channel:
-            ascii_plot = await generate_leaderboard(bot, guild.id)
-
-            leaderboard_message_id = guild_data.get('leaderboard_message')
-            leaderboard_message = None
-
-            # Try to fetch the message, but handle the error if it doesn't exist
-            if leaderboard_message_id:
-                try:
-                    leaderboard_message = await leaderboard_channel.fetch_message(leaderboard_message_id)
-                except discord.errors.NotFound:
-                    leaderboard_message = None  # Reset to None if the message was not found
-                    
-            lb_embed = discord.Embed(
-                title="Reputation Leaderboard for The Last Echelon",
-                description=f"```{ascii_plot}```",
-                color=get_random_color(True)
-            )
-
-            if leaderboard_message:
-                #await leaderboard_message.edit(content='', embed=discord.Embed(description=f"```{ascii_plot}```"))  # Edit the old message
-                await leaderboard_message.edit(embed=lb_embed)  # Edit the old message
-            else:
-                leaderboard_message = await leaderboard_channel.send(embed=lb_embed)  # Send a new message
-                #leaderboard_message = await send_embed(leaderboard_channel, title="Leaderboard", description=f"```{ascii_plot}```", color=0x00ff00)
-
-            guild_data['leaderboard_message'] = leaderboard_message.id
-            save_guild_data(guild.id, guild_data)
+            action_queue.enqueue(('channel', leaderboard_channel.id), lambda guild_id=guild.id, channel=leaderboard_channel: clear_channel_except(guild_id, channel), key='purge', priority=PRIORITY_LOW)
+
+        published_future = await refresh_leaderboard(guild, leaderboard_channel, force=True)
+        if published_future:
+            published.append(published_future)
         debug_logger.log(f"Update complete.")
-        auto_update_git.backup_to_github()
+    backupService.start_backup()  # Runs in the background, reports its own duration and sizes
+    return published
+
+@tasks.loop(minutes=1)
+async def publish_leaderboard_task():
+    # Cheap enough to run every minute: nothing is rendered unless the top of the ranking moved,
+    # and nothing is sent unless the rendered leaderboard changed
+    for guild in bot.guilds:
+        await refresh_leaderboard(guild, get_leaderboard_channel(guild))
+
+@tasks.loop(minutes=1)
+async def write_metrics_task():
+    # Prometheus text dump in data/metrics.prom, rendered here and written on a storage thread
+    await asyncStorage.run_in_storage_thread(metrics.write, metrics.render())
+
+def get_leaderboard_channel(guild):
+    leaderboard_channel_id = load_guild_data(guild.id).get('leaderboard')
+    leaderboard_channel = bot.get_channel(leaderboard_channel_id) if leaderboard_channel_id else None
+    if not leaderboard_channel:
+        if guild.id not in _missing_leaderboard_channels:  # Reported once, not on every refresh
+            _missing_leaderboard_channels.add(guild.id)
+            print(f"Channel {leaderboard_channel_id} not found")
+    else:
+        _missing_leaderboard_channels.discard(guild.id)
+    return leaderboard_channel
+
+async def refresh_leaderboard(guild, leaderboard_channel, force=False):
+    # Render the leaderboard if the ranking positions it was built from changed (or if forced) and queue an edit
+    # if the result differs from what was last published. A forced refresh is always published, which also moves
+    # the board's timestamp forward. Returns the queued edit's future, or None if nothing was sent.
+    if not leaderboard_channel:
+        return None
+
+    rank_index = await asyncStorage.get_rank_index(guild.id)
+    rank_index.watch_top(_watch_depths.get(guild.id, LEADERBOARD_WATCH_DEPTH))
+    if not force and _rendered_top_versions.get(guild.id) == rank_index.top_version:
+        return None
+    _rendered_top_versions[guild.id] = rank_index.top_version
+
+    ascii_plot, depth = await generate_leaderboard(bot, guild.id, return_depth=True)
+    if depth > rank_index.top_size:
+        # The render read past the watched positions (skipped members, the next lower level), changes down there
+        # didn't count until now, so render again on the next refresh with the wider watch
+        _watch_depths[guild.id] = depth
+        rank_index.watch_top(depth)
+        _rendered_top_versions.pop(guild.id, None)
+    fingerprint = leaderboard_fingerprint(ascii_plot)
+    if not force and fingerprint == (await asyncStorage.load_guild_data(guild.id)).get('leaderboard_fingerprint'):
+        return None
+
+    lb_embed = discord.Embed(
+        title="Reputation Leaderboard for The Last Echelon",
+        description=f"```{ascii_plot}```",
+        color=get_random_color(True)
+    )
+    return ActionQueue.get_instance().enqueue(
+        ('channel', leaderboard_channel.id), lambda: publish_leaderboard(guild, leaderboard_channel, lb_embed, fingerprint), key='leaderboard'
+    )
+
+async def publish_leaderboard(guild, leaderboard_channel, lb_embed, fingerprint):
+    guild_data = await asyncStorage.load_guild_data(guild.id)
+    leaderboard_message_id = guild_data.get('leaderboard_message')
+
+    # Edit the old message without fetching it first, send a new one if it doesn't exist anymore
+    edited = False
+    if leaderboard_message_id:
+        try:
+            await leaderboard_channel.get_partial_message(leaderboard_message_id).edit(embed=lb_embed)
+            edited = True
+        except discord.errors.NotFound:
+            pass
+
+    published = {'leaderboard_fingerprint': fingerprint}
+    if not edited:
+        leaderboard_message = await leaderboard_channel.send(embed=lb_embed)  # Send a new message
+        published['leaderboard_message'] = leaderboard_message.id
+    # guild_data may be stale after the edit, only the published fields are written back
+    await asyncStorage.update_guild_data(guild.id, lambda guild_data: guild_data.update(published))
 
 @update_leaderboard_task.before_loop
 async def before_update_leaderboard_task():
@@ -203,14 +272,9 @@ async def before_update_leaderboard_task():
         print('Update leaderboard scheduled for: {}'.format(initial_delay))
     await asyncio.sleep(initial_delay)
 
-async def clear_channel_except(guild_id: int, channel_id: int):
+async def clear_channel_except(guild_id: int, channel):
     keep_message_ids = []
-    guild_data = load_guild_data(guild_id)
-    channel = bot.get_channel(channel_id)
-
-    if not channel:
-        print(f"Channel {channel_id} not found")
-        return
+    guild_data = await asyncStorage.load_guild_data(guild_id)
     
     keep_message_ids.append(guild_data.get('leaderboard_message'))
     keep_message_ids.append(guild_data.get('levelup_log_message'))
@@ -243,7 +307,7 @@ async def update_leaderboard_command(interaction: discord.Interaction):
     #     await interaction.followup.send(f"```{leaderboard}```")  # Send the full leaderboard as a response
 
     #else:  # If Default is chosen
-    await update_leaderboard()  # Update the leaderboard
+    await asyncio.gather(*await update_leaderboard())  # Update the leaderboard and wait for the edits to be sent
     await interaction.followup.send("Leaderboard has been updated!")  # Send a response after the leaderboard has been updated
 
 @bot.tree.command(
@@ -255,10 +319,10 @@ async def update_leaderboard_command(interaction: discord.Interaction):
 async def update_leaderboard_command(interaction: discord.Interaction):
     await interaction.response.defer()  # Acknowledge the command, but don't send a response yet
 
-    image_path = await generate_leaderboard_image(bot, interaction.guild_id, True)
+    image = await generate_leaderboard_image(bot, interaction.guild_id, True)
     embed = discord.Embed(title="Leaderboard")
     embed.set_image(url="attachment://leaderboard.png")
-    await interaction.followup.send(file=discord.File(image_path), embed=embed)
+    await interaction.followup.send(file=discord.File(io.BytesIO(image), filename='leaderboard.png'), embed=embed)
     
 #------ Sync Tree ------
 guild = discord.Object(id='262726474967023619')
@@ -297,13 +361,36 @@ async def sync(
 
     await ctx.send(f"Synced the tree to {ret}/{len(guilds)}.")
 
+#------ Profiler ------
+@bot.command()
+@commands.is_owner()
+async def profile(ctx: Context, seconds: int = 30, mode: Literal["cprofile", "sample"] = "cprofile") -> None:
+    # Profile the live bot and DM the report to the developer
+    if profiler.is_running():
+        await ctx.send("A profile is already being captured, try again when it's done.")
+        return
+    seconds = max(1, min(seconds, profiler.MAX_SECONDS))
+    await ctx.send(f"Profiling for {seconds}s ({mode}), the report will be sent to the developer.")
+    try:
+        result = await profiler.capture(seconds, mode)
+    except Exception as e:
+        debug_logger.log(f"Profile failed: {e}")
+        await ctx.send(f"Profile failed: {e}")
+        return
+    if result is None:
+        await ctx.send("A profile is already being captured, try again when it's done.")
+        return
+    report_file, summary = result
+    await send_developer_message(bot, f"Profile ({mode}, {seconds}s)", summary, discord.Color.blue(),
+                                 file=discord.File(report_file, filename=os.path.basename(report_file)))
+
 @tasks.loop(seconds=30)
 async def check_version():
     await auto_update_git.check_version(bot)
 
 @check_version.before_loop
 async def before_check_version():
-    auto_update_git.set_initial_run_sha()
+    await auto_update_git.set_initial_run_sha()
     await auto_update_git.check_version(bot) # Perform initial check
     initial_delay = get_initial_delay(interval=timedelta(seconds=30))
     print('Version Check loop scheduled for: {}'.format(initial_delay))
@@ -333,6 +420,9 @@ async def run_bot():
             print(f"An unexpected error occurred: {exc}")
             await bot.close()
             break
+        finally:
+            await asyncStorage.flush_user_data()  # Never lose buffered user records when the connection ends
 
 if __name__ == "__main__":
+    setup()
     asyncio.run(run_bot())
@@ -0,0 +1,184 @@
+"""
+In-process metrics: counters, gauges and fixed-bucket latency histograms.
+
+Metrics are created once (usually at module level) and recording is an attribute update, or a bisect into a short
+bucket list for histograms, so they can stay on in production. Everything is exposed in the Prometheus text format
+by render(), written to data/metrics.prom by write(), and summarized by the /botstats admin command.
+Counters and histograms are also updated from the storage threads, so updates and reads share one lock.
+
+Example usage:
+```
+import metrics
+LEVEL_UPS = metrics.counter('level_ups_total', 'Level ups issued')
+TICK_SECONDS = metrics.histogram('voice_tick_seconds', 'Duration of a voice tick')
+
+LEVEL_UPS.inc()
+started = perf_counter()
+...
+TICK_SECONDS.observe(perf_counter() - started)
+```
+"""
+import os
+from bisect import bisect_left
+from os import makedirs, path
+from threading import Lock
+
+METRICS_FILE = 'data/metrics.prom'
+# Upper bounds in seconds, from 10 microseconds (cache hits) to 10 seconds (REST calls under rate limits)
+LATENCY_BUCKETS = (0.00001, 0.00005, 0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 10)
+
+_metrics = {}  # (name, labels) -> metric, in creation order
+_help = {}  # name -> (type, help text)
+_lock = Lock()  # Held for every update and while the samples are read, so a metric is never seen half updated
+
+
+class Counter:
+    __slots__ = ('name', 'labels', 'value')
+
+    def __init__(self, name, labels):
+        self.name = name
+        self.labels = labels
+        self.value = 0
+
+    def inc(self, amount=1):
+        with _lock:
+            self.value += amount
+
+    def samples(self):
+        yield self.name, self.labels, self.value
+
+
+class Gauge:
+    """
+    A value that is set, or read from a function when the metrics are rendered.
+    """
+
+    __slots__ = ('name', 'labels', 'value', 'function')
+
+    def __init__(self, name, labels, function=None):
+        self.name = name
+        self.labels = labels
+        self.value = 0
+        self.function = function
+
+    def set(self, value):
+        self.value = value
+
+    def samples(self):
+        yield self.name, self.labels, self.function() if self.function else self.value
+
+
+class Histogram:
+    __slots__ = ('name', 'labels', 'buckets', 'counts', 'count', 'sum')
+
+    def __init__(self, name, labels, buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.labels = labels
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # The last count is for values above the largest bucket
+        self.count = 0
+        self.sum = 0
+
+    def observe(self, value):
+        bucket = bisect_left(self.buckets, value)
+        with _lock:
+            self.counts[bucket] += 1
+            self.count += 1
+            self.sum += value
+
+    def quantile(self, q):
+        # Upper bound of the bucket holding the q-th quantile, None without observations
+        with _lock:
+            total, counts = self.count, self.counts[:]
+        if not total:
+            return None
+        rank = q * total
+        seen = 0
+        for bound, count in zip(self.buckets, counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return float('inf')
+
+    def samples(self):
+        cumulative = 0
+        for bound, count in zip(self.buckets, self.counts):
+            cumulative += count
+            yield self.name + '_bucket', self.labels + (('le', repr(bound)),), cumulative
+        yield self.name + '_bucket', self.labels + (('le', '+Inf'),), self.count
+        yield self.name + '_sum', self.labels, self.sum
+        yield self.name + '_count', self.labels, self.count
+
+
+def _register(kind, metric_class, name, help_text, labels, **kwargs):
+    key = (name, tuple(sorted(labels.items())))
+    metric = _metrics.get(key)
+    if metric is None:
+        metric = _metrics[key] = metric_class(name, key[1], **kwargs)
+        _help.setdefault(name, (kind, help_text))
+    return metric
+
+def counter(name, help_text='', **labels):
+    return _register('counter', Counter, name, help_text, labels)
+
+def gauge(name, help_text='', function=None, **labels):
+    return _register('gauge', Gauge, name, help_text, labels, function=function)
+
+def histogram(name, help_text='', buckets=LATENCY_BUCKETS, **labels):
+    return _register('histogram', Histogram, name, help_text, labels, buckets=buckets)
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{key}="{value}"' for key, value in labels) + '}'
+
+def render():
+    # All metrics in the Prometheus text exposition format, the label sets of a metric are grouped together
+    families = {}
+    for (name, _), metric in _metrics.items():
+        families.setdefault(name, []).append(metric)
+    lines = []
+    for name, family in families.items():
+        kind, help_text = _help[name]
+        if help_text:
+            lines.append(f'# HELP {name} {help_text}')
+        lines.append(f'# TYPE {name} {kind}')
+        for metric in family:
+            with _lock:
+                samples = list(metric.samples())
+            for sample_name, labels, value in samples:
+                lines.append(f'{sample_name}{_format_labels(labels)} {value}')
+    return '\n'.join(lines) + '\n'
+
+def _format_seconds(value):
+    if value is None:
+        return '-'
+    if value == float('inf'):
+        return 'inf'
+    return f'{value * 1000:.2f}ms' if value < 1 else f'{value:.2f}s'
+
+def summary():
+    # One line per metric for humans: counters and gauges with their value, histograms with count and quantiles
+    lines = []
+    for (name, labels), metric in _metrics.items():
+        label_text = ' '.join(f'{value}' for _, value in labels)
+        title = f'{name} {label_text}'.rstrip()
+        if isinstance(metric, Histogram):
+            with _lock:
+                count, total = metric.count, metric.sum
+            if count:
+                average = total / count
+                lines.append(f'{title}: n={count} avg={_format_seconds(average)} '
+                             f'p50<={_format_seconds(metric.quantile(0.5))} p99<={_format_seconds(metric.quantile(0.99))}')
+        else:
+            with _lock:
+                _, _, value = next(metric.samples())
+            lines.append(f'{title}: {round(value, 3):,}')
+    return lines
+
+def write(text=None, metrics_file=METRICS_FILE):
+    # Atomically replace the metrics file, pass the rendered text to do the file work off the event loop
+    makedirs(path.dirname(metrics_file) or '.', exist_ok=True)
+    with open(metrics_file + '.tmp', 'w') as file:
+        file.write(render() if text is None else text)
+    os.replace(metrics_file + '.tmp', metrics_file)
@@ -0,0 +1,186 @@
+"""
+On-demand profiling of the live bot.
+
+capture() profiles the process for a number of seconds while the bot keeps running, then writes a text report
+with the top functions and the allocation sites that grew the most (tracemalloc) to data/profiles/.
+
+Two modes:
+    cprofile  deterministic profile of the event loop thread, exact call counts but some overhead on every call
+    sample    a background thread samples the stacks of every thread (storage workers included) every few
+              milliseconds, cheap but statistical
+
+Only one capture runs at a time. The event loop only waits on asyncio.sleep while profiling; the snapshots and the
+report are done on a worker thread.
+
+Example usage:
+```
+import profiler
+result = await profiler.capture(30, 'sample')
+if result is not None:
+    report_file, summary = result
+```
+"""
+import asyncio
+import cProfile
+import io
+import pstats
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+from datetime import datetime
+from os import makedirs, path
+
+PROFILE_FOLDER = 'data/profiles'
+MODES = ('cprofile', 'sample')
+MAX_SECONDS = 300
+SAMPLE_INTERVAL = 0.005  # Seconds between stack samples in sample mode
+TRACEMALLOC_FRAMES = 1  # Frames kept per allocation, one is enough to group by line and keeps the overhead low
+TOP_FUNCTIONS = 40
+TOP_ALLOCATIONS = 25
+
+_running = False
+
+
+class StackSampler:
+    """
+    Samples the stack of every other thread at a fixed interval. Counts the innermost frame of each sample per
+    thread (own time) and every distinct function on the stack (cumulative time).
+    """
+
+    def __init__(self, interval=SAMPLE_INTERVAL):
+        self.interval = interval
+        self.own = Counter()  # (thread name, function) -> samples
+        self.cumulative = Counter()  # function -> samples
+        self.ticks = 0
+        self.loop_thread = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self.loop_thread = threading.current_thread().name  # Started from the event loop
+        self._thread = threading.Thread(target=self._run, name='profiler-sampler', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        own_id = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            self.ticks += 1
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                self.own[(names.get(thread_id, thread_id), _describe(frame.f_code))] += 1
+                seen = set()
+                while frame is not None:
+                    function = _describe(frame.f_code)
+                    if function not in seen:
+                        seen.add(function)
+                        self.cumulative[function] += 1
+                    frame = frame.f_back
+
+    def write(self, stream, top=TOP_FUNCTIONS):
+        # Shares are of the sampling rounds, so each thread's own time adds up to 100%. Idle threads show the
+        # function they're blocked in.
+        ticks = max(self.ticks, 1)
+        stream.write(f"{self.ticks} rounds of samples every {self.interval * 1000:g}ms\n\nOwn time (innermost frame):\n")
+        for (thread_name, function), count in self.own.most_common(top):
+            stream.write(f"{count / ticks:7.1%}  {function}  [{thread_name}]\n")
+        stream.write("\nCumulative time (on the stack of any thread):\n")
+        for function, count in self.cumulative.most_common(top):
+            stream.write(f"{count / ticks:7.1%}  {function}\n")
+
+    def top(self, count):
+        # The busiest functions of the event loop thread
+        return [function for (thread_name, function), _ in self.own.most_common() if thread_name == self.loop_thread][:count]
+
+
+def _describe(code):
+    return f"{code.co_name} ({path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+def is_running():
+    return _running
+
+def _take_snapshot():
+    return tracemalloc.take_snapshot().filter_traces((
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+    ))
+
+def _write_report(report_file, header, profile, before, after):
+    # Blocking, run it on a worker thread. Returns the report's one line summary.
+    stream = io.StringIO()
+    stream.write(header + '\n\n')
+    if isinstance(profile, StackSampler):
+        profile.write(stream)
+        top = profile.top(3)
+    else:
+        stats = pstats.Stats(profile, stream=stream)
+        stream.write("Event loop thread, by cumulative time:\n")
+        stats.sort_stats('cumulative').print_stats(TOP_FUNCTIONS)
+        stream.write("Event loop thread, by own time:\n")
+        stats.sort_stats('tottime').print_stats(TOP_FUNCTIONS)
+        # stats.stats maps (file, line, function) -> (primitive calls, calls, own time, cumulative time, callers)
+        busiest = sorted(stats.stats.items(), key=lambda item: item[1][2], reverse=True)[:3]
+        top = [f"{function} ({path.basename(file)}:{line})" for (file, line, function), _ in busiest]
+
+    stream.write(f"\nAllocation growth by line (tracemalloc), top {TOP_ALLOCATIONS}:\n")
+    for stat in after.compare_to(before, 'lineno')[:TOP_ALLOCATIONS]:
+        stream.write(f"{stat}\n")
+    stream.write(f"\nLargest allocation sites at the end, top {TOP_ALLOCATIONS}:\n")
+    for stat in after.statistics('lineno')[:TOP_ALLOCATIONS]:
+        stream.write(f"{stat}\n")
+
+    makedirs(PROFILE_FOLDER, exist_ok=True)
+    with open(report_file, 'w') as file:
+        file.write(stream.getvalue())
+    return f"Busiest: {', '.join(top) or 'nothing recorded'}"
+
+async def capture(seconds, mode='cprofile'):
+    # Profile the running process for `seconds` (capped at MAX_SECONDS). Returns (report file, summary), or None if
+    # a capture is already running.
+    global _running
+    if _running:
+        return None
+    if mode not in MODES:
+        raise ValueError(f"Unknown profiler mode {mode!r}, expected one of {', '.join(MODES)}")
+    _running = True
+    loop = asyncio.get_running_loop()
+    started_tracing = not tracemalloc.is_tracing()
+    try:
+        seconds = max(1, min(seconds, MAX_SECONDS))
+        if started_tracing:
+            tracemalloc.start(TRACEMALLOC_FRAMES)
+        before = await loop.run_in_executor(None, _take_snapshot)
+
+        started = datetime.now()
+        wall_started = time.perf_counter()
+        if mode == 'sample':
+            profile = StackSampler()
+            profile.start()
+        else:
+            profile = cProfile.Profile()
+            profile.enable()  # Profiles the thread it's enabled on, the event loop's
+        try:
+            await asyncio.sleep(seconds)
+        finally:
+            if mode == 'sample':
+                profile.stop()
+            else:
+                profile.disable()
+        elapsed = time.perf_counter() - wall_started
+
+        after = await loop.run_in_executor(None, _take_snapshot)
+        report_file = path.join(PROFILE_FOLDER, f"profile_{started.strftime('%Y-%m-%d_%H-%M-%S')}_{mode}.txt")
+        header = f"Profile ({mode}) of {elapsed:.1f}s started {started.strftime('%Y-%m-%d %H:%M:%S')}"
+        summary = await loop.run_in_executor(None, _write_report, report_file, header, profile, before, after)
+        return report_file, summary
+    finally:
+        if started_tracing:
+            tracemalloc.stop()
+        _running = False
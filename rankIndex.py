@@ -0,0 +1,64 @@
+from bisect import bisect_left
+
+
+class RankIndex:
+    """
+    Keeps one guild's users sorted by experience so a user's rank is a binary search instead of a full sort.
+
+    Entries are stored as (-experience, user_id) so the list is in rank order, ties are broken by user ID.
+    """
+
+    def __init__(self, users=()):
+        # users is an iterable of (user_id, experience)
+        self.experience = {str(user_id): experience for user_id, experience in users}
+        self.keys = sorted((-experience, user_id) for user_id, experience in self.experience.items())
+        # Materialized top-N view: top_version changes whenever an update touches the first top_size positions
+        self.top_size = 0
+        self.top_version = 0
+
+    def watch_top(self, count):
+        self.top_size = max(self.top_size, count)
+
+    def __len__(self):
+        return len(self.keys)
+
+    def update(self, user_id, experience):
+        user_id = str(user_id)
+        old_experience = self.experience.get(user_id)
+        if old_experience == experience:
+            return
+        old_position = len(self.keys)
+        if old_experience is not None:
+            old_position = bisect_left(self.keys, (-old_experience, user_id))
+            del self.keys[old_position]
+        self.experience[user_id] = experience
+        new_position = bisect_left(self.keys, (-experience, user_id))
+        self.keys.insert(new_position, (-experience, user_id))
+        if min(old_position, new_position) < self.top_size:
+            self.top_version += 1
+
+    def remove(self, user_id):
+        user_id = str(user_id)
+        old_experience = self.experience.pop(user_id, None)
+        if old_experience is not None:
+            old_position = bisect_left(self.keys, (-old_experience, user_id))
+            del self.keys[old_position]
+            if old_position < self.top_size:
+                self.top_version += 1
+
+    def rank(self, user_id):
+        # 1-based rank, or None if the user isn't indexed
+        user_id = str(user_id)
+        experience = self.experience.get(user_id)
+        if experience is None:
+            return None
+        return bisect_left(self.keys, (-experience, user_id)) + 1
+
+    def user_at(self, position):
+        # User ID at a 0-based position in the ranking
+        return self.keys[position][1]
+
+    def top(self, count=None):
+        # User IDs in rank order
+        keys = self.keys if count is None else self.keys[:count]
+        return [user_id for _, user_id in keys]
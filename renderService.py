@@ -0,0 +1,86 @@
+import asyncio
+import hashlib
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from io import BytesIO
+
+# This module is imported by the render worker process, keep it free of discord and bot imports.
+# Where workers are spawned (Windows) they also import main.py as __mp_main__, which is why its setup is in setup().
+
+CACHE_SIZE = 16  # Number of rendered images kept, keyed by a hash of their input data
+
+_executor = None
+_cache = OrderedDict()
+
+
+def _init_worker():
+    # Runs once in the worker process so every render finds matplotlib already imported
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+    plt.style.use('dark_background')
+
+
+def _render_leaderboard_png(usernames, levels):
+    import matplotlib.pyplot as plt
+
+    # Create pyplot figure and axes, the dark_background style is applied by _init_worker
+    fig, ax = plt.subplots(figsize=(10, 6))
+    bars = ax.barh(usernames[::-1], levels[::-1], color='skyblue')  # Reverse to have the top player at the top
+
+    # Add value labels to each bar
+    for bar in bars:
+        width = bar.get_width()
+        ax.annotate(f'{width}',
+                    xy=(bar.get_width() + 0.2, bar.get_y() + bar.get_height() / 2),
+                    xytext=(3, 0),  # 3 points horizontal offset
+                    textcoords="offset points",
+                    ha='center', va='center', color='white')
+
+    # Customize the plot
+    ax.set_xlabel('Levels')
+    ax.set_title(f'Leaderboard by Level')
+    fig.tight_layout()
+
+    # Render to memory instead of a shared file
+    image = BytesIO()
+    fig.savefig(image, format='png')
+    plt.close(fig)
+    return image.getvalue()
+
+
+def start():
+    # Start the worker process and import matplotlib there ahead of the first render
+    global _executor
+    if _executor is None:
+        _executor = ProcessPoolExecutor(max_workers=1, initializer=_init_worker)
+        _executor.submit(int)
+    return _executor
+
+
+def _restart():
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
+
+
+async def render_leaderboard_image(usernames, levels):
+    # Returns the PNG bytes of a bar chart of the levels, rendered in the worker process
+    key = hashlib.sha1(repr((usernames, levels)).encode()).hexdigest()
+    image = _cache.get(key)
+    if image is not None:
+        _cache.move_to_end(key)
+        return image
+
+    try:
+        image = await asyncio.get_running_loop().run_in_executor(start(), _render_leaderboard_png, list(usernames), list(levels))
+    except BrokenProcessPool:
+        # The worker died (killed, out of memory), replace it and try once more
+        _restart()
+        image = await asyncio.get_running_loop().run_in_executor(start(), _render_leaderboard_png, list(usernames), list(levels))
+    _cache[key] = image
+    if len(_cache) > CACHE_SIZE:
+        _cache.popitem(last=False)
+    return image
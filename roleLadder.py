@@ -0,0 +1,58 @@
+from bisect import bisect_right
+from configManager import load_guild_data
+
+
+class RoleLadder:
+    """
+    A guild's level roles, sorted by level with the role objects already resolved.
+
+    A member is entitled to every role whose level is at or below their own, so the entitled roles are
+    always a prefix of the ladder and a single bisect finds it.
+    """
+
+    def __init__(self, guild, level_roles):
+        rungs = []
+        for level_str, role_id in (level_roles or {}).items():
+            role = guild.get_role(role_id)
+            if role is not None:  # Skip roles that have been deleted from the guild
+                rungs.append((int(level_str), role))
+        rungs.sort(key=lambda rung: rung[0])
+        self.levels = [level for level, _ in rungs]
+        self.roles = [role for _, role in rungs]
+        self.role_ids = {role.id for role in self.roles}
+
+    def __bool__(self):
+        return bool(self.roles)
+
+    def entitled_roles(self, level):
+        return self.roles[:bisect_right(self.levels, level)]
+
+    def role_diff(self, member, level):
+        # Returns (desired_roles, added, removed) for a member at the level, or None if their roles already match.
+        # Roles that aren't on the ladder are kept as they are.
+        entitled = self.entitled_roles(level)
+        entitled_ids = {role.id for role in entitled}
+        current_roles = [role for role in member.roles if not role.is_default()]
+        current_ids = {role.id for role in current_roles}
+
+        added = [role for role in entitled if role.id not in current_ids]
+        removed = [role for role in current_roles if role.id in self.role_ids and role.id not in entitled_ids]
+        if not added and not removed:
+            return None
+        desired_roles = [role for role in current_roles if role.id not in self.role_ids] + entitled
+        return desired_roles, added, removed
+
+
+_ladders = {}
+
+
+def get_role_ladder(guild):
+    ladder = _ladders.get(guild.id)
+    if ladder is None:
+        ladder = RoleLadder(guild, load_guild_data(guild.id).get('level_roles'))
+        _ladders[guild.id] = ladder
+    return ladder
+
+def invalidate_role_ladder(guild_id):
+    # Call whenever the guild's level roles or the roles themselves change
+    _ladders.pop(guild_id, None)
@@ -0,0 +1,251 @@
+import os
+import sqlite3
+import sys
+from os import makedirs, path, walk, listdir
+from threading import RLock
+from yaml import safe_load, safe_dump, YAMLError
+
+
+def write_yaml_atomic(file_path, data, fsync=False, keep_backup=True):
+    # Write to a temp file and rename it over the target, so a crash leaves either the old file or the new one.
+    # The previous version is kept as file_path.bak, the last good copy recover() restores from.
+    temp_path = file_path + '.tmp'
+    with open(temp_path, 'w') as file:
+        file.write(safe_dump(data))
+        if fsync:
+            file.flush()
+            os.fsync(file.fileno())
+    if keep_backup and path.exists(file_path):
+        os.replace(file_path, file_path + '.bak')
+    os.replace(temp_path, file_path)
+
+def load_yaml_file(file_path):
+    # Returns the parsed document, or None if the file is missing, empty or torn
+    try:
+        with open(file_path, 'r') as file:
+            data = safe_load(file)
+    except (OSError, YAMLError):
+        return None
+    return data if isinstance(data, dict) else None
+
+def fsync_directory(directory):
+    # Makes the renames in a directory durable, not supported on Windows
+    try:
+        descriptor = os.open(directory, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(descriptor)
+    finally:
+        os.close(descriptor)
+
+
+class YamlBackend:
+    """
+    The original storage layout: one YAML file per user and a guild_data.yaml per guild, under data/{guild_id}/.
+
+    Files are replaced atomically, see write_yaml_atomic. With fsync enabled a flush syncs all of its files
+    and then each touched directory once, rather than paying for a sync per rename.
+    """
+
+    def __init__(self, fsync=False):
+        self.fsync = fsync
+
+    def _load(self, file_path):
+        data = load_yaml_file(file_path)
+        if data is None and path.exists(file_path + '.bak'):
+            data = self._restore(file_path)
+        return data
+
+    def _restore(self, file_path):
+        # Put the last good copy back in place of a damaged or missing file
+        data = load_yaml_file(file_path + '.bak')
+        if data is not None:
+            write_yaml_atomic(file_path, data, self.fsync, keep_backup=False)  # Don't rotate the damaged file into .bak
+            print(f"Restored {file_path} from its last good copy")
+        return data
+
+    def load_user(self, guild_id, user_id):
+        # Returns None if the user has no record yet
+        return self._load(f'data/{guild_id}/{user_id}.yaml')
+
+    def load_users(self, guild_id):
+        # Walk the guild directory and load each user's data
+        users = {}
+        makedirs(f'data/{guild_id}', exist_ok=True)
+        for root, dirs, files in walk(f'data/{guild_id}'):
+            for file in files:
+                if file.endswith('.yaml') and file != 'guild_data.yaml':
+                    data = self._load(path.join(root, file))
+                    if data is not None:
+                        users[file.replace('.yaml', '')] = data
+        return users
+
+    def save_users(self, records):
+        # records is a list of (guild_id, user_id, data)
+        directories = set()
+        for guild_id, user_id, data in records:
+            makedirs(f'data/{guild_id}', exist_ok=True)
+            write_yaml_atomic(f'data/{guild_id}/{user_id}.yaml', data, self.fsync)
+            directories.add(f'data/{guild_id}')
+        if self.fsync:
+            for directory in directories:
+                fsync_directory(directory)
+
+    def load_guild(self, guild_id):
+        return self._load(f'data/{guild_id}/guild_data.yaml')
+
+    def save_guild(self, guild_id, data):
+        makedirs(f'data/{guild_id}', exist_ok=True)
+        write_yaml_atomic(f'data/{guild_id}/guild_data.yaml', data, self.fsync)
+        if self.fsync:
+            fsync_directory(f'data/{guild_id}')
+
+    def recover(self, data_folder='data'):
+        # Startup pass: drop temp files from interrupted writes and restore records that are missing or empty from
+        # their last good copy. Only file sizes are checked here, files that don't parse are restored by _load
+        # when they're first read. Returns the number of restored records.
+        restored = 0
+        if not path.isdir(data_folder):
+            return restored
+        for root, dirs, files in walk(data_folder):
+            for file in files:
+                file_path = path.join(root, file)
+                if file.endswith('.yaml.tmp'):
+                    os.remove(file_path)
+                elif file.endswith('.yaml.bak'):
+                    target = file_path[:-len('.bak')]
+                    if (not path.exists(target) or path.getsize(target) == 0) and self._restore(target) is not None:
+                        restored += 1
+        return restored
+
+
+class SqliteBackend:
+    """
+    Stores users and guild data in a single SQLite database running in WAL mode.
+
+    Experience and level are kept in indexed columns so rankings are a single query, the rest of the
+    record is stored as a YAML document so it round-trips exactly like the YAML backend (datetimes included).
+    On first use the existing per-user YAML tree under data/ is imported, see migrate_yaml_tree.
+    """
+
+    DATABASE_FILE = 'data/bot.db'
+
+    def __init__(self, database_file=None, auto_migrate=True, fsync=False):
+        self.database_file = database_file or self.DATABASE_FILE
+        makedirs(path.dirname(self.database_file) or '.', exist_ok=True)
+        self.lock = RLock()
+        self.connection = sqlite3.connect(self.database_file, check_same_thread=False)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        # Transactions are atomic either way, FULL also syncs the WAL on every commit
+        self.connection.execute('PRAGMA synchronous=FULL' if fsync else 'PRAGMA synchronous=NORMAL')
+        with self.connection:
+            self.connection.execute(
+                'CREATE TABLE IF NOT EXISTS users ('
+                'guild_id TEXT NOT NULL, user_id TEXT NOT NULL, experience REAL NOT NULL, level INTEGER NOT NULL, '
+                'data TEXT NOT NULL, PRIMARY KEY (guild_id, user_id))'
+            )
+            self.connection.execute('CREATE INDEX IF NOT EXISTS users_experience ON users (guild_id, experience DESC)')
+            self.connection.execute('CREATE INDEX IF NOT EXISTS users_level ON users (guild_id, level)')
+            self.connection.execute('CREATE TABLE IF NOT EXISTS guilds (guild_id TEXT PRIMARY KEY, data TEXT NOT NULL)')
+            self.connection.execute('CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)')
+
+        if auto_migrate and self.get_meta('yaml_migrated') is None:
+            imported_users, imported_guilds = self.migrate_yaml_tree()
+            print(f"Imported {imported_users} users and {imported_guilds} guilds from the YAML data tree")
+
+    def get_meta(self, key):
+        with self.lock:
+            row = self.connection.execute('SELECT value FROM meta WHERE key = ?', (key,)).fetchone()
+        return row[0] if row else None
+
+    def set_meta(self, key, value):
+        with self.lock, self.connection:
+            self.connection.execute('INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)', (key, value))
+
+    def load_user(self, guild_id, user_id):
+        with self.lock:
+            row = self.connection.execute(
+                'SELECT data FROM users WHERE guild_id = ? AND user_id = ?', (str(guild_id), str(user_id))
+            ).fetchone()
+        return safe_load(row[0]) if row else None
+
+    def load_users(self, guild_id):
+        with self.lock:
+            rows = self.connection.execute(
+                'SELECT user_id, data FROM users WHERE guild_id = ? ORDER BY experience DESC', (str(guild_id),)
+            ).fetchall()
+        return {user_id: safe_load(data) for user_id, data in rows}
+
+    def save_users(self, records, overwrite=True):
+        # All records are written in a single transaction, without overwrite existing users are left as they are
+        rows = [
+            (str(guild_id), str(user_id), data.get('experience', 0), data.get('level', 1), safe_dump(data))
+            for guild_id, user_id, data in records
+        ]
+        with self.lock, self.connection:
+            self.connection.executemany(
+                f"INSERT OR {'REPLACE' if overwrite else 'IGNORE'} INTO users (guild_id, user_id, experience, level, data) VALUES (?, ?, ?, ?, ?)", rows
+            )
+
+    def load_guild(self, guild_id):
+        with self.lock:
+            row = self.connection.execute('SELECT data FROM guilds WHERE guild_id = ?', (str(guild_id),)).fetchone()
+        return safe_load(row[0]) if row else None
+
+    def save_guild(self, guild_id, data, overwrite=True):
+        with self.lock, self.connection:
+            self.connection.execute(
+                f"INSERT OR {'REPLACE' if overwrite else 'IGNORE'} INTO guilds (guild_id, data) VALUES (?, ?)", (str(guild_id), safe_dump(data))
+            )
+
+    def recover(self):
+        # SQLite rolls back interrupted transactions by itself, this only reports damage it can't repair
+        with self.lock:
+            result = self.connection.execute('PRAGMA quick_check').fetchone()[0]
+        if result != 'ok':
+            print(f"{self.database_file} failed its integrity check: {result}")
+        return 0
+
+    def migrate_yaml_tree(self, data_folder='data', overwrite=False):
+        # One-shot import of data/{guild_id}/*.yaml. The YAML files are left in place as a fallback, but they stop
+        # being written once the database is in use, so by default only users and guilds missing from the database
+        # are imported. Returns the number of users and guilds read from the tree.
+        yaml_backend = YamlBackend()
+        imported_users = 0
+        imported_guilds = 0
+        if path.isdir(data_folder):
+            for guild_id in listdir(data_folder):
+                if not guild_id.isdigit() or not path.isdir(path.join(data_folder, guild_id)):
+                    continue
+                records = [(guild_id, user_id, data) for user_id, data in yaml_backend.load_users(guild_id).items() if data]
+                self.save_users(records, overwrite)
+                imported_users += len(records)
+                guild_data = yaml_backend.load_guild(guild_id)
+                if guild_data is not None:
+                    self.save_guild(guild_id, guild_data, overwrite)
+                    imported_guilds += 1
+        self.set_meta('yaml_migrated', '1')
+        return imported_users, imported_guilds
+
+
+def create_backend(name, fsync=False):
+    if name == 'sqlite':
+        return SqliteBackend(fsync=fsync)
+    if name == 'yaml':
+        return YamlBackend(fsync=fsync)
+    raise ValueError(f"Unknown storage backend: {name}")
+
+
+if __name__ == "__main__":
+    # python storageBackends.py [--force]: import the YAML tree into the SQLite database. Once the database is in
+    # use the YAML files are stale, so a second import is refused unless --force is given, which overwrites the
+    # database rows with the YAML values.
+    force = '--force' in sys.argv[1:]
+    backend = SqliteBackend(auto_migrate=False)
+    if backend.get_meta('yaml_migrated') is not None and not force:
+        print(f"The YAML tree was already imported into {backend.database_file} and may be older than the database. "
+              f"Run with --force to overwrite the database rows with the YAML values.")
+        sys.exit(1)
+    imported_users, imported_guilds = backend.migrate_yaml_tree(overwrite=force)
+    print(f"Imported {imported_users} users and {imported_guilds} guilds into {backend.database_file}")
@@ -0,0 +1,29 @@
+"""
+Shared setup for the unit tests. Run from the repository root with `python -m pytest -q`.
+
+The modules under test import _secrets for optional settings; when there is no _secrets.py (CI, a fresh clone) an
+empty one is provided so the defaults apply. Tests that touch data/ run in a temporary working directory.
+"""
+import os
+import sys
+import types
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+try:
+    import _secrets  # noqa: F401
+except ImportError:
+    _secrets = types.ModuleType('_secrets')
+    _secrets.DISCORD_TOKEN = ''
+    _secrets.DEVELOPER_ID = 0
+    _secrets.SERVER_TIMEZONE = 'UTC'
+    sys.modules['_secrets'] = _secrets
+
+
+@pytest.fixture
+def data_dir(tmp_path, monkeypatch):
+    # Run the test in an empty working directory, data/ paths are relative
+    monkeypatch.chdir(tmp_path)
+    return tmp_path
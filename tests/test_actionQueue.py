@@ -0,0 +1,118 @@
+import asyncio
+
+import pytest
+
+from actionQueue import ActionQueue, PRIORITY_HIGH, PRIORITY_LOW
+
+
+@pytest.fixture
+def action_queue(monkeypatch):
+    monkeypatch.setattr(ActionQueue, '_instance', None)
+    monkeypatch.setattr(ActionQueue, 'ROUTE_INTERVAL', 0)
+    return ActionQueue.get_instance()
+
+
+def recorder(calls, value):
+    async def action():
+        calls.append(value)
+        return value
+    return action
+
+
+def test_pending_actions_with_the_same_key_are_coalesced(action_queue):
+    calls = []
+
+    async def burst():
+        futures = [action_queue.enqueue('channel', recorder(calls, level), key='levelup_log') for level in range(10)]
+        return await asyncio.gather(*futures)
+
+    # Nothing runs until the loop yields, so only the latest action is sent and every caller gets its result
+    results = asyncio.run(burst())
+    assert calls == [9]
+    assert results == [9] * 10
+    assert action_queue.pending_count() == 0
+
+
+def test_an_action_coalesced_while_waiting_is_sent_after_the_running_one(action_queue):
+    calls = []
+
+    async def run():
+        first = action_queue.enqueue('channel', recorder(calls, 'first'), key='leaderboard')
+        await asyncio.sleep(0)  # The route starts the first action
+        for value in ('second', 'third'):
+            action_queue.enqueue('channel', recorder(calls, value), key='leaderboard')
+        await action_queue.drain()
+        return await first
+
+    assert asyncio.run(run()) == 'first'
+    assert calls == ['first', 'third']
+    assert action_queue.pending_count() == 0
+
+
+def test_actions_without_a_key_all_run_in_order(action_queue):
+    calls = []
+
+    async def run():
+        for value in range(5):
+            action_queue.enqueue('channel', recorder(calls, value))
+        await action_queue.drain()
+
+    asyncio.run(run())
+    assert calls == [0, 1, 2, 3, 4]
+
+
+def test_higher_priority_runs_first(action_queue):
+    calls = []
+
+    async def run():
+        action_queue.enqueue('guild', recorder(calls, 'purge'), priority=PRIORITY_LOW)
+        action_queue.enqueue('guild', recorder(calls, 'log'))
+        action_queue.enqueue('guild', recorder(calls, 'role'), priority=PRIORITY_HIGH)
+        await action_queue.drain()
+
+    asyncio.run(run())
+    assert calls == ['role', 'log', 'purge']
+
+
+def test_coalescing_can_raise_the_priority(action_queue):
+    calls = []
+
+    async def run():
+        action_queue.enqueue('guild', recorder(calls, 'log'))
+        action_queue.enqueue('guild', recorder(calls, 'sync'), key='member', priority=PRIORITY_LOW)
+        action_queue.enqueue('guild', recorder(calls, 'sync again'), key='member', priority=PRIORITY_HIGH)
+        await action_queue.drain()
+
+    asyncio.run(run())
+    assert calls == ['sync again', 'log']
+
+
+def test_routes_run_independently(action_queue, monkeypatch):
+    monkeypatch.setattr(ActionQueue, 'ROUTE_INTERVAL', 60)
+    calls = []
+
+    async def run():
+        action_queue.enqueue('a', recorder(calls, 'a'))
+        action_queue.enqueue('b', recorder(calls, 'b'))
+        await asyncio.wait_for(action_queue.drain(), timeout=5)  # A route's first action doesn't wait
+
+    asyncio.run(run())
+    assert sorted(calls) == ['a', 'b']
+
+
+def test_failures_raise_through_the_future(action_queue):
+    calls = []
+
+    async def fail():
+        raise RuntimeError('rate limited')
+
+    async def run():
+        failed = action_queue.enqueue('channel', fail)
+        action_queue.enqueue('channel', fail)  # Dropped, must not stop the route
+        after = action_queue.enqueue('channel', recorder(calls, 'after'))
+        with pytest.raises(RuntimeError):
+            await failed
+        return await after
+
+    assert asyncio.run(run()) == 'after'
+    assert calls == ['after']
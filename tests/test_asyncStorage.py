@@ -0,0 +1,64 @@
+import asyncio
+
+import pytest
+
+import asyncStorage
+import configManager
+from benchmarks.fakes import FakeGuild
+
+GUILD = 1
+
+
+@pytest.fixture
+def storage(data_dir, monkeypatch):
+    for name in ('_user_cache', '_guild_data_cache', '_rank_indexes'):
+        monkeypatch.setattr(configManager, name, {})
+    for name in ('_dirty_users', '_loaded_guilds'):
+        monkeypatch.setattr(configManager, name, set())
+    monkeypatch.setattr(configManager, '_backend', None)
+
+
+def stored_guild_data():
+    configManager._guild_data_cache.clear()
+    return configManager.load_guild_data(GUILD)
+
+
+def test_concurrent_guild_updates_are_all_kept(storage):
+    async def add(key):
+        def mutate(guild_data):
+            guild_data[key] = True
+        await asyncStorage.update_guild_data(GUILD, mutate)
+
+    async def run():
+        await asyncio.gather(*(add(f'key{index}') for index in range(20)))
+
+    asyncio.run(run())
+    guild_data = stored_guild_data()
+    assert all(guild_data[f'key{index}'] for index in range(20))
+
+
+def test_update_returns_the_mutator_result(storage):
+    result = asyncio.run(asyncStorage.update_guild_data(GUILD, lambda guild_data: guild_data.get('publog', 'unset')))
+    assert result is None  # New guilds start with every field set to None
+
+
+def test_publish_keeps_changes_saved_while_the_message_is_sent(storage, monkeypatch):
+    import levelSystem
+
+    guild = FakeGuild(GUILD)
+    channel = guild.add_text_channel('level-ups')
+    send = channel.send
+
+    async def slow_send(**kwargs):
+        # An admin changes the leaderboard channel and a level up is logged while the request is in flight
+        await asyncStorage.update_guild_data(GUILD, lambda guild_data: guild_data.update(leaderboard=1234))
+        await asyncStorage.update_guild_data(GUILD, lambda guild_data: guild_data.update(levelup_log=[('[now]', 'Someone is now level 7!')]))
+        return await send(**kwargs)
+
+    monkeypatch.setattr(channel, 'send', slow_send)
+    asyncio.run(levelSystem.publish_levelup_log(guild, channel))
+
+    guild_data = stored_guild_data()
+    assert guild_data['levelup_log_message'] in channel.messages
+    assert guild_data['leaderboard'] == 1234
+    assert guild_data['levelup_log'] == [['[now]', 'Someone is now level 7!']]
@@ -0,0 +1,152 @@
+import os
+import sqlite3
+from datetime import datetime, timedelta
+
+import pytest
+
+import backupService
+from backupService import SNAPSHOT_FORMAT, create_snapshot, restore_snapshot, snapshots_to_keep
+
+START = datetime(2026, 1, 10, 12, 0, 0)
+
+
+class Clock(datetime):
+    # Stands in for datetime in backupService so every snapshot gets its own name
+    current = START
+
+    @classmethod
+    def now(cls, tz=None):
+        cls.current += timedelta(hours=1)
+        return cls.current
+
+
+@pytest.fixture
+def folders(data_dir, monkeypatch):
+    Clock.current = START
+    monkeypatch.setattr(backupService, 'datetime', Clock)
+    source = data_dir / 'data'
+    (source / 'users' / '1').mkdir(parents=True)
+    (source / 'users' / '1' / '42.yaml').write_text('experience: 10\nlevel: 1\n')
+    (source / 'users' / '1' / '43.yaml').write_text('experience: 99\nlevel: 3\n')
+    (source / 'config.yaml').write_text('chat_limit: 5\n')
+    return str(source), str(data_dir / 'backup')
+
+
+def snapshot_file(backup, report):
+    return os.path.join(backup, 'snapshots', report.snapshot + '.json')
+
+
+def read_tree(folder):
+    files = {}
+    for root, _, names in os.walk(folder):
+        for name in names:
+            file_path = os.path.join(root, name)
+            with open(file_path, 'rb') as file:
+                files[os.path.relpath(file_path, folder)] = file.read()
+    return files
+
+
+def test_unchanged_files_are_not_read_again(folders):
+    source, backup = folders
+    first = create_snapshot(source, backup)
+    assert (first.files, first.changed_files) == (3, 3)
+
+    second = create_snapshot(source, backup)
+    assert (second.files, second.changed_files, second.bytes_read, second.bytes_written) == (3, 0, 0, 0)
+
+    with open(os.path.join(source, 'users', '1', '42.yaml'), 'w') as file:
+        file.write('experience: 20\nlevel: 1\n')
+    third = create_snapshot(source, backup)
+    assert third.changed_files == 1
+    assert third.bytes_read == len('experience: 20\nlevel: 1\n')
+
+
+def test_identical_content_is_stored_once(folders):
+    source, backup = folders
+    with open(os.path.join(source, 'users', '1', '44.yaml'), 'w') as file:
+        file.write('experience: 10\nlevel: 1\n')  # Same as 42.yaml
+    create_snapshot(source, backup)
+    objects = [name for _, _, names in os.walk(os.path.join(backup, 'objects')) for name in names]
+    assert len(objects) == 3
+
+
+def test_restore_reproduces_every_snapshot(folders, tmp_path):
+    source, backup = folders
+    first = create_snapshot(source, backup)
+    first_tree = read_tree(source)
+    os.remove(os.path.join(source, 'users', '1', '43.yaml'))
+    with open(os.path.join(source, 'config.yaml'), 'w') as file:
+        file.write('chat_limit: 8\n')
+    second = create_snapshot(source, backup)
+
+    assert restore_snapshot(snapshot_file(backup, first), str(tmp_path / 'first'), backup) == 3
+    assert read_tree(str(tmp_path / 'first')) == first_tree
+    assert restore_snapshot(snapshot_file(backup, second), str(tmp_path / 'second'), backup) == 2
+    assert read_tree(str(tmp_path / 'second')) == read_tree(source)
+
+
+def test_excluded_files(folders, tmp_path):
+    source, backup = folders
+    os.makedirs(os.path.join(source, 'profiles'))
+    for name in ('metrics.prom', 'debugconf.yaml', 'users/1/42.yaml.tmp', 'users/1/42.yaml.bak', 'profiles/profile.txt'):
+        with open(os.path.join(source, *name.split('/')), 'w') as file:
+            file.write('skip me')
+    report = create_snapshot(source, backup)
+    assert report.files == 3
+    restore_snapshot(snapshot_file(backup, report), str(tmp_path / 'restored'), backup)
+    assert sorted(read_tree(str(tmp_path / 'restored'))) == sorted(['config.yaml', os.path.join('users', '1', '42.yaml'), os.path.join('users', '1', '43.yaml')])
+
+
+def test_live_sqlite_database_is_copied_consistently(folders, tmp_path):
+    source, backup = folders
+    database = sqlite3.connect(os.path.join(source, 'storage.db'))
+    try:
+        database.execute('PRAGMA journal_mode=WAL')
+        database.execute('CREATE TABLE users (id TEXT PRIMARY KEY, experience REAL)')
+        database.executemany('INSERT INTO users VALUES (?, ?)', [(str(user_id), user_id * 1.5) for user_id in range(100)])
+        database.commit()  # Still in the WAL, the open connection keeps it from being checkpointed
+        assert os.path.exists(os.path.join(source, 'storage.db-wal'))
+
+        report = create_snapshot(source, backup)
+    finally:
+        database.close()
+
+    assert report.files == 4  # The -wal and -shm files are part of the database copy
+    restore_snapshot(snapshot_file(backup, report), str(tmp_path / 'restored'), backup)
+    restored = sqlite3.connect(str(tmp_path / 'restored' / 'storage.db'))
+    try:
+        assert restored.execute('SELECT COUNT(*), SUM(experience) FROM users').fetchone() == (100, sum(user_id * 1.5 for user_id in range(100)))
+    finally:
+        restored.close()
+
+
+def test_retention_keeps_recent_and_daily_snapshots():
+    now = datetime(2026, 3, 1, 0, 30)
+    names = [(now - timedelta(hours=hours)).strftime(SNAPSHOT_FORMAT) for hours in range(24 * 60)]  # Hourly, 60 days
+    keep = snapshots_to_keep(names, now)
+
+    newest = sorted(names, reverse=True)
+    recent, older = newest[:48], newest[48:]
+    assert set(recent) <= keep
+    daily = keep - set(recent)
+    days = {datetime.strptime(name, SNAPSHOT_FORMAT).date() for name in daily}
+    assert len(days) == len(daily) == 28  # Jan 31 to Feb 27, the days after the cutoff not covered by the recent ones
+    assert min(days) > (now - timedelta(days=30)).date()
+    for name in daily:  # The newest of its day among the older snapshots
+        day = datetime.strptime(name, SNAPSHOT_FORMAT).date()
+        assert name == max(other for other in older if datetime.strptime(other, SNAPSHOT_FORMAT).date() == day)
+
+
+def test_pruning_removes_objects_only_dropped_snapshots_used(folders, monkeypatch, tmp_path):
+    source, backup = folders
+    monkeypatch.setattr(backupService, 'KEEP_RECENT_SNAPSHOTS', 1)
+    monkeypatch.setattr(backupService, 'KEEP_DAILY_SNAPSHOTS', 0)
+    create_snapshot(source, backup)
+    with open(os.path.join(source, 'config.yaml'), 'w') as file:
+        file.write('chat_limit: 8\n')
+    report = create_snapshot(source, backup)
+
+    assert (report.pruned_snapshots, report.removed_objects) == (1, 1)  # Only the old config.yaml
+    assert os.listdir(os.path.join(backup, 'snapshots')) == [report.snapshot + '.json']
+    restore_snapshot(snapshot_file(backup, report), str(tmp_path / 'restored'), backup)
+    assert read_tree(str(tmp_path / 'restored')) == read_tree(source)
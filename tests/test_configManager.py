@@ -0,0 +1,64 @@
+import os
+
+import pytest
+
+import configManager
+
+
+@pytest.fixture
+def config_file(data_dir, monkeypatch):
+    monkeypatch.setattr(configManager, '_config', None)
+    monkeypatch.setattr(configManager, '_config_mtime', None)
+    monkeypatch.setattr(configManager, '_config_checked_at', 0)
+    monkeypatch.setattr(configManager, '_config_error', None)
+    monkeypatch.setattr(configManager, '_config_subscribers', [])
+    os.makedirs('data')
+    return configManager.CONFIG_FILE
+
+
+def write(config_file, text, mtime):
+    with open(config_file, 'w') as file:
+        file.write(text)
+    os.utime(config_file, (mtime, mtime))  # Distinct modification times without sleeping
+
+
+def test_missing_file_is_created_with_the_defaults(config_file):
+    config = configManager.reload_config()
+    assert config['chat_limit'] == 5
+    assert os.path.exists(config_file)
+    assert configManager.get_config_error() is None
+
+
+@pytest.mark.parametrize('broken', ['', 'chat_limit: [5\n', '- 1\n- 2\n', 'just a string\n'])
+def test_broken_file_keeps_the_last_good_config(config_file, broken, capsys):
+    write(config_file, 'chat_limit: 7\nexperience_constant: 1.5\n', 1000)
+    good = configManager.reload_config()
+    notified = []
+    configManager.subscribe_config(notified.append)
+
+    write(config_file, broken, 2000)
+    assert configManager.reload_config() is good
+    assert configManager.load_config() is good
+    assert configManager.get_config_error() is not None
+    assert notified == [good]  # Subscribers aren't told about a reload that didn't happen
+    assert configManager._config_mtime == 1000
+
+    # Checked again on every interval, but the error is only printed once
+    configManager._config_checked_at = 0
+    assert configManager.load_config() is good
+    assert capsys.readouterr().out.count('Could not read') == 1
+
+    write(config_file, 'chat_limit: 9\nexperience_constant: 1.5\n', 3000)
+    configManager._config_checked_at = 0
+    assert configManager.load_config()['chat_limit'] == 9
+    assert configManager.get_config_error() is None
+    assert len(notified) == 2
+
+
+def test_broken_file_at_startup_uses_the_defaults(config_file):
+    write(config_file, 'chat_limit: [5\n', 1000)
+    config = configManager.reload_config()
+    assert config['chat_limit'] == 5
+    assert configManager.get_config_error() is not None
+    with open(config_file) as file:
+        assert file.read() == 'chat_limit: [5\n'  # Left for the admin to fix
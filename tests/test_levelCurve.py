@@ -0,0 +1,56 @@
+import pytest
+
+import levelCurve
+from levelCurve import LevelCurve, get_level_curve
+
+EXPERIENCE_CONSTANT = 0.8
+
+
+def linear_scan_level(experience, experience_constant):
+    # The level lookup levelSystem used before the curve: walk the cumulative thresholds until one isn't reached
+    total = 0
+    level = 1
+    next_level = 1
+    while True:
+        total += next_level * (next_level ** experience_constant) + 30
+        if total > experience:
+            return level
+        level = next_level
+        next_level += 1
+
+
+@pytest.mark.parametrize('experience', [0, 0.5, 30, 30.99, 31, 31.01, 100, 1234.56, 10 ** 5, 10 ** 7])
+def test_level_for_matches_the_linear_scan(experience):
+    curve = LevelCurve(EXPERIENCE_CONSTANT, levels=4)  # Small table so the lookups have to extend it
+    assert curve.level_for(experience) == linear_scan_level(experience, EXPERIENCE_CONSTANT)
+
+
+def test_thresholds_are_exact_boundaries():
+    curve = LevelCurve(EXPERIENCE_CONSTANT)
+    for level in range(2, 50):
+        threshold = curve.experience_for_level(level)
+        assert curve.level_for(threshold) == level
+        assert curve.level_for(threshold - 0.01) == level - 1
+
+
+def test_levels_for_matches_level_for():
+    curve = LevelCurve(EXPERIENCE_CONSTANT, levels=4)
+    experiences = [0, 31, 500, 99999.5, 3, 10 ** 6]
+    assert [int(level) for level in curve.levels_for(experiences)] == [curve.level_for(e) for e in experiences]
+    assert list(curve.levels_for([])) == []
+
+
+def test_experience_for_level_extends_the_table():
+    curve = LevelCurve(EXPERIENCE_CONSTANT, levels=2)
+    assert curve.experience_for_level(0) == 0
+    assert curve.experience_for_level(1) == 31
+    assert curve.experience_for_level(300) == curve.thresholds[300]
+    assert len(curve.thresholds) == 301
+
+
+def test_shared_curve_is_rebuilt_when_the_constant_changes(monkeypatch):
+    monkeypatch.setattr(levelCurve, '_curve', None)
+    curve = get_level_curve(0.8)
+    assert get_level_curve(0.8) is curve
+    assert get_level_curve(0.9) is not curve
+    assert levelCurve.current_level_curve().experience_constant == 0.9
@@ -0,0 +1,68 @@
+from rankIndex import RankIndex
+
+
+def brute_force_ranking(experience):
+    return [user_id for user_id, _ in sorted(experience.items(), key=lambda item: (-item[1], item[0]))]
+
+
+def test_rank_matches_a_full_sort():
+    users = {str(user_id): (user_id * 37) % 101 for user_id in range(1, 60)}
+    index = RankIndex(users.items())
+    ranking = brute_force_ranking(users)
+    assert index.top() == ranking
+    for position, user_id in enumerate(ranking):
+        assert index.rank(user_id) == position + 1
+        assert index.user_at(position) == user_id
+
+
+def test_ties_are_broken_by_user_id():
+    index = RankIndex([('20', 5), ('10', 5), ('30', 7)])
+    assert index.top() == ['30', '10', '20']
+
+
+def test_update_moves_the_user():
+    users = {'1': 10, '2': 20, '3': 30}
+    index = RankIndex(users.items())
+    index.update(1, 40)  # Integer IDs are stored as strings
+    users['1'] = 40
+    index.update('4', 25)
+    users['4'] = 25
+    assert index.top() == brute_force_ranking(users)
+    assert index.rank('1') == 1
+    assert index.rank('4') == 3
+    assert len(index) == 4
+
+
+def test_remove():
+    index = RankIndex([('1', 10), ('2', 20)])
+    index.remove('2')
+    index.remove('missing')
+    assert index.top() == ['1']
+    assert index.rank('2') is None
+
+
+def test_top_version_only_changes_inside_the_watched_positions():
+    index = RankIndex((str(user_id), user_id * 10) for user_id in range(1, 11))
+    index.watch_top(3)
+    version = index.top_version
+
+    index.update('2', 25)  # Moves within positions 7-8
+    assert index.top_version == version
+    index.update('2', 25)  # No change at all
+    assert index.top_version == version
+
+    index.update('1', 95)  # Enters the top 3
+    assert index.top_version == version + 1
+    version = index.top_version
+
+    index.remove('3')  # Was near the bottom
+    assert index.top_version == version
+    index.remove('10')  # Was first
+    assert index.top_version == version + 1
+
+
+def test_watch_top_only_grows():
+    index = RankIndex()
+    index.watch_top(10)
+    index.watch_top(5)
+    assert index.top_size == 10
@@ -0,0 +1,70 @@
+from types import SimpleNamespace
+
+from roleLadder import RoleLadder
+
+
+class Role(SimpleNamespace):
+    def is_default(self):
+        return self.id == 0
+
+
+EVERYONE = Role(id=0, name='@everyone')
+BRONZE = Role(id=1, name='Bronze')
+SILVER = Role(id=2, name='Silver')
+GOLD = Role(id=3, name='Gold')
+MODERATOR = Role(id=9, name='Moderator')  # Not a level role
+
+
+def make_ladder(level_roles):
+    roles = {role.id: role for role in (BRONZE, SILVER, GOLD, MODERATOR)}
+    return RoleLadder(SimpleNamespace(get_role=roles.get), level_roles)
+
+
+def member(*roles):
+    return SimpleNamespace(roles=[EVERYONE, *roles])
+
+
+LADDER = {'10': 2, '1': 1, '25': 3}  # Keys are strings in the guild data, unsorted
+
+
+def ids(roles):
+    return [role.id for role in roles]
+
+
+def test_entitled_roles_are_a_prefix():
+    ladder = make_ladder(LADDER)
+    assert ladder.entitled_roles(0) == []
+    assert ladder.entitled_roles(1) == [BRONZE]
+    assert ladder.entitled_roles(24) == [BRONZE, SILVER]
+    assert ladder.entitled_roles(100) == [BRONZE, SILVER, GOLD]
+
+
+def test_no_diff_when_roles_match():
+    ladder = make_ladder(LADDER)
+    assert ladder.role_diff(member(BRONZE, SILVER, MODERATOR), 12) is None
+
+
+def test_level_up_adds_roles_and_keeps_other_roles():
+    desired, added, removed = make_ladder(LADDER).role_diff(member(MODERATOR, BRONZE), 30)
+    assert ids(added) == [2, 3]
+    assert removed == []
+    assert ids(desired) == [9, 1, 2, 3]  # The @everyone role is never part of the edit
+
+
+def test_level_down_removes_roles():
+    desired, added, removed = make_ladder(LADDER).role_diff(member(BRONZE, SILVER, GOLD, MODERATOR), 5)
+    assert added == []
+    assert ids(removed) == [2, 3]
+    assert ids(desired) == [9, 1]
+
+
+def test_deleted_roles_are_skipped():
+    ladder = make_ladder({'1': 1, '5': 404})
+    assert ladder.entitled_roles(10) == [BRONZE]
+    assert ladder.role_diff(member(BRONZE), 10) is None
+
+
+def test_empty_ladder_is_falsy():
+    assert not make_ladder(None)
+    assert not make_ladder({'3': 404})
+    assert make_ladder(LADDER)
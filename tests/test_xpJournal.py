@@ -0,0 +1,160 @@
+import gzip
+import os
+
+import pytest
+
+import configManager
+import xpHistory
+import xpJournal
+
+GUILD = '1'
+USER = '42'
+
+
+def restart(monkeypatch):
+    # Drop everything the process keeps in memory, only data/ survives
+    for name in ('_user_cache', '_guild_data_cache', '_rank_indexes'):
+        monkeypatch.setattr(configManager, name, {})
+    for name in ('_dirty_users', '_loaded_guilds'):
+        monkeypatch.setattr(configManager, name, set())
+    monkeypatch.setattr(configManager, '_backend', None)
+    for name in ('_histories', '_dirty_users', '_documents'):
+        monkeypatch.setattr(xpHistory, name, {})
+    monkeypatch.setattr(xpJournal, '_buffer', [])
+    monkeypatch.setattr(xpJournal, '_last_seq', 0)
+    monkeypatch.setattr(xpJournal, '_append_handler', lambda: None)  # Appended explicitly with append()
+
+
+@pytest.fixture
+def journal(data_dir, monkeypatch):
+    restart(monkeypatch)
+    return monkeypatch
+
+
+def grant(delta, source='chat'):
+    # What award_experience does: apply the change, journal it, save the record
+    user_data = configManager.load_user_data(GUILD, USER)
+    user_data['experience'] = round(user_data['experience'] + delta, 2)
+    xpJournal.record(GUILD, USER, user_data, delta, source)
+    configManager.save_user_data(GUILD, USER, user_data)
+
+
+def append():
+    xpJournal.append_buffer()
+
+
+def snapshot():
+    # The storage steps of asyncStorage.flush_user_data, in the same order
+    lines = xpJournal.take_buffer()
+    records = configManager.take_dirty_user_records()
+    segments = xpJournal.rotate(lines)
+    configManager.write_user_records(records)
+    xpJournal.archive(segments)
+
+
+def stored_experience():
+    return configManager.load_user_data(GUILD, USER)['experience']
+
+
+def test_replay_restores_events_after_a_crash(journal):
+    for delta in (10, 5, 2.5):
+        grant(delta)
+    append()  # Appended to the journal but never snapshotted
+
+    restart(journal)
+    assert stored_experience() == 0
+    assert xpJournal.replay() == 3
+    assert stored_experience() == 17.5
+    assert xpJournal.replay() == 0  # Idempotent
+
+
+def test_replay_only_applies_events_newer_than_the_snapshot(journal):
+    grant(10)
+    grant(20)
+    snapshot()
+    grant(5)
+    append()
+
+    restart(journal)
+    assert stored_experience() == 30
+    assert xpJournal.replay() == 1
+    assert stored_experience() == 35
+
+
+def test_crash_between_rotate_and_archive(journal):
+    grant(10)
+    lines = xpJournal.take_buffer()
+    records = configManager.take_dirty_user_records()
+    xpJournal.rotate(lines)
+    configManager.write_user_records(records)  # Crash before the segment is archived
+
+    restart(journal)
+    assert xpJournal.replay() == 0  # The segment's events are already in the snapshot
+    assert stored_experience() == 10
+    grant(1)
+    snapshot()  # Archives the leftover segment as well
+    assert not xpJournal._segments()
+    assert len(os.listdir(xpJournal.ARCHIVE_FOLDER)) == 2
+
+
+def test_clock_stepping_back_across_a_restart(journal):
+    journal.setattr(xpJournal.time, 'time_ns', lambda: 2_000_000_000_000_000_000)
+    grant(10)
+    grant(20)
+    snapshot()
+    grant(5)
+    append()
+
+    restart(journal)
+    journal.setattr(xpJournal.time, 'time_ns', lambda: 1_000_000_000_000_000_000)  # The clock stepped back
+    assert xpJournal.replay() == 1
+    grant(7)
+    grant(3)
+    append()
+    assert configManager.load_user_data(GUILD, USER)['journal_seq'] > 2_000_000_000_000_000_000
+
+    # Without the snapshot, the events recorded after the step back must replay on top of the earlier ones
+    restart(journal)
+    assert xpJournal.replay() == 3
+    assert stored_experience() == 45
+
+
+def test_sequence_stays_above_the_record_without_a_replay(journal):
+    journal.setattr(xpJournal.time, 'time_ns', lambda: 2_000_000_000_000_000_000)
+    grant(10)
+    snapshot()
+
+    restart(journal)
+    journal.setattr(xpJournal.time, 'time_ns', lambda: 1_000_000_000_000_000_000)
+    grant(5)
+    append()
+    restart(journal)
+    assert xpJournal.replay() == 1
+    assert stored_experience() == 15
+
+
+def test_torn_line_is_skipped(journal):
+    grant(10)
+    append()
+    with open(xpJournal.JOURNAL_FILE, 'a') as file:
+        file.write('123\t17000\t1\t42\t5')  # Cut off by a crash
+
+    restart(journal)
+    assert xpJournal.replay() == 1
+    assert stored_experience() == 10
+
+
+def test_history_reads_the_archive_and_the_live_journal(journal):
+    grant(10, 'chat')
+    snapshot()
+    grant(-4, 'adjust_rep')
+    append()
+    grant(1, 'voice_activity')  # Still buffered, not in the history yet
+
+    events = xpJournal.history(GUILD, USER)
+    assert [(delta, experience, source) for _, _, _, _, delta, experience, source, _ in events] == [
+        (10, 10, 'chat'), (-4, 6, 'adjust_rep'),
+    ]
+    archived = os.listdir(xpJournal.ARCHIVE_FOLDER)
+    with gzip.open(os.path.join(xpJournal.ARCHIVE_FOLDER, archived[0]), 'rt') as file:
+        assert len(file.readlines()) == 1
@@ -1,16 +1,5 @@
-import importlib
-import subprocess
-import sys
 import random
 
-def verify_libraries_installed(libraries):
-    for library in libraries:
-        try:
-            importlib.import_module(library[0])
-        except ImportError:
-            print(f"{library[0]} not installed. Installing...")
-            subprocess.call([sys.executable, "-m", "pip", "install", library[1]])
-
 import discord
 from datetime import time, timedelta, datetime
 import pytz
@@ -0,0 +1,166 @@
+import json
+import os
+import time
+from array import array
+from os import makedirs, path
+from threading import Lock
+
+# Per-user experience history, rolled up on write into fixed-size ring buffers: one slot per bucket, so a user's
+# whole history is a few small float arrays and reading a range never touches individual events.
+RESOLUTIONS = {
+    'minute': (60, 60),        # Bucket length in seconds, number of buckets kept (the last hour)
+    'hour': (3600, 24 * 7),    # The last week
+    'day': (86400, 90),        # The last 90 days
+}
+HISTORY_FOLDER = 'data/xp_history'  # One JSON file per guild: {user ID: {resolution: [last bucket, [values]]}}
+
+_histories = {}  # Guild ID -> {user ID -> UserHistory}, loaded from disk on the guild's first use
+_dirty_users = {}  # Guild ID -> IDs of the users changed since the last snapshot
+_documents = {}  # Guild ID -> the guild's file content as a dict, updated and written by write_snapshots
+_documents_lock = Lock()  # Guilds are loaded on the event loop thread, written on the storage threads
+
+
+class Series:
+    """
+    Ring buffer of experience per bucket. Slots skipped over since the last write are zeroed when it moves forward.
+    """
+
+    __slots__ = ('resolution', 'values', 'last_bucket')
+
+    def __init__(self, resolution, size):
+        self.resolution = resolution
+        self.values = array('f', bytes(4 * size))
+        self.last_bucket = 0
+
+    def add(self, timestamp, amount):
+        bucket = int(timestamp // self.resolution)
+        size = len(self.values)
+        if bucket > self.last_bucket:
+            for skipped in range(max(self.last_bucket + 1, bucket - size + 1), bucket + 1):
+                self.values[skipped % size] = 0
+            self.last_bucket = bucket
+        elif bucket <= self.last_bucket - size:
+            return  # Older than the retention
+        self.values[bucket % size] += amount
+
+    def copy_state(self):
+        return self.last_bucket, array('f', self.values)
+
+    @classmethod
+    def from_state(cls, resolution, size, last_bucket, values):
+        # Saved values are dropped if the number of buckets kept has changed since
+        series = cls(resolution, size)
+        if len(values) == size:
+            series.values = array('f', values)
+            series.last_bucket = last_bucket
+        return series
+
+    def recent(self, count, now=None):
+        # The last `count` buckets up to now, oldest first
+        bucket = int((now or time.time()) // self.resolution)
+        size = len(self.values)
+        return [
+            self.values[b % size] if self.last_bucket - size < b <= self.last_bucket else 0
+            for b in range(bucket - min(count, size) + 1, bucket + 1)
+        ]
+
+
+class UserHistory:
+    __slots__ = ('series',)
+
+    def __init__(self):
+        self.series = {name: Series(resolution, size) for name, (resolution, size) in RESOLUTIONS.items()}
+
+    def add(self, timestamp, amount):
+        for series in self.series.values():
+            series.add(timestamp, amount)
+
+    def recent(self, name, count, now=None):
+        return self.series[name].recent(count, now)
+
+    def copy_state(self):
+        return {name: series.copy_state() for name, series in self.series.items()}
+
+    @classmethod
+    def from_document(cls, document):
+        history = cls()
+        for name, (resolution, size) in RESOLUTIONS.items():
+            if name in document:
+                last_bucket, values = document[name]
+                history.series[name] = Series.from_state(resolution, size, last_bucket, values)
+        return history
+
+
+def _guild_histories(guild_id):
+    histories = _histories.get(str(guild_id))
+    if histories is None:
+        histories = _histories[str(guild_id)] = _load(guild_id)
+    return histories
+
+def _load(guild_id):
+    # A guild's file is small (a few KB per active user) and is read once per run
+    history_file = path.join(HISTORY_FOLDER, f'{guild_id}.json')
+    document, histories = _read(history_file) if path.exists(history_file) else ({}, {})
+    with _documents_lock:
+        _documents[str(guild_id)] = document
+    return histories
+
+def _read(history_file):
+    # Returns (document, histories)
+    try:
+        with open(history_file, 'r') as file:
+            document = json.load(file)
+        return document, {user_id: UserHistory.from_document(entry) for user_id, entry in document.items()}
+    except (OSError, ValueError, TypeError, AttributeError) as e:
+        # Keep the damaged file for inspection instead of overwriting it with the new history
+        os.replace(history_file, history_file + '.corrupt')
+        print(f"Could not read {history_file} ({e}), moved it to {history_file}.corrupt and started a new history")
+        return {}, {}
+
+def record(guild_id, user_id, amount, timestamp=None):
+    histories = _guild_histories(guild_id)
+    history = histories.get(str(user_id))
+    if history is None:
+        history = histories[str(user_id)] = UserHistory()
+    history.add(timestamp or time.time(), amount)
+    _dirty_users.setdefault(str(guild_id), set()).add(str(user_id))
+
+def get_history(guild_id, user_id):
+    # The user's UserHistory, or None if no experience was recorded for them
+    return _guild_histories(guild_id).get(str(user_id))
+
+def take_snapshots():
+    # Copies of the changed users' buffers as (guild_id, {user_id: state}), taken on the event loop thread.
+    # Copying an array is a memcpy, the serialization is left to write_snapshots on a storage thread.
+    snapshots = [
+        (guild_id, {user_id: _histories[guild_id][user_id].copy_state() for user_id in user_ids})
+        for guild_id, user_ids in _dirty_users.items()
+    ]
+    _dirty_users.clear()
+    return snapshots
+
+def write_snapshots(snapshots):
+    makedirs(HISTORY_FOLDER, exist_ok=True)
+    for guild_id, states in snapshots:
+        with _documents_lock:
+            document = _documents.setdefault(guild_id, {})
+            for user_id, state in states.items():
+                document[user_id] = {name: [last_bucket, [round(value, 2) for value in values]] for name, (last_bucket, values) in state.items()}
+            text = json.dumps(document, separators=(',', ':'))
+        history_file = path.join(HISTORY_FOLDER, f'{guild_id}.json')
+        with open(history_file + '.tmp', 'w') as file:
+            file.write(text)
+        os.replace(history_file + '.tmp', history_file)
+
+def restore_snapshots(snapshots):
+    # Mark the users of a failed write dirty again
+    for guild_id, states in snapshots:
+        _dirty_users.setdefault(guild_id, set()).update(states)
+
+def sparkline(values):
+    # One block character per value, scaled to the largest value
+    blocks = '▁▂▃▄▅▆▇█'
+    peak = max(values, default=0)
+    if peak <= 0:
+        return blocks[0] * len(values)
+    return ''.join(blocks[round(max(value, 0) / peak * (len(blocks) - 1))] for value in values)
@@ -0,0 +1,156 @@
+"""
+Append-only journal of experience changes.
+
+Every grant is recorded as one line (sequence number, time, guild, user, delta, resulting experience, source,
+modifier) in an in-memory buffer that is appended to data/xp_journal.log in one sequential write every
+APPEND_INTERVAL seconds. The user records themselves are only written on a flush, which is the snapshot: each flush
+rotates the journal into a segment, writes the dirty records and then moves the segments it covers into the
+gzipped archive under data/xp_journal/, which doubles as the audit trail for experience disputes.
+
+Each user record keeps the sequence number of the last event applied to it (journal_seq), so replaying the journal
+on startup is idempotent: only events newer than the snapshot are applied, whatever point a crash happened at.
+
+Look up a user's history from the command line:
+
+    python xpJournal.py <guild_id> <user_id>
+"""
+import glob
+import gzip
+import os
+import shutil
+import sys
+import time
+from os import makedirs, path
+from threading import Lock
+import configManager
+import metrics
+import xpHistory
+
+JOURNAL_FILE = 'data/xp_journal.log'
+ARCHIVE_FOLDER = 'data/xp_journal'
+APPEND_INTERVAL = 2  # Seconds a recorded event can wait in memory before it's appended
+APPEND_BATCH = 1000  # Append right away once this many events are buffered
+
+_buffer = []
+_last_seq = 0
+_file_lock = Lock()  # The journal is appended to and rotated from the storage threads
+
+metrics.gauge('xp_journal_pending_events', 'Journal events waiting to be appended', function=lambda: len(_buffer))
+
+
+def next_seq(floor=0):
+    # Nanosecond timestamps, kept above `floor` and every sequence number seen since start (replay() observes the
+    # journals and the archive) so a clock that steps back across a restart can't reuse numbers already stored
+    global _last_seq
+    _last_seq = max(_last_seq + 1, floor + 1, time.time_ns())
+    return _last_seq
+
+def observe_seq(seq):
+    global _last_seq
+    _last_seq = max(_last_seq, seq)
+
+def record(guild_id, user_id, user_data, delta, source, modifier=''):
+    # Journal a change that has already been applied to user_data, call it before the record is saved
+    seq = next_seq(user_data.get('journal_seq', 0))
+    user_data['journal_seq'] = seq
+    _buffer.append(f"{seq}\t{time.time():.0f}\t{guild_id}\t{user_id}\t{delta}\t{user_data['experience']}\t{source}\t{modifier}\n")
+    if len(_buffer) == 1 or len(_buffer) >= APPEND_BATCH:
+        _append_handler()
+
+def pending_count():
+    return len(_buffer)
+
+def take_buffer():
+    lines = _buffer[:]
+    _buffer.clear()
+    return lines
+
+def write_lines(lines):
+    if not lines:
+        return
+    makedirs(path.dirname(JOURNAL_FILE), exist_ok=True)
+    with _file_lock, open(JOURNAL_FILE, 'a') as file:
+        file.write(''.join(lines))
+
+def append_buffer():
+    write_lines(take_buffer())
+
+def set_append_handler(handler):
+    # Called when the first event is buffered and whenever APPEND_BATCH events are waiting
+    global _append_handler
+    _append_handler = handler
+
+_append_handler = append_buffer
+
+def rotate(lines):
+    # Append the last buffered events and close the journal into a segment. Returns every segment waiting for
+    # the archive, including ones left behind by a crash (their events were replayed into the records).
+    write_lines(lines)
+    with _file_lock:
+        if path.exists(JOURNAL_FILE):
+            os.replace(JOURNAL_FILE, f'{JOURNAL_FILE}.{next_seq()}')
+        return _segments()
+
+def _segments():
+    return sorted(glob.glob(f'{JOURNAL_FILE}.*'), key=_segment_seq)
+
+def _segment_seq(segment):
+    # Segments are named after the sequence number they were rotated at, archived ones have a .gz suffix as well
+    return int(path.basename(segment).removesuffix('.gz').rsplit('.', 1)[1])
+
+def archive(segments):
+    # Called once the snapshot covering the segments is written, moves them into the gzipped archive
+    makedirs(ARCHIVE_FOLDER, exist_ok=True)
+    for segment in segments:
+        archive_file = path.join(ARCHIVE_FOLDER, path.basename(segment) + '.gz')
+        with open(segment, 'rb') as source, gzip.open(archive_file, 'wb') as target:
+            shutil.copyfileobj(source, target)
+        os.remove(segment)
+
+def _parse(lines):
+    # Yields (seq, timestamp, guild_id, user_id, delta, experience, source, modifier), a line torn by a crash is skipped
+    for line in lines:
+        fields = line.rstrip('\n').split('\t')
+        if len(fields) != 8:
+            continue
+        try:
+            yield int(fields[0]), int(fields[1]), fields[2], fields[3], float(fields[4]), float(fields[5]), fields[6], fields[7]
+        except ValueError:
+            continue
+
+def replay():
+    # Apply the events the last snapshot doesn't include, run once at startup. Returns the number of events applied.
+    applied = 0
+    for segment in glob.glob(path.join(ARCHIVE_FOLDER, '*.gz')) + _segments():
+        observe_seq(_segment_seq(segment))
+    for journal in _segments() + [JOURNAL_FILE]:
+        if not path.exists(journal):
+            continue
+        with open(journal, 'r') as file:
+            for seq, timestamp, guild_id, user_id, delta, experience, _, _ in _parse(file):
+                observe_seq(seq)
+                user_data = configManager.load_user_data(guild_id, user_id)
+                if seq <= user_data.get('journal_seq', 0):
+                    continue
+                user_data['experience'] = experience  # Levels are fixed by the startup reconciliation
+                user_data['journal_seq'] = seq
+                configManager.save_user_data(guild_id, user_id, user_data)
+                xpHistory.record(guild_id, user_id, delta, timestamp)
+                applied += 1
+    return applied
+
+def history(guild_id, user_id):
+    # Every journaled event of a user, oldest first, from the archive and the live journal
+    journals = sorted(glob.glob(path.join(ARCHIVE_FOLDER, '*.gz'))) + _segments() + [JOURNAL_FILE]
+    events = []
+    for journal in journals:
+        if not path.exists(journal):
+            continue
+        with (gzip.open(journal, 'rt') if journal.endswith('.gz') else open(journal, 'r')) as file:
+            events.extend(event for event in _parse(file) if event[2] == str(guild_id) and event[3] == str(user_id))
+    return sorted(events)
+
+
+if __name__ == "__main__":
+    for seq, timestamp, _, _, delta, experience, source, modifier in history(sys.argv[1], sys.argv[2]):
+        print(f"{time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(timestamp))}  {delta:+10.2f}  {experience:12.2f}  {source} {modifier}")